@@ -1,18 +1,119 @@
-from flask import Flask, render_template, request, jsonify
-from emotion_model import analyze_sentiment
+import os
+import json
+import time
+from flask import Flask, Response, g, render_template, request, jsonify, stream_with_context
+from emotion_model import (
+    analysis_version, analyze_sentiment, analyze_sentiment_batch, analyze_sentiment_stream,
+    cache_stats, engine, lexicons, model_registry, model_score_many, use_scheduler,
+)
+from history_store import DAY, get_store, parse_time, record_request
+from inference_scheduler import MicroBatchScheduler
+from metrics import REGISTRY, begin_trace, cache_collector, end_trace, model_registry_collector
+from safe_logging import get_logger, text_fingerprint
 
 app = Flask(__name__)
+log = get_logger("app")
+
+# 併批推論：同時進來的請求收成一批再丟模型（BATCH_MAX_SIZE=1 等於關閉）
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "16"))
+BATCH_MAX_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS", "10"))
+# /analyze_batch 一次最多幾篇
+ANALYZE_BATCH_LIMIT = int(os.getenv("ANALYZE_BATCH_LIMIT", "64"))
+
+# 判定用不到模型（ANALYSIS_LABELER=lexicon_count）就不開 scheduler
+scheduler = None
+if BATCH_MAX_SIZE > 1 and engine.uses_model:
+    scheduler = MicroBatchScheduler(model_score_many, BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS)
+    use_scheduler(scheduler)
+
+# /metrics：render 時才讀的現值
+REGISTRY.add_collector(model_registry_collector(model_registry))
+REGISTRY.add_collector(cache_collector(cache_stats))
+
+def _scheduler_metrics():
+    if scheduler is None:
+        return
+    s = scheduler.stats()
+    yield "focusbridge_scheduler_queue_depth", "gauge", "Requests waiting for a micro-batch", {}, s["queue_depth"]
+    yield "focusbridge_scheduler_max_queue_depth", "gauge", "Highest queue depth seen", {}, s["max_queue_depth"]
+    yield "focusbridge_scheduler_batches_total", "counter", "Micro-batches run", {}, s["batches"]
+
+REGISTRY.add_collector(_scheduler_metrics)
+
+def _lexicon_metrics():
+    s = lexicons.stats()
+    yield "focusbridge_lexicon_info", "gauge", "Active lexicon version", {"name": s["name"], "version": s["version"]}, 1
+    yield "focusbridge_lexicon_reloads_total", "counter", "Lexicon hot reloads", {}, s["reloads"]
+
+REGISTRY.add_collector(_lexicon_metrics)
+
+# 每個請求的階段耗時：結束時寫一行結構化日誌（不含日記原文）並計入直方圖
+_UNTRACED = {"metrics", "healthz", "readyz", "static"}
+
+@app.before_request
+def _begin_trace():
+    if request.endpoint not in _UNTRACED:
+        g.trace = begin_trace(request.endpoint)
+
+@app.after_request
+def _record_status(response):
+    trace = g.get("trace")
+    if trace is not None:
+        trace.status = response.status_code
+    return response
+
+@app.teardown_request
+def _end_trace(exc):
+    trace = g.pop("trace", None)
+    if trace is not None:
+        if exc is not None:
+            trace.status = 500
+        # SSE 回應在 generator 跑完前就會結束追蹤，total 只到送出標頭為止
+        end_trace(trace)
 
 @app.route("/")
 def index():
     return render_template("index.html")
 
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def _record_history(body, label, keywords, topics, scores):
+    """有設定 HISTORY_DB 且請求帶 user_id 才記錄；寫入失敗不影響分析回應"""
+    try:
+        record_request(body, label, keywords, topics, analysis_version(), scores)
+    except Exception:
+        log.exception("❌ 分析歷史寫入失敗")
+
 @app.route("/analyze", methods=["POST"])
 def analyze():
-    text = request.json.get("text", "")
-    sentiment_label, message, keywords, topics = analyze_sentiment(text)
-    print(f"✅ 收到使用者日記：{text}")
+    body = request.json or {}
+    text = body.get("text", "")
+    if "trace" in g:
+        g.trace.note(text=text_fingerprint(text))
+
+    # 串流模式（Accept: text/event-stream）：分類結果先送，鼓勵語到了再送
+    if request.accept_mimetypes.best_match(["application/json", "text/event-stream"]) == "text/event-stream":
+        def events():
+            for kind, payload in analyze_sentiment_stream(text, with_scores=True):
+                if kind == "result":
+                    scores = payload.pop("scores", None)   # 只給分析歷史，不送給前端
+                    _record_history(body, payload["sentiment"], payload["keywords"], payload["topics"], scores)
+                    yield _sse("result", payload)
+                else:
+                    yield _sse("message", {"message": payload})
+            yield _sse("done", {})
 
+        return Response(
+            stream_with_context(events()),
+            mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    sentiment_label, message, keywords, topics, scores = analyze_sentiment(text, with_scores=True)
+    if "trace" in g:
+        g.trace.note(sentiment=sentiment_label)
+    _record_history(body, sentiment_label, keywords, topics, scores)
 
     return jsonify({
         "sentiment": sentiment_label,
@@ -21,5 +122,85 @@ def analyze():
         "message": message
     })
 
+@app.route("/analyze_batch", methods=["POST"])
+def analyze_batch():
+    texts = (request.json or {}).get("texts", [])
+    if not isinstance(texts, list) or not all(isinstance(t, str) for t in texts):
+        return jsonify({"error": "texts 必須是字串陣列"}), 400
+    if len(texts) > ANALYZE_BATCH_LIMIT:
+        return jsonify({"error": f"一次最多 {ANALYZE_BATCH_LIMIT} 篇"}), 400
+
+    results = analyze_sentiment_batch(texts)
+    return jsonify({
+        "results": [
+            {"sentiment": label, "keywords": keywords, "topics": topics, "message": message}
+            for label, message, keywords, topics in results
+        ]
+    })
+
+# 分析歷史查詢：start / end 可用 epoch 秒或 ISO 8601，預設最近 30 天
+def _history_window():
+    end = parse_time(request.args.get("end"), time.time())
+    start = parse_time(request.args.get("start"), end - 30 * DAY)
+    return start, end
+
+@app.route("/history/<user_id>/trend")
+def history_trend(user_id):
+    store = get_store()
+    if store is None:
+        return jsonify({"error": "未設定 HISTORY_DB"}), 404
+    try:
+        start, end = _history_window()
+        window = int(request.args.get("window", "7"))
+    except ValueError:
+        return jsonify({"error": "start / end / window 格式錯誤"}), 400
+    return jsonify({
+        "rolling_average": store.rolling_average(user_id, start, end, window),
+        "labels": store.label_distribution(user_id, start, end),
+    })
+
+@app.route("/history/<user_id>/keywords")
+def history_keywords(user_id):
+    store = get_store()
+    if store is None:
+        return jsonify({"error": "未設定 HISTORY_DB"}), 404
+    try:
+        start, end = _history_window()
+        limit = int(request.args.get("limit", "20"))
+    except ValueError:
+        return jsonify({"error": "start / end / limit 格式錯誤"}), 400
+    return jsonify({
+        "keywords": store.keyword_frequencies(user_id, start, end, limit),
+        "topics": store.term_frequencies(user_id, start, end, kind="topic", limit=limit),
+    })
+
+@app.route("/scheduler/stats")
+def scheduler_stats():
+    if scheduler is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **scheduler.stats()})
+
+@app.route("/healthz")
+def healthz():
+    return jsonify({"status": "ok"})
+
+@app.route("/readyz")
+def readyz():
+    # eager 模式：模型載入與暖身完成前回 503，負載平衡器先不要導流量進來
+    stats = model_registry.stats()
+    return jsonify(stats), (200 if stats["ready"] else 503)
+
+@app.route("/cache/stats")
+def cache_stats_view():
+    return jsonify(cache_stats())
+
+@app.route("/lexicon/stats")
+def lexicon_stats_view():
+    return jsonify(lexicons.stats())
+
+@app.route("/metrics")
+def metrics():
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
 if __name__ == "__main__":
-    app.run(debug=True)
\ No newline at end of file
+    app.run(debug=True, threaded=True)
\ No newline at end of file
@@ -0,0 +1,372 @@
+"""
+ASGI 版服務入口：與 app.py 相同的 /analyze 契約（JSON 與 SSE），改成 async 處理
+
+啟動（在 ai_test_done/ 目錄下）：
+    uvicorn asgi:app --host 0.0.0.0 --port 8000 --timeout-graceful-shutdown 30
+    gunicorn -k uvicorn.workers.UvicornWorker -w 4 asgi:app      # 多行程
+
+環境變數：
+    ASGI_WORKERS         模型/斷詞用的執行緒數（預設 4）；event loop 本身不跑任何阻塞工作
+    ASGI_MAX_QUEUE       執行緒都在忙時最多再排幾個請求（預設 32）；超過就回 503 + Retry-After
+    ASGI_DRAIN_TIMEOUT   關機時最多等在途請求幾秒（預設 30）
+    ASGI_DRAIN_GRACE     收到 SIGTERM 後先排空幾秒才讓 uvicorn 關掉 listener（預設 5；0 = 立刻關）
+    ASGI_GEMINI_CONCURRENCY  /analyze_batch 同時 await 幾篇 Gemini 鼓勵語（預設 8）
+    BATCH_MAX_SIZE / BATCH_MAX_WAIT_MS / ANALYZE_BATCH_LIMIT 與 app.py 相同
+
+作法：
+- 模型推論與 jieba 斷詞丟進有界的 ThreadPoolExecutor；有 micro-batch scheduler 時直接 await
+  它的 Future，不必為了等待佔一條執行緒
+- Gemini 用 gemini_client.agenerate（await，不佔執行緒），逾時照樣退回預設鼓勵語；
+  /analyze_batch 的鼓勵語也在 event loop 上以有界並行 await，不在執行緒裡逐篇同步等
+- 背壓：在途請求（執行中 + 排隊）超過 ASGI_WORKERS + ASGI_MAX_QUEUE 就立刻拒絕，
+  不讓佇列無限長、每個人都等到逾時。爆量時被接受的請求延遲上限約為
+  「佇列長度 / 執行緒數 × 平均處理時間」，被拒絕的請求依 Retry-After 稍後重送
+- 優雅關機：收到 SIGTERM 當下（listener 還開著）/readyz 就改回 503、新請求一律 503，
+  讓負載平衡器有 ASGI_DRAIN_GRACE 秒把流量移走；之後 uvicorn 才停止 listen，lifespan 再等
+  在途請求（含 SSE 串流）做完或 ASGI_DRAIN_TIMEOUT 到期，關執行緒池、scheduler 與 Gemini 連線池
+
+壓測：python ../benchmark.py load --url http://127.0.0.1:8000/analyze --concurrency 1 16 64
+"""
+import asyncio
+import json
+import math
+import os
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+from starlette.applications import Starlette
+from starlette.background import BackgroundTask
+from starlette.requests import Request
+from starlette.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+from emotion_model import (
+    analysis_version, analyze_sentiment_async, analyze_sentiment_batch_async, analyze_sentiment_stream_async,
+    cache_stats, engine, gemini_client, lexicons, model_registry, model_score_many, use_scheduler,
+)
+from history_store import record_request
+from inference_scheduler import MicroBatchScheduler
+from metrics import REGISTRY, begin_trace, cache_collector, end_trace, model_registry_collector
+from safe_logging import get_logger, text_fingerprint
+
+log = get_logger("asgi")
+
+ASGI_WORKERS = int(os.getenv("ASGI_WORKERS", "4"))
+ASGI_MAX_QUEUE = int(os.getenv("ASGI_MAX_QUEUE", "32"))
+ASGI_DRAIN_TIMEOUT = float(os.getenv("ASGI_DRAIN_TIMEOUT", "30"))
+ASGI_DRAIN_GRACE = float(os.getenv("ASGI_DRAIN_GRACE", "5"))
+ASGI_GEMINI_CONCURRENCY = int(os.getenv("ASGI_GEMINI_CONCURRENCY", "8"))
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "16"))
+BATCH_MAX_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS", "10"))
+ANALYZE_BATCH_LIMIT = int(os.getenv("ANALYZE_BATCH_LIMIT", "64"))
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+
+
+class AdmissionGate:
+    """
+    在途請求上限 + 關機排空；只在 event loop 執行緒裡使用，不需要鎖
+    Retry-After 以最近請求的平均處理時間（EWMA）估算目前在途的量要多久才消化得完
+    """
+
+    def __init__(self, workers: int, max_queue: int):
+        self.workers = max(1, workers)
+        self.capacity = self.workers + max(0, max_queue)
+        self.inflight = 0
+        self.max_inflight = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.draining = False
+        self._avg_seconds = 0.1
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    def try_enter(self) -> bool:
+        if self.draining or self.inflight >= self.capacity:
+            self.rejected += 1
+            return False
+        self.inflight += 1
+        self.admitted += 1
+        self.max_inflight = max(self.max_inflight, self.inflight)
+        self._idle.clear()
+        return True
+
+    def leave(self, seconds: float) -> None:
+        self.inflight -= 1
+        self._avg_seconds = 0.9 * self._avg_seconds + 0.1 * seconds
+        if self.inflight == 0:
+            self._idle.set()
+
+    def retry_after(self) -> int:
+        return max(1, min(30, math.ceil(self._avg_seconds * self.inflight / self.workers)))
+
+    async def drain(self, timeout: float) -> bool:
+        """停止收件並等在途請求做完；逾時回 False"""
+        self.draining = True
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def stats(self) -> dict:
+        return {
+            "inflight": self.inflight, "max_inflight": self.max_inflight, "capacity": self.capacity,
+            "admitted": self.admitted, "rejected": self.rejected, "draining": self.draining,
+            "avg_seconds": self._avg_seconds,
+        }
+
+
+executor = ThreadPoolExecutor(max_workers=max(1, ASGI_WORKERS), thread_name_prefix="analyze")
+gate = AdmissionGate(ASGI_WORKERS, ASGI_MAX_QUEUE)
+
+# 判定用不到模型（ANALYSIS_LABELER=lexicon_count）就不開 scheduler
+scheduler = None
+if BATCH_MAX_SIZE > 1 and engine.uses_model:
+    scheduler = MicroBatchScheduler(model_score_many, BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS)
+    use_scheduler(scheduler)
+
+# /metrics：與 app.py 相同的現值，另加背壓狀態
+REGISTRY.add_collector(model_registry_collector(model_registry))
+REGISTRY.add_collector(cache_collector(cache_stats))
+
+
+def _gate_metrics():
+    s = gate.stats()
+    yield "focusbridge_asgi_inflight", "gauge", "Requests running or queued", {}, s["inflight"]
+    yield "focusbridge_asgi_capacity", "gauge", "Admission limit (workers + queue)", {}, s["capacity"]
+    yield "focusbridge_asgi_rejected_total", "counter", "Requests rejected with 503", {}, s["rejected"]
+
+
+REGISTRY.add_collector(_gate_metrics)
+
+
+def _overloaded() -> JSONResponse:
+    reason = "服務正在關閉" if gate.draining else "目前請求過多，請稍後再試"
+    return JSONResponse({"error": reason}, status_code=503,
+                        headers={"Retry-After": str(gate.retry_after())})
+
+
+async def _record_history(body, label, keywords, topics, scores) -> None:
+    """SQLite 寫入也丟進執行緒池；失敗不影響分析回應"""
+    try:
+        await asyncio.get_running_loop().run_in_executor(
+            executor, record_request, body, label, keywords, topics, analysis_version(), scores)
+    except Exception:
+        log.exception("❌ 分析歷史寫入失敗")
+
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+# ───────────────────────────────────────────────────────────────
+# 路由
+# ───────────────────────────────────────────────────────────────
+async def analyze(request: Request):
+    if not gate.try_enter():
+        return _overloaded()
+    started = time.perf_counter()
+    try:
+        body = await request.json()
+        if not isinstance(body, dict):
+            raise ValueError
+    except ValueError:
+        gate.leave(time.perf_counter() - started)
+        return JSONResponse({"error": "請送 JSON 物件"}, status_code=400)
+    text = body.get("text", "")
+
+    if "text/event-stream" in request.headers.get("accept", ""):
+        released = False
+
+        def release():
+            # generator 的 finally 與 background 都會呼叫：連線在開始串流前就斷掉時 generator 不會被執行
+            nonlocal released
+            if not released:
+                released = True
+                gate.leave(time.perf_counter() - started)
+
+        async def events():
+            # 串流的追蹤與背壓計數都在 generator 裡開始與結束：total 涵蓋到最後一個事件送出
+            trace = begin_trace("analyze")
+            trace.note(text=text_fingerprint(text), stream=True)
+            trace.status = 200
+            try:
+                async for kind, payload in analyze_sentiment_stream_async(text, executor, with_scores=True):
+                    if kind == "result":
+                        scores = payload.pop("scores", None)   # 只給分析歷史，不送給前端
+                        await _record_history(body, payload["sentiment"], payload["keywords"], payload["topics"],
+                                              scores)
+                        yield _sse("result", payload)
+                    else:
+                        yield _sse("message", {"message": payload})
+                yield _sse("done", {})
+            finally:
+                end_trace(trace)
+                release()
+
+        return StreamingResponse(
+            events(), media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+            background=BackgroundTask(release),
+        )
+
+    trace = begin_trace("analyze")
+    trace.note(text=text_fingerprint(text))
+    try:
+        label, message, keywords, topics, scores = await analyze_sentiment_async(text, executor, with_scores=True)
+        trace.note(sentiment=label)
+        await _record_history(body, label, keywords, topics, scores)
+        trace.status = 200
+        return JSONResponse({"sentiment": label, "keywords": keywords, "topics": topics, "message": message})
+    except BaseException:
+        trace.status = 500
+        raise
+    finally:
+        end_trace(trace)
+        gate.leave(time.perf_counter() - started)
+
+
+async def analyze_batch(request: Request):
+    try:
+        texts = (await request.json() or {}).get("texts", [])
+    except (ValueError, AttributeError):
+        texts = None
+    if not isinstance(texts, list) or not all(isinstance(t, str) for t in texts):
+        return JSONResponse({"error": "texts 必須是字串陣列"}, status_code=400)
+    if len(texts) > ANALYZE_BATCH_LIMIT:
+        return JSONResponse({"error": f"一次最多 {ANALYZE_BATCH_LIMIT} 篇"}, status_code=400)
+    if not gate.try_enter():
+        return _overloaded()
+
+    started = time.perf_counter()
+    trace = begin_trace("analyze_batch")
+    trace.note(texts=len(texts))
+    try:
+        # 分類在一條執行緒上整批跑完（只佔一個名額），鼓勵語在 event loop 上有界並行 await
+        results = await analyze_sentiment_batch_async(texts, executor, ASGI_GEMINI_CONCURRENCY)
+        trace.status = 200
+    except BaseException:
+        trace.status = 500
+        raise
+    finally:
+        end_trace(trace)
+        gate.leave(time.perf_counter() - started)
+    return JSONResponse({
+        "results": [
+            {"sentiment": label, "keywords": keywords, "topics": topics, "message": message}
+            for label, message, keywords, topics in results
+        ]
+    })
+
+
+async def index(request: Request):
+    return FileResponse(os.path.join(TEMPLATE_DIR, "index.html"))
+
+
+async def healthz(request: Request):
+    return JSONResponse({"status": "ok"})
+
+
+async def readyz(request: Request):
+    # 模型還沒暖好、或正在排空關機：負載平衡器先不要導流量進來
+    stats = dict(model_registry.stats(), draining=gate.draining)
+    return JSONResponse(stats, status_code=200 if stats["ready"] and not gate.draining else 503)
+
+
+async def gate_stats(request: Request):
+    return JSONResponse(gate.stats())
+
+
+async def scheduler_stats(request: Request):
+    if scheduler is None:
+        return JSONResponse({"enabled": False})
+    return JSONResponse({"enabled": True, **scheduler.stats()})
+
+
+async def cache_stats_view(request: Request):
+    return JSONResponse(cache_stats())
+
+
+async def lexicon_stats_view(request: Request):
+    return JSONResponse(lexicons.stats())
+
+
+async def metrics(request: Request):
+    return Response(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+# ───────────────────────────────────────────────────────────────
+# 啟動與關機
+# ───────────────────────────────────────────────────────────────
+_loop = None
+
+
+def _drain_first(handle_exit):
+    """
+    包住 uvicorn 的 Server.handle_exit：第一個 SIGTERM 先把 gate 切成 draining
+    （/readyz 與新請求回 503，listener 仍開著），ASGI_DRAIN_GRACE 秒後才交給 uvicorn 停止 listen；
+    SIGINT、第二個 SIGTERM 或 grace 為 0 時照原本的行為立刻關
+    """
+
+    def wrapper(server, sig, frame):
+        loop = _loop
+        if sig != signal.SIGTERM or ASGI_DRAIN_GRACE <= 0 or loop is None or loop.is_closed() or gate.draining:
+            return handle_exit(server, sig, frame)
+
+        def begin():
+            if gate.draining:
+                return
+            gate.draining = True
+            log.info("收到 SIGTERM，先排空 %gs 再停止接受連線：%s", ASGI_DRAIN_GRACE, gate.stats())
+            loop.call_later(ASGI_DRAIN_GRACE, handle_exit, server, sig, frame)
+
+        # signal handler 可能不在 event loop 的回呼裡執行，一律排回 loop 上做
+        loop.call_soon_threadsafe(begin)
+
+    wrapper._drains_first = True
+    return wrapper
+
+
+try:
+    from uvicorn.server import Server as _UvicornServer
+except ImportError:  # 用其他 ASGI server 時只在 lifespan shutdown 排空
+    _UvicornServer = None
+if _UvicornServer is not None and not getattr(_UvicornServer.handle_exit, "_drains_first", False):
+    # gunicorn 的 UvicornWorker 也走 Server.handle_exit
+    _UvicornServer.handle_exit = _drain_first(_UvicornServer.handle_exit)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    global _loop
+    _loop = asyncio.get_running_loop()
+    yield
+    # uvicorn 已停止接受新連線（SIGTERM 時 gate 早已在排空）；這裡等在途請求（含 SSE）做完
+    log.info("開始排空在途請求：%s", gate.stats())
+    if not await gate.drain(ASGI_DRAIN_TIMEOUT):
+        log.warning("排空逾時（%.0fs），仍有 %d 個請求在途", ASGI_DRAIN_TIMEOUT, gate.inflight)
+    await asyncio.get_running_loop().run_in_executor(None, executor.shutdown, True)
+    if scheduler is not None:
+        scheduler.close()
+    gemini_client.close()
+    log.info("已關閉")
+
+
+app = Starlette(
+    routes=[
+        Route("/", index),
+        Route("/analyze", analyze, methods=["POST"]),
+        Route("/analyze_batch", analyze_batch, methods=["POST"]),
+        Route("/healthz", healthz),
+        Route("/readyz", readyz),
+        Route("/gate/stats", gate_stats),
+        Route("/scheduler/stats", scheduler_stats),
+        Route("/cache/stats", cache_stats_view),
+        Route("/lexicon/stats", lexicon_stats_view),
+        Route("/metrics", metrics),
+    ],
+    lifespan=lifespan,
+)
@@ -1,180 +1,182 @@
 from dotenv import load_dotenv
 
 load_dotenv()  # 這行會讀取 .env 檔案並把內容塞到 os.environ 裡
-from transformers import AutoTokenizer, AutoModelForSequenceClassification
-import torch
-import jieba
-import requests
+import asyncio
 import os
-
-# 載入情緒分類模型
+import sys
+
+# 共用模組放在專案根目錄（analysis_engine、lexicon_bundle 等）
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from lexicon_bundle import LexiconStore
+import segmenter
+from analysis_engine import LABELERS, AnalysisEngine
+from gemini_client import GeminiClient
+from model_registry import ModelRegistry
+from safe_logging import get_logger
+
+log = get_logger("analyzer")
+
+# 判定方式 ANALYSIS_LABELER：
+# - lexicon_count（預設）：比較正負情緒詞個數，不需要模型，模型也不會載入
+# - fusion             ：與後端相同的模型+詞典融合（模型依 MODEL_STARTUP_MODE 載入）
+ANALYSIS_LABELER = os.getenv("ANALYSIS_LABELER", "lexicon_count")
+if ANALYSIS_LABELER not in LABELERS:
+    raise ValueError(f"未知的 ANALYSIS_LABELER：{ANALYSIS_LABELER!r}（可用：{', '.join(LABELERS)}）")
+
+# 情緒分類模型：MODEL_STARTUP_MODE=lazy（預設，第一次用到才載）/ eager（啟動就載入並暖身）/ lexicon（不載）
+# 判定用不到模型時一律視為 lexicon（/readyz 不必等一個不會用到的模型暖身）
 MODEL_NAME = "IDEA-CCNL/Erlangshen-RoBERTa-110M-Sentiment"
-tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
-model = AutoModelForSequenceClassification.from_pretrained(MODEL_NAME)
-model.eval()
-
-# 標籤對應與預設鼓勵語句
-label_map = {0: "negative", 1: "neutral", 2: "positive"}
+# 詞庫來源（預設 lexicons/demo/）；student 載入時也拿它比對訓練時的詞庫版本
+LEXICON_DIR = os.getenv("LEXICON_DIR") or os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "lexicons", "demo")
+# 推論後端 MODEL_BACKEND=torch / torch-int8 / onnx / student（見 inference_backends.py）
+model_registry = ModelRegistry(
+    MODEL_NAME, os.getenv("MODEL_STARTUP_MODE", "lazy") if LABELERS[ANALYSIS_LABELER][1] else "lexicon",
+    os.getenv("MODEL_BACKEND", "torch"), os.getenv("ONNX_MODEL_PATH") or None,
+    student_path=os.getenv("STUDENT_MODEL_PATH") or None, lexicon_dir=LEXICON_DIR,
+)
+model_registry.start(background=True)
+
+# 預設鼓勵語句
 default_message_map = {
     "positive": "你今天的心情聽起來很棒，請繼續保持哦！",
     "neutral": "無論心情如何，紀錄的每一步都是自我照顧的一部分。",
     "negative": "今天可能有點辛苦，但你願意寫下來，就已經很了不起了。"
 }
 
-# 情緒關鍵詞詞庫（擴充含現代用語）
-POSITIVE_WORDS = [
-    "開心", "快樂", "滿足", "期待", "興奮", "爽爆", "開薰", "超 chill", "好幸福", "有成就感","很喜歡", "很開心", "很滿", "開心", 
-    "快樂", "興奮", "愉快", "喜悅", "雀躍", "樂觀", "喜樂", "狂喜", "歡喜", "歡暢",
-    "興高采烈", "賞心悅目", "心花怒放", "笑逐顏開", "賞心樂事", "欣喜若狂", "悅目娛心", "歡天喜地", "高興", "喜悅", "喜樂", "高興", "快活",
-    "快樂的不得了","不錯", "蠻好", "爽快", "舒服", "舒暢", "放心", "釋放", "感恩", "感激", "感謝", "崇拜", "歡愉",
-    "滿足", "滿意", "陶醉", "誇讚", "幸福", "快樂有趣", "心醉神迷", "得意洋洋", "很得意", "很自豪", "有信心", "有把握", "很享受",
-    "有能力", "很安慰", "很光榮", "有盼望", "有成就感", "有安全感", "有感興趣", "被稱讚", "被尊重", "被激勵", "被重視", "被吸引",
-    "被認同", "被瞭解", "被欣賞", "被鼓舞", "被信任", "被接納", "被呵護", "被包容", "被肯定", "被關心", "被需要", "被體諒",
-    "被愛", "親密", "甜蜜", "貼心", "溫馨", "溫暖", "安慰", "親密感", "觸電感", "歸屬感", "受感動", "細心體貼", "平安", "自由",
-    "自在", "輕鬆", "寧靜", "怡然", "自得", "放鬆", "平靜", "安穩", "柔和", "心靈安詳", "溫和", "振奮", "驚喜", "痛快", "過癮",
-    "興致勃勃", "仁慈", "體諒", "信心", "體貼", "慷慨", "有同情心", "有活力", "生氣勃勃", "有精力", "開朗", "開闊", "有希望",
-    "有期待", "意想不到", "不可思議", "美夢成真", "熱血沸騰","在一起", "聊天", "放鬆", "開心", "摯友"
-
-]
-NEGATIVE_WORDS = [
-    "悲傷", "懊惱", "沮喪", "失望", "灰心", "心痛", "難過", "可憐", "委屈", "氣餒",
-    "想哭", "心碎", "消沈", "不爽", "洩氣", "傷心", "哀傷", "愛慮", "沈重", "可怕",
-    "後悔", "無聊", "彆扭", "苦惱", "痛苦", "辛苦", "很苦", "很累", "冷淡", "悶間的",
-    "不高興", "不快樂", "不舒服", "壓迫感", "受傷害", "沒盼望", "悲痛", "感到難過", "感到可惜", "悔恨",
-    "憂鬱", "喪氣", "淒慘", "絕望", "自暴自棄", "虛空", "孤單", "寂寞", "苦悶", "迷惘",
-    "茫然", "疑惑", "無奈", "無助", "麻木", "可惜", "失落", "鬱悶", "被遺棄", "無力感",
-    "無依無靠", "失魂落魄", "生氣", "憤怒", "怨恨", "被騙", "氣憤", "厭惡", "嫉妒", "不滿",
-    "受挫", "憤慨", "煩躁", "惱怒", "懷恨", "狂怒", "討厭", "無理", "苦毒", "沒耐心",
-    "有惡意", "被誤會", "被壓抑", "被勉強", "被激怒", "被控制", "被陷害", "被利用", "被出賣", "被左右",
-    "莫名其妙", "不懷好意", "怒氣沖沖", "令人討厭", "羞恥", "羞愧", "自卑", "怕羞", "慚愧", "內疚",
-    "很糗", "丟臉", "想逃", "挫折感", "被冤枉", "冒犯", "驚恐", "被批評", "被拒絕", "被責備",
-    "被嘲笑", "被輕視", "窘迫不安", "被羞辱", "沒面子", "沒信心", "被忽視", "被忽略", "不好意思", "不被重視",
-    "不被尊重", "焦慮", "掙扎", "矛盾", "緊張", "驚慌", "慌張", "恐懼", "急", "害怕",
-    "懼怕", "拒絕", "不安", "擔心", "擔憂", "混亂", "糟糕", "窒息感", "怪怪的", "被驚嚇",
-    "膽小", "被拋棄", "不安全", "被虐待", "失去方向", "不知所措", "無所適從", "心煩意亂", "亂七八糟", "亂成一團",
-    "無可奈何", "無能為力", "心神不安", "憎惡", "輕蔑", "不喜歡", "令人作嘔", "驚訝", "驚奇", "吃驚", "昏倒", "仇富"
-    "殺人", "自殺", "爆氣", 
-]
-
-# 事件詞庫，分成正面跟負面（甚至可以加中立）
-POSITIVE_EVENTS = [
-    "婚禮", "成果發表會", "音樂會", "慶典", "畢業典禮", "升職", "約會", "旅行"
-]
-
-NEGATIVE_EVENTS = [
-    "葬禮", "病痛", "失業", "分手", "考試失敗", "受傷", "車禍", "去世", "走了", "離開人世",
-]
-
-NEUTRAL_EVENTS = [
-    "會議", "拜訪", "出差", "通勤"
-]
-
-
-# 主題分類關鍵詞
-AWARENESS_WORDS = ["注意到", "覺得", "發現", "意識到", "醒悟", "體會", "感覺到", "理解", "深知", "了解", "深知" ]
-CONTROL_WORDS = ["忍住", "壓下", "控制", "冷靜", "不發火", "壓抑", "抑鬱", "吞下怒火",] 
-MANAGEMENT_WORDS = ["安排", "規劃", "處理", "面對", "調整", "應付", "解決", "完成", "結束"]
+# jieba 在 import 時就初始化（字典快取放在 JIEBA_CACHE_DIR），第一個請求不必等建字典
+segmenter.initialize()
+
+# 詞庫（情緒詞、事件詞、主題詞）放在 LEXICON_DIR，編譯成快照並註冊成 jieba 使用者詞典
+# 修改詞庫檔後：設 LEXICON_WATCH_INTERVAL（秒）會自動熱更新，不必重啟
+lexicons = LexiconStore(LEXICON_DIR)
+lexicons.start_watcher(float(os.getenv("LEXICON_WATCH_INTERVAL", "0")))
 
 # Gemini API 設定（需設定環境變數 GEMINI_API_KEY）
-# 若你希望使用快速版 Flash（回應速度較快）
-GEMINI_API_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash-latest:generateContent"
+# 若你希望使用快速版 Flash（回應速度較快）；測試時可指到本機 stub（gemini_stub.py）
+GEMINI_API_URL = os.getenv(
+    "GEMINI_API_URL",
+    "https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash-latest:generateContent",
+)
 
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-print("DEBUG: Gemini API key =", GEMINI_API_KEY)
-
-
-def generate_gemini_message(summary: str):
-    if not GEMINI_API_KEY:
-        print("⚠️ GEMINI_API_KEY 未設定")
-        return None
-    headers = {
-        "Content-Type": "application/json",
-        "X-goog-api-key": GEMINI_API_KEY
-    }
-    payload = {
-        "contents": [
-            {
-                "parts": [
-                    {
-                        "text": f"你是一位善於傾聽、理解與鼓勵的人，句尾的方式寫一段 1～2 句話的話語，除了溫暖安慰，分析他今天可能經歷了哪些情緒（如焦慮、疲憊、難過、期待、快樂等），並以貼近人心、真誠自然的語氣回應他，但從使用者的角度出發就好，不要自己帶入過多的猜測，也不要反問句，讓他感受到被理解和支持。請注意不要使用罐頭式的空泛鼓勵語：{summary}"
-                    }
-                ]
-            }
-        ]
-    }
+if not GEMINI_API_KEY:
+    log.warning("⚠️ GEMINI_API_KEY 未設定，鼓勵語一律使用預設語句")
+
+# 端到端時限（秒），逾時就用預設鼓勵語句
+GEMINI_DEADLINE = float(os.getenv("GEMINI_DEADLINE", "3"))
+
+
+def gemini_prompt(summary: str):
+    return f"你是一位善於傾聽、理解與鼓勵的人，句尾的方式寫一段 1～2 句話的話語，除了溫暖安慰，分析他今天可能經歷了哪些情緒（如焦慮、疲憊、難過、期待、快樂等），並以貼近人心、真誠自然的語氣回應他，但從使用者的角度出發就好，不要自己帶入過多的猜測，也不要反問句，讓他感受到被理解和支持。請注意不要使用罐頭式的空泛鼓勵語：{summary}"
+
+
+# 連線池 + 時限 + 斷路器 + 訊息快取
+GEMINI_MAX_PENDING = int(os.getenv("GEMINI_MAX_PENDING", "32"))  # 排隊 + 執行中上限，滿了用預設語句
+gemini_client = GeminiClient(GEMINI_API_KEY, GEMINI_API_URL, gemini_prompt, deadline=GEMINI_DEADLINE,
+                             max_pending=GEMINI_MAX_PENDING)
+
+
+
+# 結果快取：分類結果與 Gemini 訊息分開存（前端重送、使用者重按都不必再跑一次）
+ANALYSIS_CACHE_SIZE = int(os.getenv("ANALYSIS_CACHE_SIZE", "1024"))
+ANALYSIS_CACHE_TTL = float(os.getenv("ANALYSIS_CACHE_TTL", "86400"))
+MESSAGE_CACHE_TTL = float(os.getenv("MESSAGE_CACHE_TTL", "3600"))
+ANALYSIS_CACHE_DB = os.getenv("ANALYSIS_CACHE_DB") or None
+ANALYSIS_CACHE_DB_ROWS = int(os.getenv("ANALYSIS_CACHE_DB_ROWS", "100000"))  # 磁碟層每種快取的列數上限
+
+# 與後端共用 analysis_engine：關鍵詞用全文掃描、簡短摘要（不含原文）、Gemini 失敗時用預設語句
+engine = AnalysisEngine(
+    "demo", lexicons, model_registry, gemini_client, default_message_map,
+    labeler=ANALYSIS_LABELER, keywords="scan", summary="brief", fallback="default",
+    cache_size=ANALYSIS_CACHE_SIZE, cache_ttl=ANALYSIS_CACHE_TTL, message_cache_ttl=MESSAGE_CACHE_TTL,
+    cache_db=ANALYSIS_CACHE_DB, cache_db_rows=ANALYSIS_CACHE_DB_ROWS, cache_prefix="demo_",
+)
+analysis_version = engine.analysis_version
+cache_stats = engine.cache_stats
+# 批次推論（由 inference_scheduler 收集多個請求後一次呼叫）；engine.uses_model 為 False 時用不到
+model_score_many = engine.model_score_many
+use_scheduler = engine.use_scheduler
+
+
+def _failed(with_scores: bool = False):
+    log.exception("❌ 分析失敗")
+    return ("neutral", default_message_map["neutral"], [], []) + ((None,) if with_scores else ())
+
+
+def analyze_sentiment(text: str, with_scores: bool = False):
+    """with_scores=True 時多回傳一個 scores dict（分析失敗或空白文字為 None）"""
+    try:
+        return engine.analyze(text, with_scores)
+    except Exception:
+        return _failed(with_scores)
+
+
+def analyze_sentiment_stream(text: str, with_scores: bool = False):
+    """
+    分兩段產出，讓前端先顯示分類結果：
+    ("result", {"sentiment", "keywords", "topics"}) → ("message", 鼓勵語)
+    with_scores=True 時 result 多一個 "scores" 鍵（分析失敗時沒有）
+    """
+    stream = engine.stream(text, with_scores)
+    try:
+        first = next(stream)
+    except Exception:
+        _failed()
+        yield "result", {"sentiment": "neutral", "keywords": [], "topics": []}
+        yield "message", default_message_map["neutral"]
+        return
+    yield first
+    yield from stream
+
+
+def analyze_sentiment_batch(texts):
+    """批次版 analyze_sentiment：快取未命中的文字一起處理（判定需要模型時共用 forward）"""
+    texts = list(texts)
+    try:
+        return engine.analyze_batch(texts)
+    except Exception:
+        # 整批失敗 → 退回逐筆，讓單筆錯誤只影響自己
+        log.exception("❌ 批次分析失敗")
+        return [analyze_sentiment(t) for t in texts]
+
+
+# ── asyncio 版（ai_test_done/asgi.py 用）────────────────────────
+async def analyze_sentiment_async(text: str, executor=None, with_scores: bool = False):
+    """與 analyze_sentiment 相同的回傳值；executor 為 None 時用 event loop 預設的執行緒池"""
     try:
-        response = requests.post(GEMINI_API_URL, headers=headers, json=payload)
-        response.raise_for_status()
-        result = response.json()
-        print("Gemini API 回傳:", result)
-        return result["candidates"][0]["content"]["parts"][0]["text"]
-    except Exception as e:
-        print("Gemini API 呼叫失敗:", e)
-        if hasattr(e, 'response') and e.response is not None:
-            print("回應內容:", e.response.text)
-        return None
-
-def extract_keywords_from_text(text):
-    return [kw for kw in POSITIVE_WORDS + NEGATIVE_WORDS if kw in text]
-
-
-def analyze_sentiment(text: str):
+        return await engine.analyze_async(text, executor, with_scores)
+    except Exception:
+        return _failed(with_scores)
+
+
+async def analyze_sentiment_batch_async(texts, executor=None, concurrency: int = 8):
+    """analyze_sentiment_batch 的 async 版：鼓勵語最多 concurrency 篇同時 await Gemini"""
+    texts = list(texts)
+    try:
+        return await engine.analyze_batch_async(texts, executor, concurrency)
+    except Exception:
+        # 整批失敗 → 退回逐筆（同樣最多 concurrency 篇同時進行）
+        log.exception("❌ 批次分析失敗")
+        limit = asyncio.Semaphore(max(1, concurrency))
+
+        async def one(text):
+            async with limit:
+                return await analyze_sentiment_async(text, executor)
+
+        return list(await asyncio.gather(*(one(t) for t in texts)))
+
+
+async def analyze_sentiment_stream_async(text: str, executor=None, with_scores: bool = False):
+    """analyze_sentiment_stream 的 async generator 版"""
+    stream = engine.stream_async(text, executor, with_scores)
     try:
-        # Step 1: 情緒分類
-        inputs = tokenizer(text, return_tensors="pt", truncation=True, padding=True)
-        with torch.no_grad():
-            outputs = model(**inputs)
-            logits = outputs.logits
-            probs = torch.softmax(logits, dim=1)
-            label_id = torch.argmax(probs, dim=1).item()
-            label = label_map[label_id]
-
-        # Step 2: 斷詞並找出情緒詞
-        # 中文斷詞（保留給主題分析）
-        words = list(jieba.cut(text))
-
-        pos_count = sum(1 for w in words if w in POSITIVE_WORDS)
-        neg_count = sum(1 for w in words if w in NEGATIVE_WORDS)
-
-        if pos_count > neg_count:
-            label = "positive"
-        elif neg_count > pos_count:
-            label = "negative"
-        else:
-            label = "neutral"
-        
-        
-
-
-# ✅ 改成全文搜尋情緒詞（避免斷詞抓不到）
-        emotion_keywords = extract_keywords_from_text(text)
-
-
-        # Step 3: 探測主題
-        topics = []
-        if any(w in words for w in AWARENESS_WORDS):
-            topics.append("自我覺察")
-        if any(w in words for w in CONTROL_WORDS):
-            topics.append("自我控制")
-        if any(w in words for w in MANAGEMENT_WORDS):
-            topics.append("自我管理")
-
-        # Step 4: 利用關鍵詞構造摘要（不含原文）
-        summary_parts = [f"偵測到的情緒傾向：{label}"]
-        if emotion_keywords:
-            summary_parts.append("出現的情緒詞：" + ", ".join(set(emotion_keywords)))
-        if topics:
-            summary_parts.append("可能的主題：" + ", ".join(topics))
-
-        summary = "；".join(summary_parts)
-
-        # Step 5: 送給 Gemini
-        message = generate_gemini_message(summary)
-        if not message:
-            message = default_message_map.get(label, "保持勇氣，繼續加油！")
-
-        return label, message, emotion_keywords, topics
-
-    except Exception as e:
-        print("❌ 分析失敗:", e)
-        return "neutral", default_message_map["neutral"], [], []
+        first = await stream.__anext__()
+    except Exception:
+        _failed()
+        yield "result", {"sentiment": "neutral", "keywords": [], "topics": []}
+        yield "message", default_message_map["neutral"]
+        return
+    yield first
+    async for item in stream:
+        yield item
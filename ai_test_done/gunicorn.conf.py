@@ -0,0 +1,73 @@
+"""
+Pre-fork 多行程服務：父行程只載一次模型，worker 以 copy-on-write 共用權重
+
+啟動（在 ai_test_done/ 目錄下）：
+    gunicorn -c gunicorn.conf.py app:app
+
+環境變數：
+    WEB_WORKERS               worker 數（預設 = CPU 核心數）
+    WEB_THREADS               每個 worker 的執行緒數（預設 4，配合 micro-batch 併批）
+    TORCH_THREADS_PER_WORKER  每個 worker 的 torch intra-op 執行緒數（預設 核心數 / worker 數，至少 1）
+    BIND                      監聽位址（預設 0.0.0.0:8000）
+
+作法：
+- preload_app：app 在父行程 import，when_ready 時把模型權重（判定用得到模型時）與 jieba 詞典（segmenter.py，讀持久化快取）載好，再 fork worker
+- gc.freeze()：把載入期間的物件移出 GC 追蹤，避免 GC 掃描時寫到共用頁面而觸發複製
+- 父行程不做任何 forward：OpenMP / ONNX Runtime 的執行緒池跨 fork 不安全，
+  eager 模式的暖身改在每個 worker 的 post_fork 做，worker 開始接請求前就暖好
+- onnx 後端的 session 不能跨 fork 共用，改由各 worker 自行載入
+
+量測每個 worker 的記憶體：
+    python worker_memory.py $(cat gunicorn.pid)
+RSS 會把共用頁面重複計入每個行程，請看 PSS（共用頁面依共用行程數平分）與 Private；
+worker 數加倍時，總 PSS 應該只增加各 worker 的 Private 部分。
+"""
+import gc
+import multiprocessing
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_WORKERS", multiprocessing.cpu_count()))
+threads = int(os.getenv("WEB_THREADS", "4"))
+worker_class = "gthread"
+preload_app = True
+pidfile = "gunicorn.pid"
+
+TORCH_THREADS_PER_WORKER = int(os.getenv("TORCH_THREADS_PER_WORKER", "0")) or max(
+    1, multiprocessing.cpu_count() // max(1, workers)
+)
+
+# 父行程不能跑暖身 forward（見上方說明）：eager 先改成 lazy 載入，暖身交給各 worker
+_WARMUP_IN_WORKER = os.getenv("MODEL_STARTUP_MODE") == "eager"
+if _WARMUP_IN_WORKER:
+    os.environ["MODEL_STARTUP_MODE"] = "lazy"
+# 子行程 load_backend 時讀這個值（onnx 後端）
+os.environ.setdefault("ORT_INTRA_OP_THREADS", str(TORCH_THREADS_PER_WORKER))
+
+
+def when_ready(server):
+    from emotion_model import model_registry
+    import segmenter   # emotion_model 已把專案根目錄加進 sys.path
+
+    # lexicon 模式（含 ANALYSIS_LABELER=lexicon_count）沒有模型要載
+    if model_registry.backend != "onnx" and model_registry.mode != "lexicon":
+        model_registry.get()
+        server.log.info("model loaded in master: %s", model_registry.stats())
+    # import 時通常已初始化完成，這裡只是保險，並記下花了多久（有快取應在 1 秒內）
+    segmenter.initialize()
+    server.log.info("jieba ready in master: %s", segmenter.stats())
+
+    gc.collect()
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    import sys
+    if "torch" in sys.modules:
+        import torch
+        torch.set_num_threads(TORCH_THREADS_PER_WORKER)
+
+    if _WARMUP_IN_WORKER:
+        from emotion_model import model_registry
+        model_registry.warmup()
+        worker.log.info("worker %s warmed up in %.2fs", worker.pid, model_registry.warmup_seconds or 0.0)
@@ -0,0 +1,130 @@
+import os
+import threading
+import time
+import queue
+from collections import Counter
+from concurrent.futures import Future
+
+
+class MicroBatchScheduler:
+    """
+    把同時間進來的多個請求收成一批（micro-batch），一次丟給 batch_fn 推論。
+    - batch_fn(items) 必須回傳與 items 等長、順序對齊的結果
+    - 一批最多 max_batch_size 筆；第一筆進來後最多再等 max_wait_ms 毫秒
+    - 每個呼叫者只拿回自己那一筆的結果（或例外）
+    - fork 安全：背景執行緒不會跟著 fork 過去，子行程第一次送件時會重建佇列與執行緒
+    """
+
+    def __init__(self, batch_fn, max_batch_size=16, max_wait_ms=10):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+
+        self._lock = threading.Lock()
+        self._closed = False
+
+        # 統計：批次大小分佈、佇列深度
+        self._batch_sizes = Counter()
+        self._items = 0
+        self._max_queue_depth = 0
+
+        self._start_lock = threading.Lock()
+        self._pid = None
+        self._ensure_worker()
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # 子行程：父行程的鎖可能停在被持有的狀態，全部換新
+        self._start_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def _ensure_worker(self):
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            # 第一次，或在 fork 出來的子行程裡：重建佇列與背景執行緒
+            self._queue = queue.Queue()
+            self._worker = threading.Thread(target=self._run, name="micro-batch", daemon=True)
+            self._worker.start()
+            self._pid = os.getpid()
+
+    # ── 對外介面 ────────────────────────────────────────────────
+    def submit(self, item, timeout=None):
+        """送入一筆並等待結果（阻塞到該筆所在的批次跑完）"""
+        return self.submit_async(item).result(timeout=timeout)
+
+    def submit_async(self, item) -> Future:
+        if self._closed:
+            raise RuntimeError("scheduler 已關閉")
+        self._ensure_worker()
+        fut = Future()
+        self._queue.put((item, fut))
+        depth = self._queue.qsize()
+        with self._lock:
+            if depth > self._max_queue_depth:
+                self._max_queue_depth = depth
+        return fut
+
+    def stats(self) -> dict:
+        with self._lock:
+            batches = sum(self._batch_sizes.values())
+            return {
+                "queue_depth": self._queue.qsize(),
+                "max_queue_depth": self._max_queue_depth,
+                "batches": batches,
+                "items": self._items,
+                "avg_batch_size": (self._items / batches) if batches else 0.0,
+                "batch_size_histogram": {str(k): v for k, v in sorted(self._batch_sizes.items())},
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000.0,
+            }
+
+    def close(self):
+        """停止收件；已在佇列中的請求仍會跑完"""
+        self._closed = True
+        self._queue.put(None)
+        self._worker.join()
+
+    # ── 背景執行緒 ──────────────────────────────────────────────
+    def _collect(self):
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                nxt = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if nxt is None:
+                # 關閉訊號：這批跑完就結束
+                self._queue.put(None)
+                break
+            batch.append(nxt)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            items = [item for item, _ in batch]
+            try:
+                results = self.batch_fn(items)
+                if len(results) != len(items):
+                    raise RuntimeError(f"batch_fn 回傳 {len(results)} 筆，預期 {len(items)} 筆")
+            except Exception as e:
+                for _, fut in batch:
+                    fut.set_exception(e)
+            else:
+                for (_, fut), res in zip(batch, results):
+                    fut.set_result(res)
+            with self._lock:
+                self._batch_sizes[len(batch)] += 1
+                self._items += len(batch)
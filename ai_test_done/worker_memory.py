@@ -0,0 +1,63 @@
+"""
+列出 gunicorn 父行程與各 worker 的記憶體（Linux，讀 /proc/<pid>/smaps_rollup）
+
+    python worker_memory.py $(cat gunicorn.pid)
+
+RSS 會把 copy-on-write 共用的頁面重複算進每個行程；PSS 把共用頁面依共用行程數平分，
+所有行程 PSS 加總才是整組服務真正占用的記憶體。Private 是各 worker 自己獨有的部分。
+"""
+import os
+import sys
+
+FIELDS = ("Rss", "Pss", "Shared_Clean", "Shared_Dirty", "Private_Clean", "Private_Dirty")
+
+
+def smaps_rollup(pid):
+    out = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2 and parts[0].rstrip(":") in FIELDS:
+                out[parts[0].rstrip(":")] = int(parts[1])   # kB
+    return out
+
+
+def children(pid):
+    kids = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # 第 4 欄是 ppid；行程名稱可能含空白，從最後一個 ')' 之後切
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, ValueError, IndexError):
+            continue
+        if ppid == pid:
+            kids.append(int(entry))
+    return sorted(kids)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv:
+        print(__doc__)
+        return 1
+    master = int(argv[0])
+    rows = [("master", master)] + [("worker", p) for p in children(master)]
+
+    print(f"{'role':<7} {'pid':>7} {'RSS MiB':>9} {'PSS MiB':>9} {'Shared MiB':>11} {'Private MiB':>12}")
+    total_pss = 0
+    for role, pid in rows:
+        m = smaps_rollup(pid)
+        shared = m.get("Shared_Clean", 0) + m.get("Shared_Dirty", 0)
+        private = m.get("Private_Clean", 0) + m.get("Private_Dirty", 0)
+        total_pss += m.get("Pss", 0)
+        print(f"{role:<7} {pid:>7} {m.get('Rss', 0) / 1024:>9.1f} {m.get('Pss', 0) / 1024:>9.1f} "
+              f"{shared / 1024:>11.1f} {private / 1024:>12.1f}")
+    print(f"總 PSS：{total_pss / 1024:.1f} MiB（{len(rows) - 1} 個 worker）")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
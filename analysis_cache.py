@@ -0,0 +1,201 @@
+# backend/api/utils/analysis_cache.py
+"""
+分析結果快取：以「正規化文字雜湊 + 詞典/模型版本戳」為 key
+
+- LRUCache：行程內記憶體快取，有筆數上限與 TTL
+- SQLiteCache：可選的磁碟層，多個 worker 行程共用同一個檔案；每寫入 purge_every 次
+  清一次過期列，並把該 namespace 砍到最多 max_rows 列（先刪最早寫入的），檔案不會無限長大
+- TieredCache：先查記憶體再查磁碟（磁碟命中會回填記憶體），並記錄命中/未命中次數
+- build_cache：筆數上限 0 = 關閉，記憶體與磁碟兩層都不建
+
+值必須可 JSON 序列化，且不能是 None（None 代表未命中）。
+"""
+from __future__ import annotations
+from typing import Any, Dict, Optional
+from collections import OrderedDict
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+
+from safe_logging import get_logger
+
+log = get_logger(__name__)
+
+_WS_RE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """只抹平不影響分析結果的差異：前後空白、連續空白、Unicode 組合形式"""
+    text = unicodedata.normalize("NFC", text or "")
+    return _WS_RE.sub(" ", text).strip()
+
+
+def make_key(text: str, version: str) -> str:
+    h = hashlib.sha256()
+    h.update(version.encode("utf-8"))
+    h.update(b"\0")
+    h.update(normalize_text(text).encode("utf-8"))
+    return h.hexdigest()
+
+
+class LRUCache:
+    def __init__(self, max_items: int = 1024, ttl: Optional[float] = None):
+        self.max_items = max_items
+        self.ttl = ttl
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Any:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires = item
+            if expires is not None and time.monotonic() >= expires:
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any) -> None:
+        if self.max_items <= 0:
+            return
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_items:
+                self._data.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SQLiteCache:
+    """多行程共用的磁碟快取（WAL 模式，每個執行緒各自一條連線；fork 後子行程會重開連線）"""
+
+    def __init__(self, path: str, namespace: str, ttl: Optional[float] = None,
+                 max_rows: Optional[int] = None, purge_every: int = 256):
+        self.path = path
+        self.namespace = namespace
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self.purge_every = max(1, purge_every)
+        self._writes = 0
+        self._writes_lock = threading.Lock()
+        self._local = threading.local()
+        d = os.path.dirname(os.path.abspath(path))
+        os.makedirs(d, exist_ok=True)
+        with self._conn() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                " ns TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, expires_at REAL,"
+                " PRIMARY KEY (ns, key))"
+            )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key: str) -> Any:
+        row = self._conn().execute(
+            "SELECT value, expires_at FROM cache WHERE ns = ? AND key = ?", (self.namespace, key)
+        ).fetchone()
+        if row is None:
+            return None
+        value, expires_at = row
+        if expires_at is not None and time.time() >= expires_at:
+            with self._conn() as conn:
+                conn.execute("DELETE FROM cache WHERE ns = ? AND key = ?", (self.namespace, key))
+            return None
+        return json.loads(value)
+
+    def set(self, key: str, value: Any) -> None:
+        expires_at = time.time() + self.ttl if self.ttl else None
+        with self._conn() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (ns, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                (self.namespace, key, json.dumps(value, ensure_ascii=False), expires_at),
+            )
+        with self._writes_lock:
+            self._writes += 1
+            due = self._writes % self.purge_every == 0
+        if due:
+            self.purge()
+
+    def purge(self) -> int:
+        """刪掉過期列，再把超過 max_rows 的最舊列刪掉（INSERT OR REPLACE 會換新 rowid，rowid 小 = 較早寫入）"""
+        with self._conn() as conn:
+            removed = conn.execute(
+                "DELETE FROM cache WHERE ns = ? AND expires_at IS NOT NULL AND expires_at < ?",
+                (self.namespace, time.time()),
+            ).rowcount
+            if self.max_rows is not None:
+                removed += conn.execute(
+                    "DELETE FROM cache WHERE ns = ? AND rowid NOT IN"
+                    " (SELECT rowid FROM cache WHERE ns = ? ORDER BY rowid DESC LIMIT ?)",
+                    (self.namespace, self.namespace, max(0, self.max_rows)),
+                ).rowcount
+        return removed
+
+
+class TieredCache:
+    def __init__(self, memory: LRUCache, disk: Optional[SQLiteCache] = None):
+        self.memory = memory
+        self.disk = disk
+        self._lock = threading.Lock()
+        self._counts = {"hits": 0, "memory_hits": 0, "disk_hits": 0, "misses": 0, "sets": 0}
+
+    def _count(self, *names: str) -> None:
+        with self._lock:
+            for n in names:
+                self._counts[n] += 1
+
+    def get(self, key: str) -> Any:
+        value = self.memory.get(key)
+        if value is not None:
+            self._count("hits", "memory_hits")
+            return value
+        if self.disk is not None:
+            try:
+                value = self.disk.get(key)
+            except sqlite3.Error as e:
+                log.warning("❌ 快取讀取失敗：%s", e)
+                value = None
+            if value is not None:
+                self.memory.set(key, value)
+                self._count("hits", "disk_hits")
+                return value
+        self._count("misses")
+        return None
+
+    def set(self, key: str, value: Any) -> None:
+        self.memory.set(key, value)
+        if self.disk is not None:
+            try:
+                self.disk.set(key, value)
+            except sqlite3.Error as e:
+                log.warning("❌ 快取寫入失敗：%s", e)
+        self._count("sets")
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counts, size=len(self.memory))
+
+
+def build_cache(namespace: str, max_items: int, ttl: Optional[float], db_path: Optional[str] = None,
+                db_max_rows: Optional[int] = 100_000) -> TieredCache:
+    # 0 = 關閉：連磁碟層也不開，否則設了 ANALYSIS_CACHE_DB 時仍會讀寫 SQLite
+    disk = SQLiteCache(db_path, namespace, ttl, db_max_rows) if db_path and max_items > 0 else None
+    return TieredCache(LRUCache(max_items, ttl), disk)
@@ -0,0 +1,920 @@
+# backend/api/utils/analysis_engine.py
+"""
+情緒分析引擎：後端（emotion_models.py）與 Flask 示範（ai_test_done/emotion_model.py）共用同一套流程
+
+一個 AnalysisEngine 由幾個可替換的部分組成，各自以名稱選擇：
+- labeler  ：標籤與 final_score 怎麼決定
+    fusion        ：模型分數 × w_model + 詞典分數 × w_lex + 事件加權（後端）；可開串接模式先用詞典判定
+    lexicon_count ：正負情緒詞個數比較（示範版一直以來的判定方式），不需要模型
+- keywords ：tokens（斷詞後的情緒詞/emoji，再補上事件詞）/ scan（全文掃描情緒詞，依出現順序）
+- summary  ：detailed（含各分量，後端）/ brief（示範版）
+- fallback ：compose（依標籤、主題、事件組規則式訊息）/ default（每個標籤一句固定訊息）
+
+特徵（tokens、詞典分數、事件、主題、模型分數…）由 STAGES 裡的 stage 產生，放在 Features 裡
+「第一次讀到才算」：上面幾個部分沒讀到的特徵就不會計算。例如 lexicon_count 從來不讀模型分數，
+示範版就不再跑一次結果會被丟掉的 forward pass，模型也不必載入。
+
+詞典分數、正負詞個數、主題與關鍵詞由 score stage 一趟算完（token_scorer.py）：單篇時直接吃
+segmenter.iter_cut 的 generator，token 不會先變成 list；批次與增量重算已經有 tokens，就走那份 list。
+
+單篇、批次、增量重算與 async 版都走同一套 stage，只是事先把 tokens / 模型分數整批算好放進 Features。
+"""
+from __future__ import annotations
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import asyncio
+import contextvars
+import functools
+import hashlib
+import json
+import threading
+import time
+from functools import lru_cache
+
+import segmenter
+from analysis_cache import build_cache, make_key
+from gemini_client import GeminiClient
+from inference_backends import probs_to_scores
+from lexicon_bundle import LexiconBundle, LexiconStore
+from lexicon_matcher import first_hits
+from metrics import stage, observe_stage, observe_gemini, current_trace, CHUNKS_PER_TEXT, FORWARD_BATCH_SIZES
+from model_registry import ModelRegistry
+from token_scorer import score_tokens
+
+# 句末標點（token 分段時優先在這些 token 之後切）
+_SENTENCE_END = ["。", "！", "？", "!", "?", "…", "；", ";", "～", "~"]
+# 段尾往回最多找幾個 token，盡量在句末標點之後切
+SENTENCE_BREAK_LOOKBACK = 32
+# 主題類別 → 顯示名稱
+TOPIC_NAMES = {"awareness": "自我覺察", "control": "自我控制", "management": "自我管理"}
+
+
+# ───────────────────────────────────────────────────────────────
+# 模型分段推論（不依賴 engine 狀態的部分）
+# ───────────────────────────────────────────────────────────────
+def _token_windows(ids: List[int], size: int, stride: int, break_ids: set) -> List[List[int]]:
+    """把一篇的 token id 切成多段，每段 ≤ size，段與段重疊 stride 個 token"""
+    if not ids:
+        return []
+    size = max(1, size)
+    stride = max(0, min(stride, size // 2))
+    windows: List[List[int]] = []
+    start, n = 0, len(ids)
+    while start < n:
+        end = min(start + size, n)
+        if end < n:
+            lo = max(start + 1, end - SENTENCE_BREAK_LOOKBACK)
+            for j in range(end - 1, lo - 1, -1):
+                if ids[j] in break_ids:
+                    end = j + 1
+                    break
+        windows.append(ids[start:end])
+        if end >= n:
+            break
+        start = max(end - stride, start + 1)
+    return windows
+
+
+@lru_cache(maxsize=4)
+def _special_affixes(tokenizer) -> Tuple[List[int], List[int]]:
+    """單句輸入前後要補的特殊 token（BERT 類是 [CLS] … [SEP]）"""
+    probe = tokenizer("好", add_special_tokens=False)["input_ids"]
+    full = tokenizer("好")["input_ids"]
+    for i in range(len(full) - len(probe) + 1):
+        if full[i:i + len(probe)] == probe:
+            return full[:i], full[i + len(probe):]
+    return [], []
+
+
+def _average_chunks(results: List[Tuple[float, float]]) -> Tuple[float, float]:
+    """各段 (score, conf) 依原順序取平均；沒有任何一段成功就回 (0, 0)"""
+    if not results:
+        return 0.0, 0.0
+    scores, confs = zip(*results)
+    return float(sum(scores)/len(scores)), float(sum(confs)/len(confs))
+
+
+# ───────────────────────────────────────────────────────────────
+# 增量重算用的切句與 key
+# ───────────────────────────────────────────────────────────────
+# 在這些字元之後切句。它們都會被 segmenter.pretokenize 補空白（或本身是換行），jieba 也不會跨過
+# 它們切詞，所以「各句分別斷詞再接起來」與「整篇一起斷詞」得到完全相同的 token
+_SEGMENT_BREAKS = frozenset("。！？!?…~\n")
+
+
+def split_segments(raw: str) -> List[str]:
+    segments, start = [], 0
+    for i, ch in enumerate(raw):
+        if ch in _SEGMENT_BREAKS:
+            segments.append(raw[start:i + 1])
+            start = i + 1
+    if start < len(raw):
+        segments.append(raw[start:])
+    return segments
+
+
+def _part_key(version: str, payload: str) -> str:
+    """分段快取的 key：不做 make_key 的空白正規化，內容差一個字元就是不同的 key"""
+    h = hashlib.sha256()
+    h.update(version.encode("utf-8"))
+    h.update(b"\0")
+    h.update(payload.encode("utf-8"))
+    return h.hexdigest()
+
+
+# ───────────────────────────────────────────────────────────────
+# 融合參數設定檔（fusion_tune.py 離線調好後輸出）
+# ───────────────────────────────────────────────────────────────
+# 設定檔裡可以出現的參數，都是 AnalysisEngine 的同名參數
+FUSION_PARAMS = (
+    "w_model", "w_lex", "t_neu", "conf_cutoff", "low_conf_w_model", "low_conf_w_lex",
+    "event_bonus", "excitement_bonus",
+)
+
+
+def load_fusion_config(path: str) -> Dict[str, float]:
+    """讀 JSON 設定檔的 params（也接受直接就是參數的 dict），回傳可直接傳給 AnalysisEngine 的 kwargs"""
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    params = data.get("params", data)
+    unknown = sorted(set(params) - set(FUSION_PARAMS))
+    if unknown:
+        raise ValueError(f"融合設定檔 {path} 有未知的參數：{', '.join(unknown)}（可用：{', '.join(FUSION_PARAMS)}）")
+    return {k: float(v) for k, v in params.items()}
+
+
+# ───────────────────────────────────────────────────────────────
+# Stage：每個 stage 產生一組特徵鍵
+# ───────────────────────────────────────────────────────────────
+# stage 名稱 → (產生的鍵, fn(engine, features) -> dict)；fn 自己負責 metrics 的 stage 計時
+STAGES: Dict[str, Tuple[Tuple[str, ...], Callable]] = {}
+# 特徵鍵 → 產生它的 stage
+PROVIDERS: Dict[str, str] = {}
+
+
+def register_stage(name: str, provides: Iterable[str]):
+    provides = tuple(provides)
+
+    def deco(fn):
+        STAGES[name] = (provides, fn)
+        for key in provides:
+            PROVIDERS[key] = name
+        return fn
+    return deco
+
+
+class Features:
+    """一篇文字的特徵；第一次讀到某個鍵才跑產生它的 stage，已給定（批次預先算好）的鍵直接用"""
+
+    def __init__(self, engine: "AnalysisEngine", raw: str, lex: LexiconBundle, **given):
+        self.engine = engine
+        self.raw = raw
+        self.lex = lex
+        self._values: Dict[str, object] = dict(given)
+        self.ran: List[str] = []
+
+    def __getitem__(self, key: str):
+        if key not in self._values:
+            name = PROVIDERS[key]
+            self._values.update(STAGES[name][1](self.engine, self))
+            self.ran.append(name)
+        return self._values[key]
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._values
+
+    def set(self, **values) -> None:
+        self._values.update(values)
+
+
+@register_stage("tokenize", ["tokens"])
+def _stage_tokenize(engine, f):
+    with stage("tokenize"):
+        return {"tokens": segmenter.cut(f.raw)}
+
+
+def _timed(tokens, spent: List[float]):
+    """包住 token iterator，把花在 next()（斷詞本身）的時間累加到 spent[0]"""
+    it = iter(tokens)
+    while True:
+        started = time.perf_counter()
+        try:
+            token = next(it)
+        except StopIteration:
+            spent[0] += time.perf_counter() - started
+            return
+        spent[0] += time.perf_counter() - started
+        yield token
+
+
+@register_stage("lexicon", ["lex_s", "lex_pos", "lex_neg", "pos_count", "neg_count", "topics", "keyword_ids"])
+def _stage_lexicon(engine, f):
+    # 已有 tokens（批次、增量）就用；否則邊斷詞邊評分，斷詞時間另外記在 tokenize、其餘記在 lexicon
+    if "tokens" in f:
+        with stage("lexicon"):
+            sc = score_tokens(f["tokens"], f.lex.table)
+    else:
+        spent = [0.0]
+        started = time.perf_counter()
+        sc = score_tokens(_timed(segmenter.iter_cut(f.raw), spent), f.lex.table)
+        observe_stage("tokenize", spent[0])
+        observe_stage("lexicon", time.perf_counter() - started - spent[0])
+    return {
+        "lex_s": sc.lex_s, "lex_pos": sc.pos_hits, "lex_neg": sc.neg_hits,
+        "pos_count": sc.pos_count, "neg_count": sc.neg_count,
+        # 主題以 jieba token 整詞判定（不是子字串）
+        "topics": sc.topics(TOPIC_NAMES),
+        "keyword_ids": sc.keyword_ids,
+    }
+
+
+@register_stage("events", ["pos_events", "neg_events", "excitement", "event_bonus"])
+def _stage_events(engine, f):
+    with stage("events"):
+        # 事件加權（弱加分/扣分）
+        event_bonus = 0.0
+        hits = f.lex.matcher.find_all(f.raw)
+        pos_events_hit = first_hits(hits, "positive_event")
+        neg_events_hit = first_hits(hits, "negative_event")
+        if pos_events_hit:
+            event_bonus += engine.event_bonus   # 例如：提到「動物園/生日」→ 偏正向
+        if neg_events_hit:
+            event_bonus -= engine.event_bonus
+        # 特殊口語強化：出現「興奮、期待」等強正向詞
+        excitement = any(m.category == "excitement" for m in hits)
+        if excitement:
+            event_bonus += engine.excitement_bonus
+    return {"pos_events": pos_events_hit, "neg_events": neg_events_hit, "excitement": excitement,
+            "event_bonus": event_bonus}
+
+
+@register_stage("scan", ["scan_keywords"])
+def _stage_scan(engine, f):
+    """全文掃一遍，出現的情緒詞（依出現順序、不重複；斷詞切不出來的詞也抓得到）"""
+    with stage("scan"):
+        return {"scan_keywords": first_hits(f.lex.matcher.finditer(f.raw), "positive", "negative")}
+
+
+@register_stage("model", ["mdl_s", "mdl_conf"])
+def _stage_model(engine, f):
+    mdl_s, mdl_conf = engine.model_score(f.raw)
+    return {"mdl_s": mdl_s, "mdl_conf": mdl_conf}
+
+
+# ───────────────────────────────────────────────────────────────
+# Labeler / keywords / summary / fallback
+# ───────────────────────────────────────────────────────────────
+def _label_fusion(engine: "AnalysisEngine", f: Features) -> Dict:
+    if engine.cascade and engine.cascade_decides(f):
+        return engine.fuse(f, 0.0, 0.0, path="lexicon")
+    return engine.fuse(f, f["mdl_s"], f["mdl_conf"])
+
+
+def _label_counts(engine: "AnalysisEngine", f: Features) -> Dict:
+    pos, neg = f["pos_count"], f["neg_count"]
+    if pos > neg:
+        label = "positive"
+    elif neg > pos:
+        label = "negative"
+    else:
+        label = "neutral"
+    # 給分析歷史用的分數：正負詞個數差 / 總數，方向與標籤一致
+    score = (pos - neg) / (pos + neg) if pos + neg else 0.0
+    return engine.build_result(f, label, {"final": score, "lexicon": score}, path="lexicon")
+
+
+# labeler 名稱 → (fn, 會不會用到模型)
+LABELERS: Dict[str, Tuple[Callable, bool]] = {
+    "fusion": (_label_fusion, True),
+    "lexicon_count": (_label_counts, False),
+}
+
+
+def _keywords_tokens(f: Features) -> List[str]:
+    # 斷詞後的情緒詞/emoji，依出現順序、含重複
+    keywords = f.lex.table.words(f["keyword_ids"])
+    # 把事件也放進 keywords 方便前端展示
+    keywords += [e for e in f["pos_events"] + f["neg_events"] if e not in keywords]
+    return keywords
+
+
+def _keywords_scan(f: Features) -> List[str]:
+    return list(f["scan_keywords"])
+
+
+KEYWORD_SOURCES: Dict[str, Callable[[Features], List[str]]] = {
+    "tokens": _keywords_tokens,
+    "scan": _keywords_scan,
+}
+
+
+def _summary_detailed(label: str, scores: Dict, weights: Tuple[float, float],
+                      keywords: List[str], topics: List[str]) -> str:
+    w_model, w_lex = weights
+    summary_parts = [
+        f"整體極性分數：{scores['final']:.2f}（模型 {scores['model']:.2f}×{w_model} + 詞典 {scores['lexicon']:.2f}×{w_lex}；"
+        f"事件加權 {scores['event_bonus']:+.2f}；信心 {scores['model_conf']:.2f}）",
+        f"判定為：{label}",
+    ]
+    if keywords:
+        ks = [k for k in keywords if k not in ["，","。","!","！"]][:8]  # 只展示前 8 個
+        if ks:
+            summary_parts.append("線索：" + ", ".join(ks))
+    if topics:
+        summary_parts.append("主題：" + ", ".join(topics))
+    return "；".join(summary_parts)
+
+
+def _summary_brief(label: str, scores: Dict, weights: Tuple[float, float],
+                   keywords: List[str], topics: List[str]) -> str:
+    # 只放關鍵詞，不含原文
+    summary_parts = [f"偵測到的情緒傾向：{label}"]
+    if keywords:
+        summary_parts.append("出現的情緒詞：" + ", ".join(keywords))
+    if topics:
+        summary_parts.append("可能的主題：" + ", ".join(topics))
+    return "；".join(summary_parts)
+
+
+SUMMARIES = {"detailed": _summary_detailed, "brief": _summary_brief}
+
+
+def compose_support_message(label: str, keywords: List[str], topics: List[str], extra_hint: str | None) -> str:
+    """規則式提示語（無 Gemini 時用，不講呼吸）"""
+    topic_hint = ""
+    if topics:
+        topic_hint = f"（你也展現了{ '、'.join(topics) }）"
+
+    if label == "positive":
+        base = "聽起來你的心情很不錯，保持這份好能量去面對接下來的事情吧！"
+        if extra_hint:
+            base = f"聽起來你的心情很不錯，{extra_hint}，把這份好能量帶著走吧！"
+        return base + ("" if not topic_hint else f"{topic_hint}")
+    elif label == "negative":
+        base = "讀起來今天不太容易，感謝你寫下來，這已經很勇敢。願你被好好看見，也對自己溫柔一些。"
+        return base + ("" if not topic_hint else f"{topic_hint}")
+    else:
+        base = "你清楚地記錄了此刻，這本身就是很好的練習。"
+        if extra_hint:
+            base = f"{base} {extra_hint}"
+        return base + ("" if not topic_hint else f"{topic_hint}")
+
+
+def _fallback_compose(engine: "AnalysisEngine", f: Features, label: str, keywords: List[str], topics: List[str]) -> str:
+    # 客製一點的小提示（例如偵測到正向事件）
+    extra_hint = None
+    if label == "positive" and f["pos_events"]:
+        extra_hint = f"看起來你對「{f['pos_events'][0]}」很期待"
+    return compose_support_message(label, keywords, topics, extra_hint)
+
+
+def _fallback_default(engine: "AnalysisEngine", f: Features, label: str, keywords: List[str], topics: List[str]) -> str:
+    return engine.default_messages[label]
+
+
+FALLBACKS = {"compose": _fallback_compose, "default": _fallback_default}
+
+
+# ───────────────────────────────────────────────────────────────
+# Engine
+# ───────────────────────────────────────────────────────────────
+class AnalysisEngine:
+    """
+    一組設定（詞典、labeler、關鍵詞/摘要/備用訊息的來源、快取、Gemini）＝ 一個 engine
+    模型只有 labeler 需要時才會啟動與載入（見 uses_model）
+    """
+
+    def __init__(self, name: str, lexicons: LexiconStore, model_registry: ModelRegistry,
+                 gemini_client: GeminiClient, default_messages: Dict[str, str], *,
+                 labeler: str = "fusion", keywords: str = "tokens", summary: str = "detailed",
+                 fallback: str = "compose",
+                 w_model: float = 0.6, w_lex: float = 0.4, t_neu: float = 0.15,
+                 conf_cutoff: float = 0.55, low_conf_w_model: float = 0.5, low_conf_w_lex: float = 0.5,
+                 event_bonus: float = 0.15, excitement_bonus: float = 0.15,
+                 cascade: bool = False, cascade_min_score: float = 0.6, cascade_min_hits: int = 1,
+                 max_len: int = 256, chunk_tokens: int = 220, chunk_stride: int = 0, model_batch_size: int = 16,
+                 cache_size: int = 1024, cache_ttl: float = 86400, message_cache_ttl: float = 3600,
+                 cache_db: Optional[str] = None, cache_db_rows: Optional[int] = 100_000, cache_prefix: str = "",
+                 incremental_cache_size: int = 0):
+        for value, table, what in ((labeler, LABELERS, "labeler"), (keywords, KEYWORD_SOURCES, "keywords"),
+                                   (summary, SUMMARIES, "summary"), (fallback, FALLBACKS, "fallback")):
+            if value not in table:
+                raise ValueError(f"未知的 {what}：{value!r}（可用：{', '.join(table)}）")
+        self.name = name
+        self.lexicons = lexicons
+        self.model_registry = model_registry
+        self.gemini_client = gemini_client
+        self.default_messages = default_messages
+        self.labeler, self.keywords, self.summary, self.fallback = labeler, keywords, summary, fallback
+        self.w_model, self.w_lex, self.t_neu = w_model, w_lex, t_neu
+        self.conf_cutoff, self.low_conf_w_model, self.low_conf_w_lex = conf_cutoff, low_conf_w_model, low_conf_w_lex
+        self.event_bonus, self.excitement_bonus = event_bonus, excitement_bonus
+        self.cascade, self.cascade_min_score, self.cascade_min_hits = cascade, cascade_min_score, cascade_min_hits
+        self.max_len, self.chunk_tokens, self.chunk_stride = max_len, chunk_tokens, chunk_stride
+        self.model_batch_size = model_batch_size
+        self.uses_model = LABELERS[labeler][1]
+
+        self._result_cache = build_cache(f"{cache_prefix}result", cache_size, cache_ttl, cache_db, cache_db_rows)
+        self._message_cache = build_cache(f"{cache_prefix}message", cache_size, message_cache_ttl, cache_db, cache_db_rows)
+        # 增量重算用的分段快取：每句的斷詞結果、每個 token 分段的模型分數（0 = 關閉）
+        self._segment_cache = build_cache(f"{cache_prefix}segment", incremental_cache_size, cache_ttl, cache_db, cache_db_rows)
+        self._chunk_cache = build_cache(f"{cache_prefix}chunk", incremental_cache_size, cache_ttl, cache_db, cache_db_rows)
+
+        self._scheduler = None
+        self._path_counts = {"lexicon": 0, "model": 0}
+        self._path_lock = threading.Lock()
+        self._versions: Dict[str, str] = {}
+
+    # ── 設定與版本 ────────────────────────────────────────────
+    def use_scheduler(self, scheduler) -> None:
+        """設定 micro-batch scheduler（batch_fn 用 model_score_many）；None 則每個請求各自推論"""
+        self._scheduler = scheduler
+
+    def analysis_version(self, lex: Optional[LexiconBundle] = None) -> str:
+        """詞典、設定、模型任一變動都會換版本戳，舊快取自然失效"""
+        lex_version = (lex or self.lexicons.current).version
+        version = self._versions.get(lex_version)
+        if version is None:
+            h = hashlib.sha1()
+            parts = [self.name, self.labeler, self.keywords, self.summary, self.fallback, lex_version,
+                     self.event_bonus, self.excitement_bonus]
+            if self.uses_model:
+                r = self.model_registry
+                parts += [r.model_name, r.backend, r.student_path or "", r.mode == "lexicon", self.w_model, self.w_lex, self.t_neu,
+                          self.conf_cutoff, self.low_conf_w_model, self.low_conf_w_lex,
+                          self.chunk_tokens, self.chunk_stride,
+                          self.cascade, self.cascade_min_score, self.cascade_min_hits]
+            for part in parts:
+                h.update(repr(part).encode("utf-8"))
+            version = self._versions[lex_version] = h.hexdigest()[:12]
+        return version
+
+    def cache_stats(self) -> Dict[str, Dict[str, int]]:
+        return {
+            "result": self._result_cache.stats(), "message": self._message_cache.stats(),
+            "segment": self._segment_cache.stats(), "chunk": self._chunk_cache.stats(),
+        }
+
+    def _count_path(self, path: str) -> None:
+        with self._path_lock:
+            self._path_counts[path] = self._path_counts.get(path, 0) + 1
+
+    def cascade_stats(self) -> Dict:
+        """每次實際分析（快取未命中）由哪條路徑判定"""
+        with self._path_lock:
+            counts = dict(self._path_counts)
+        total = sum(counts.values())
+        return {
+            "enabled": self.cascade,
+            "min_score": self.cascade_min_score,
+            "min_hits": self.cascade_min_hits,
+            "paths": counts,
+            "skip_rate": (counts.get("lexicon", 0) / total) if total else 0.0,
+        }
+
+    # ── 特徵、判定與結果 ──────────────────────────────────────
+    def features(self, raw: str, lex: Optional[LexiconBundle] = None, **given) -> Features:
+        return Features(self, raw, lex or self.lexicons.current, **given)
+
+    def needs_model(self, f: Features) -> bool:
+        """這一篇的判定會不會讀到模型分數（串接模式下詞典夠明確就不會）"""
+        if not self.uses_model:
+            return False
+        return not (self.cascade and self.cascade_decides(f))
+
+    def cascade_decides(self, f: Features, min_score: float = None, min_hits: int = None) -> bool:
+        """詞典結果夠明確（不稀疏、不矛盾、離中立夠遠）就不必跑模型"""
+        min_score = self.cascade_min_score if min_score is None else min_score
+        min_hits = self.cascade_min_hits if min_hits is None else min_hits
+        lex_s, bonus = f["lex_s"], f["event_bonus"]
+        # 正負詞同時出現：可能是轉折（「雖然很累但很開心」），交給模型
+        if f["lex_pos"] and f["lex_neg"]:
+            return False
+        # 證據太少
+        if f["lex_pos"] + f["lex_neg"] < min_hits:
+            return False
+        # 事件方向跟詞典相反
+        if lex_s * bonus < 0:
+            return False
+        return abs(max(-1.0, min(1.0, lex_s + bonus))) >= min_score
+
+    def label(self, f: Features) -> Dict:
+        """依設定的 labeler 產生結果（label / keywords / topics / summary / fallback / path / scores）"""
+        return LABELERS[self.labeler][0](self, f)
+
+    def fuse(self, f: Features, mdl_s: float, mdl_conf: float, path: str = "model") -> Dict:
+        """fusion：詞典特徵 + 給定的模型分數 → 結果；path 記錄由哪條路徑判定"""
+        lex_s, event_bonus = f["lex_s"], f["event_bonus"]
+
+        # 權重調整：模型沒載到/信心低/串接模式跳過 → 提高詞典比重
+        if mdl_conf == 0.0:        # 沒模型或完全失敗
+            w_model, w_lex = 0.0, 1.0
+        elif mdl_conf < self.conf_cutoff:   # 信心偏低 → 預設 50/50
+            w_model, w_lex = self.low_conf_w_model, self.low_conf_w_lex
+        else:
+            w_model, w_lex = self.w_model, self.w_lex
+
+        final_score = w_model * mdl_s + w_lex * lex_s + event_bonus
+        final_score = max(-1.0, min(1.0, final_score))
+
+        if final_score > self.t_neu:
+            label = "positive"
+        elif final_score < -self.t_neu:
+            label = "negative"
+        else:
+            label = "neutral"
+        scores = {
+            "final": final_score, "model": mdl_s, "model_conf": mdl_conf,
+            "lexicon": lex_s, "event_bonus": event_bonus,
+        }
+        return self.build_result(f, label, scores, path, (w_model, w_lex))
+
+    def build_result(self, f: Features, label: str, scores: Dict, path: str,
+                     weights: Tuple[float, float] = (0.0, 1.0)) -> Dict:
+        keywords = KEYWORD_SOURCES[self.keywords](f)
+        topics = f["topics"]
+        return {
+            "label": label,
+            "keywords": keywords,
+            "topics": topics,
+            "summary": SUMMARIES[self.summary](label, scores, weights, keywords, topics),
+            "fallback": FALLBACKS[self.fallback](self, f, label, keywords, topics),
+            "path": path,
+            "scores": scores,
+        }
+
+    # ── 模型分數 ──────────────────────────────────────────────
+    def _encode_windows(self, texts: List[str]):
+        """
+        整批文字只跑一次 HF tokenizer（不截斷），依 token 切段
+        回傳 (windows, owners)：每段的 token id 與它屬於第幾篇
+        """
+        tokenizer, _ = self.model_registry.get()
+        prefix, suffix = _special_affixes(tokenizer)
+        size = min(self.chunk_tokens, self.max_len - len(prefix) - len(suffix))
+        break_ids = set(tokenizer.convert_tokens_to_ids(_SENTENCE_END)) - {tokenizer.unk_token_id}
+
+        encoded = tokenizer(texts, add_special_tokens=False, truncation=False)["input_ids"]
+        windows: List[List[int]] = []
+        owners: List[int] = []
+        for idx, ids in enumerate(encoded):
+            for w in _token_windows(ids, size, self.chunk_stride, break_ids):
+                windows.append(w)
+                owners.append(idx)
+        return windows, owners
+
+    def _score_batch(self, windows: List[List[int]]) -> List[Optional[Tuple[float, float]]]:
+        """已 tokenize 的多段直接補 [CLS]/[SEP] 與 padding，一次 forward，回傳每段 (score, conf)"""
+        import torch
+        tokenizer, model = self.model_registry.get()
+        prefix, suffix = _special_affixes(tokenizer)
+        inputs = tokenizer.pad({"input_ids": [prefix + w + suffix for w in windows]}, return_tensors="pt")
+        if "token_type_ids" in tokenizer.model_input_names and "token_type_ids" not in inputs:
+            inputs["token_type_ids"] = torch.zeros_like(inputs["input_ids"])
+        with torch.no_grad():
+            logits = model(**inputs).logits  # (batch, num_labels)
+        out = probs_to_scores(torch.softmax(logits, dim=-1))
+        if out is None:
+            return [None] * len(windows)
+        scores, confs = out
+        # 整批只同步一次（不是每個機率各 .item() 一次）
+        return list(zip(scores.tolist(), confs.tolist()))
+
+    def _score_chunks(self, windows: List[List[int]]) -> List[Optional[Tuple[float, float]]]:
+        """
+        分批推論多段，回傳與 windows 對齊的 [(score, conf) 或 None]
+        整批失敗才退回逐段推論，某段壞掉只略過那段
+        """
+        results: List[Optional[Tuple[float, float]]] = []
+        batch_size = max(1, self.model_batch_size)
+        for start in range(0, len(windows), batch_size):
+            batch = windows[start:start + batch_size]
+            FORWARD_BATCH_SIZES.observe(len(batch))
+            try:
+                results.extend(self._score_batch(batch))
+            except Exception:
+                for w in batch:
+                    try:
+                        results.extend(self._score_batch([w]))
+                    except Exception:
+                        results.append(None)
+        return results
+
+    def model_score_many(self, texts: List[str]) -> List[Tuple[float, float]]:
+        """
+        多篇文字的所有分段攤平後共用批次推論，再依篇取平均，回傳 [(score in [-1,1], avg_confidence)]
+        - num_labels == 3：視為 (neg, neu, pos)；== 2：視為 (neg, pos)；score = p_pos - p_neg
+        - 沒有模型或其他情況：(0, 0)
+        """
+        bundle = self.model_registry.get()
+        if bundle is None:
+            return [(0.0, 0.0)] * len(texts)
+        if self.model_registry.backend == "student":
+            # 蒸餾小模型：整篇直接評分，不切段、不經 HF tokenizer
+            with stage("model"):
+                return bundle[1].score_many(texts)
+
+        with stage("model"):
+            windows, owners = self._encode_windows(texts)
+            chunks = [0] * len(texts)
+            for idx in owners:
+                chunks[idx] += 1
+            for n in chunks:
+                CHUNKS_PER_TEXT.observe(n)
+
+            per_text: List[List[Tuple[float, float]]] = [[] for _ in texts]
+            for idx, r in zip(owners, self._score_chunks(windows)):
+                if r is not None:
+                    per_text[idx].append(r)
+        return [_average_chunks(results) for results in per_text]
+
+    def model_score(self, text: str) -> Tuple[float, float]:
+        """單篇；有 micro-batch scheduler 時和同時間的其他請求併成一批"""
+        if self._scheduler is not None:
+            # 排隊等併批 + 整批推論的等待時間；推論本身由 scheduler 的批次函式記在 model
+            with stage("model_wait"):
+                return self._scheduler.submit(text)
+        return self.model_score_many([text])[0]
+
+    # ── 單篇 / 批次 ───────────────────────────────────────────
+    def _unpack(self, result: Dict, message: str):
+        # 複製 list，避免呼叫端改到快取內容
+        return result["label"], message, list(result["keywords"]), list(result["topics"])
+
+    def _empty(self):
+        return "neutral", self.default_messages["neutral"], [], []
+
+    def _lookup(self, raw: str):
+        # 整個請求用同一份詞典（熱更新時不會新舊混用）
+        lex = self.lexicons.current
+        key = make_key(raw, self.analysis_version(lex))
+        return lex, key, self._result_cache.get(key)
+
+    def _cacheable(self, result: Dict) -> bool:
+        """
+        模型該用卻載入失敗時，結果只剩詞典分數，不能存在模型版本的 key 底下
+        （磁碟層還會被模型正常的其他 worker 讀到）；串接模式由詞典判定的結果不受影響
+        """
+        return result["path"] == "lexicon" or not (self.uses_model and self.model_registry.error is not None)
+
+    def _store(self, key: str, result: Dict) -> Dict:
+        self._count_path(result["path"])
+        if self._cacheable(result):
+            self._result_cache.set(key, result)
+        return result
+
+    def classify(self, text: str) -> Tuple[str, Dict]:
+        """回傳 (快取 key, 結果)；快取未命中才實際分析，沒用到的 stage 不會跑"""
+        raw = (text or "").strip()
+        lex, key, result = self._lookup(raw)
+        if result is None:
+            result = self._store(key, self.label(self.features(raw, lex)))
+        return key, result
+
+    def analyze(self, text: str, with_scores: bool = False):
+        """
+        回傳：(label, message, keywords, topics)，label ∈ {'positive','neutral','negative'}
+        with_scores=True 時多一個 scores dict（空白文字為 None），給分析歷史記錄分數用
+        """
+        if not (text or "").strip():
+            return self._empty() + ((None,) if with_scores else ())
+        key, result = self.classify(text)
+        return self._unpack(result, self.support_message(result, key)) + self._scores(result, with_scores)
+
+    def stream(self, text: str, with_scores: bool = False):
+        """
+        分兩段產出，讓前端先顯示分類結果：("result", {...}) → ("message", 鼓勵語)
+        with_scores=True 時 result 多一個 "scores" 鍵（送給前端前由呼叫端拿掉）
+        """
+        if not (text or "").strip():
+            label, message, _, _ = self._empty()
+            yield "result", {"sentiment": label, "keywords": [], "topics": []}
+            yield "message", message
+            return
+        key, result = self.classify(text)
+        yield "result", self._result_event(result, with_scores)
+        yield "message", self.support_message(result, key)
+
+    @staticmethod
+    def _scores(result: Dict, with_scores: bool) -> Tuple:
+        return (dict(result["scores"]),) if with_scores else ()
+
+    @staticmethod
+    def _result_event(result: Dict, with_scores: bool) -> Dict:
+        event = {
+            "sentiment": result["label"],
+            "keywords": list(result["keywords"]),
+            "topics": list(result["topics"]),
+        }
+        if with_scores:
+            event["scores"] = dict(result["scores"])
+        return event
+
+    def classify_batch(self, texts: List[str]) -> List[Optional[Tuple[str, Dict]]]:
+        """
+        批次版 classify：快取未命中的文字整批斷詞，需要模型的那些分段共用 forward pass
+        回傳與 texts 對齊的 [(快取 key, 結果)]；空白文字為 None
+        """
+        raws = [(t or "").strip() for t in texts]
+        lex = self.lexicons.current
+        version = self.analysis_version(lex)
+        keys = [make_key(r, version) if r else None for r in raws]
+        results = [self._result_cache.get(k) if k else None for k in keys]
+
+        todo = [i for i, r in enumerate(raws) if r and results[i] is None]
+        # 整批一起斷詞（批次工作開了 segmenter.enable_parallel 時會分給多個行程）
+        with stage("tokenize"):
+            tokenized = segmenter.cut_many([raws[i] for i in todo])
+        feats = {i: self.features(raws[i], lex, tokens=tokens) for i, tokens in zip(todo, tokenized)}
+        need = [i for i in todo if self.needs_model(feats[i])]
+        for i, (mdl_s, mdl_conf) in zip(need, self.model_score_many([raws[i] for i in need])):
+            feats[i].set(mdl_s=mdl_s, mdl_conf=mdl_conf)
+        for i in todo:
+            results[i] = self._store(keys[i], self.label(feats[i]))
+        return [(key, result) if raw else None for raw, key, result in zip(raws, keys, results)]
+
+    def analyze_batch(self, texts: List[str], use_gemini: bool = True, with_scores: bool = False):
+        """
+        批次版 analyze，回傳與 texts 對齊的 [(label, message, keywords, topics), ...]
+        use_gemini=False 時直接用規則式訊息；with_scores=True 時每筆多一個 scores dict（空白文字為 None）
+        """
+        out = []
+        for item in self.classify_batch(texts):
+            if item is None:
+                out.append(self._empty() + ((None,) if with_scores else ()))
+                continue
+            key, result = item
+            out.append(self._unpack(result, self.support_message(result, key, use_gemini=use_gemini))
+                       + self._scores(result, with_scores))
+        return out
+
+    # ── 訊息 ──────────────────────────────────────────────────
+    def support_message(self, result: Dict, key: str, use_gemini: bool = True) -> str:
+        """先查訊息快取 → Gemini → 備用訊息（備用訊息不進快取，下次仍會再試 Gemini）"""
+        if use_gemini:
+            cached = self._message_cache.get(key)
+            if cached is not None:
+                return cached
+            started = time.perf_counter()
+            gem, outcome = self.gemini_client.generate_with_outcome(result["summary"])
+            observe_gemini(outcome, time.perf_counter() - started)
+            if gem and gem.strip():
+                if self._cacheable(result):
+                    self._message_cache.set(key, gem.strip())
+                return gem.strip()
+        return result["fallback"]
+
+    async def support_message_async(self, result: Dict, key: str) -> str:
+        cached = self._message_cache.get(key)
+        if cached is not None:
+            return cached
+        started = time.perf_counter()
+        gem, outcome = await self.gemini_client.agenerate_with_outcome(result["summary"])
+        observe_gemini(outcome, time.perf_counter() - started)
+        if gem and gem.strip():
+            if self._cacheable(result):
+                self._message_cache.set(key, gem.strip())
+            return gem.strip()
+        return result["fallback"]
+
+    # ── asyncio 版 ────────────────────────────────────────────
+    # 斷詞、詞典與模型丟進呼叫端給的有界執行緒池；有 scheduler 時直接 await 它的 Future，
+    # Gemini 用 agenerate，都不佔 event loop
+    def _prepare(self, raw: str, lex: LexiconBundle) -> Tuple[Features, bool]:
+        f = self.features(raw, lex)
+        return f, self.needs_model(f)
+
+    async def classify_async(self, text: str, executor=None) -> Tuple[str, Dict]:
+        raw = (text or "").strip()
+        lex, key, result = await _in_executor(executor, self._lookup, raw)
+        if result is None:
+            f, needs_model = await _in_executor(executor, self._prepare, raw, lex)
+            if needs_model:
+                if self._scheduler is not None:
+                    with stage("model_wait"):
+                        mdl_s, mdl_conf = await asyncio.wrap_future(self._scheduler.submit_async(raw))
+                else:
+                    mdl_s, mdl_conf = await _in_executor(executor, lambda: self.model_score_many([raw])[0])
+                f.set(mdl_s=mdl_s, mdl_conf=mdl_conf)
+            result = await _in_executor(executor, lambda: self._store(key, self.label(f)))
+        return key, result
+
+    async def analyze_async(self, text: str, executor=None, with_scores: bool = False):
+        if not (text or "").strip():
+            return self._empty() + ((None,) if with_scores else ())
+        key, result = await self.classify_async(text, executor)
+        return self._unpack(result, await self.support_message_async(result, key)) + self._scores(result, with_scores)
+
+    async def analyze_batch_async(self, texts: List[str], executor=None, concurrency: int = 8):
+        """
+        analyze_batch 的 async 版：分類整批在一條執行緒上做完，鼓勵語則在 event loop 上
+        以最多 concurrency 個同時 await Gemini（不在執行緒裡逐篇同步等），
+        整批最久約 ⌈篇數 / concurrency⌉ 個 deadline，而不是篇數 × deadline
+        """
+        classified = await _in_executor(executor, self.classify_batch, texts)
+        limit = asyncio.Semaphore(max(1, concurrency))
+
+        async def one(item):
+            if item is None:
+                return self._empty()
+            key, result = item
+            async with limit:
+                return self._unpack(result, await self.support_message_async(result, key))
+
+        return list(await asyncio.gather(*(one(item) for item in classified)))
+
+    async def stream_async(self, text: str, executor=None, with_scores: bool = False):
+        if not (text or "").strip():
+            label, message, _, _ = self._empty()
+            yield "result", {"sentiment": label, "keywords": [], "topics": []}
+            yield "message", message
+            return
+        key, result = await self.classify_async(text, executor)
+        yield "result", self._result_event(result, with_scores)
+        yield "message", await self.support_message_async(result, key)
+
+    # ── 增量重算：日記反覆編修時，只重跑有變的句子與分段 ─────────
+    def _model_version(self) -> str:
+        """分段模型分數只跟模型與 token id 有關（切段參數已反映在 id 上）"""
+        r = self.model_registry
+        return f"{r.model_name}|{r.backend}|{r.onnx_path or ''}|{r.student_path or ''}"
+
+    def cached_tokens(self, raw: str, lex: LexiconBundle) -> Tuple[List[str], int, int]:
+        """逐句查斷詞快取，回傳 (整篇 tokens, 句數, 重用句數)；詞典換版（jieba 詞典跟著換）就重新斷詞"""
+        segments = split_segments(raw)
+        tokens: List[str] = []
+        reused = 0
+        for seg in segments:
+            key = _part_key(lex.version, seg)
+            seg_tokens = self._segment_cache.get(key)
+            if seg_tokens is None:
+                seg_tokens = segmenter.cut(seg)
+                self._segment_cache.set(key, seg_tokens)
+            else:
+                reused += 1
+            tokens.extend(seg_tokens)
+        return tokens, len(segments), reused
+
+    def cached_model_score(self, raw: str) -> Tuple[Tuple[float, float], int, int]:
+        """
+        整篇照常 tokenize 切段（切點與完整重算相同），只有快取裡沒有的分段才送進模型
+        回傳 ((score, conf), 段數, 重用段數)
+        """
+        if self.model_registry.get() is None:
+            return (0.0, 0.0), 0, 0
+        if self.model_registry.backend == "student":
+            # 學生模型整篇評分已經很便宜，不切段也不進分段快取
+            return self.model_score_many([raw])[0], 1, 0
+
+        with stage("model"):
+            windows, _ = self._encode_windows([raw])
+            CHUNKS_PER_TEXT.observe(len(windows))
+            version = self._model_version()
+            keys = [_part_key(version, ",".join(map(str, w))) for w in windows]
+            scored = [self._chunk_cache.get(k) for k in keys]
+            missing = [i for i, r in enumerate(scored) if r is None]
+            for i, r in zip(missing, self._score_chunks([windows[i] for i in missing])):
+                if r is not None:   # 推論失敗的段不進快取，下次再試
+                    scored[i] = r
+                    self._chunk_cache.set(keys[i], list(r))
+
+        results = [(r[0], r[1]) for r in scored if r is not None]
+        return _average_chunks(results), len(windows), len(windows) - len(missing)
+
+    def analyze_uncached_incremental(self, raw: str, lex: LexiconBundle) -> Dict:
+        """與快取未命中時的流程相同，只是斷詞與模型分數改從分段快取組回來"""
+        with stage("tokenize"):
+            tokens, n_segments, reused_segments = self.cached_tokens(raw, lex)
+        f = self.features(raw, lex, tokens=tokens)
+        n_chunks = reused_chunks = 0
+        if self.needs_model(f):
+            (mdl_s, mdl_conf), n_chunks, reused_chunks = self.cached_model_score(raw)
+            f.set(mdl_s=mdl_s, mdl_conf=mdl_conf)
+        result = self.label(f)
+        trace = current_trace()
+        if trace is not None:
+            trace.note(segments=n_segments, segments_reused=reused_segments,
+                       chunks=n_chunks, chunks_reused=reused_chunks)
+        return result
+
+    def analyze_incremental(self, text: str):
+        """
+        給「同一篇日記反覆存檔」用的 analyze，回傳值相同：(label, message, keywords, topics)
+        - 每句的斷詞結果、每個 token 分段的模型分數，各自以內容雜湊存在分段快取
+        - 存檔時整篇仍重新切句、切段（便宜），但只有改過的句子重新斷詞、內容變了的分段重新推論；
+          詞典分數、事件、final_score、關鍵詞與主題則用組回來的 tokens 與分段分數照常計算
+        - 不需要傳入舊版本：任何共用句子/分段的文字（包括別篇）都能重用
+        結果與完整重算相同；模型分數的唯一差異來源是分段被分在不同批次 forward（浮點誤差等級）
+        """
+        raw = (text or "").strip()
+        if not raw:
+            return self._empty()
+        lex, key, result = self._lookup(raw)
+        if result is None:
+            result = self._store(key, self.analyze_uncached_incremental(raw, lex))
+        return self._unpack(result, self.support_message(result, key))
+
+
+def _in_executor(executor, fn, *args):
+    """帶著目前的 contextvars 進執行緒池（請求追蹤、階段計時才會記在同一個請求上）"""
+    ctx = contextvars.copy_context()
+    return asyncio.get_running_loop().run_in_executor(executor, functools.partial(ctx.run, fn, *args))
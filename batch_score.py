@@ -0,0 +1,154 @@
+# backend/api/utils/batch_score.py
+"""
+批次情緒評分 CLI：JSONL 進、JSONL 出（串流處理，記憶體只放得下在途的幾批）
+
+用法：
+    python batch_score.py diaries.jsonl -o scored.jsonl --workers 4 --batch-size 32
+    cat diaries.jsonl | python batch_score.py - > scored.jsonl
+
+每行輸入是一個 JSON 物件，文字欄位預設為 "text"（--text-field 可改），其他欄位原樣保留；
+輸出多出 sentiment / keywords / topics / message，順序與輸入相同。
+
+回填分析歷史（history_store.py）：加上 --history-db，有使用者欄位的每一筆都會寫進去，
+時間取 --time-field（epoch 秒或 ISO 8601），--id-field 當 diary_id（重跑會取代而不是重複）：
+    python batch_score.py diaries.jsonl -o scored.jsonl --history-db history.db
+"""
+from __future__ import annotations
+from typing import Iterator, List, Dict, Optional, Tuple
+import argparse
+import json
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import segmenter
+from history_store import HistoryStore
+
+# emotion_models 不在頂層 import：斷詞行程池的子行程會重新 import 這個模組，
+# 不該在每個子行程裡載詞庫、開模型載入與 Gemini 執行緒
+
+
+def _read_batches(fp, batch_size: int) -> Iterator[List[Tuple[int, str]]]:
+    batch: List[Tuple[int, str]] = []
+    for lineno, line in enumerate(fp, 1):
+        if not line.strip():
+            continue
+        batch.append((lineno, line))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _score_batch(batch: List[Tuple[int, str]], text_field: str, use_gemini: bool,
+                 history: Optional[HistoryStore] = None, fields: Tuple[str, str, str] = ("user_id", "created_at", "id")) -> List[Dict]:
+    records: List[Dict] = []
+    texts: List[str] = []
+    slots: List[int] = []
+    for lineno, line in batch:
+        try:
+            rec = json.loads(line)
+            if not isinstance(rec, dict):
+                raise ValueError("每行必須是 JSON 物件")
+        except ValueError as e:
+            records.append({"line": lineno, "error": str(e)})
+            continue
+        text = rec.get(text_field)
+        if not isinstance(text, str):
+            rec["error"] = f"缺少字串欄位 {text_field!r}"
+            records.append(rec)
+            continue
+        slots.append(len(records))
+        records.append(rec)
+        texts.append(text)
+
+    from emotion_models import analyze_sentiment_batch, analysis_version
+
+    results = analyze_sentiment_batch(texts, use_gemini=use_gemini, with_scores=True)
+    version = analysis_version() if history is not None else None
+    user_field, time_field, id_field = fields
+    for idx, (label, message, keywords, topics, scores) in zip(slots, results):
+        rec = records[idx]
+        rec.update({"sentiment": label, "keywords": keywords, "topics": topics, "message": message})
+        if history is not None and rec.get(user_field) is not None:
+            try:
+                history.record(rec[user_field], label, keywords, topics, scores, rec.get(time_field),
+                               rec.get(id_field), version)
+            except ValueError as e:   # 時間格式不對之類：照樣輸出評分，只是不進歷史
+                rec["history_error"] = str(e)
+    return records
+
+
+def run(fin, fout, batch_size: int = 32, workers: int = 2, text_field: str = "text",
+        use_gemini: bool = False, progress_every: float = 5.0,
+        history: Optional[HistoryStore] = None, fields: Tuple[str, str, str] = ("user_id", "created_at", "id")) -> int:
+    """回傳處理筆數；最多 workers*2 批在途，輸出依輸入順序寫出"""
+    done = 0
+    started = last_report = time.monotonic()
+    inflight = deque()
+
+    def _drain_one():
+        nonlocal done, last_report
+        for rec in inflight.popleft().result():
+            fout.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            done += 1
+        now = time.monotonic()
+        if progress_every and now - last_report >= progress_every:
+            last_report = now
+            rate = done / max(now - started, 1e-9)
+            print(f"… 已處理 {done} 筆（{rate:.1f} 筆/秒）", file=sys.stderr)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        for batch in _read_batches(fin, max(1, batch_size)):
+            inflight.append(pool.submit(_score_batch, batch, text_field, use_gemini, history, fields))
+            if len(inflight) >= max(1, workers) * 2:
+                _drain_one()
+        while inflight:
+            _drain_one()
+
+    elapsed = time.monotonic() - started
+    print(f"✅ 完成 {done} 筆，耗時 {elapsed:.1f}s（{done / max(elapsed, 1e-9):.1f} 筆/秒）", file=sys.stderr)
+    return done
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="批次情緒評分（JSONL → JSONL）")
+    ap.add_argument("input", help="輸入 JSONL 檔，- 代表 stdin")
+    ap.add_argument("-o", "--output", default="-", help="輸出 JSONL 檔，預設 stdout")
+    ap.add_argument("--batch-size", type=int, default=32, help="每批幾篇（共用一次模型推論）")
+    ap.add_argument("--workers", type=int, default=2, help="同時處理幾批")
+    ap.add_argument("--text-field", default="text", help="文字欄位名稱")
+    ap.add_argument("--gemini", action="store_true", help="逐篇呼叫 Gemini 產生訊息（預設用規則式訊息）")
+    ap.add_argument("--progress-every", type=float, default=5.0, help="每幾秒回報一次進度，0 為關閉")
+    ap.add_argument("--seg-processes", type=int, default=segmenter.SEGMENT_PROCESSES,
+                    help="斷詞用幾個行程（0 = 不開行程池；批次夠大才有幫助）")
+    ap.add_argument("--history-db", help="同時寫入分析歷史（SQLite 檔）")
+    ap.add_argument("--user-field", default="user_id", help="使用者欄位（沒有這個欄位的筆不寫入歷史）")
+    ap.add_argument("--time-field", default="created_at", help="日記時間欄位；缺少時用現在時間")
+    ap.add_argument("--id-field", default="id", help="日記 id 欄位（當 diary_id）")
+    args = ap.parse_args(argv)
+
+    history = HistoryStore(args.history_db) if args.history_db else None
+    if args.seg_processes:
+        from emotion_models import lexicons
+
+        segmenter.enable_parallel(args.seg_processes, lexicons)
+
+    fin = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8")
+    fout = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    try:
+        run(fin, fout, args.batch_size, args.workers, args.text_field, args.gemini, args.progress_every,
+            history, (args.user_field, args.time_field, args.id_field))
+    finally:
+        segmenter.disable_parallel()
+        if fin is not sys.stdin:
+            fin.close()
+        if fout is not sys.stdout:
+            fout.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
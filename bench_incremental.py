@@ -0,0 +1,113 @@
+# backend/api/utils/bench_incremental.py
+"""
+增量重算（AnalysisEngine.analyze_uncached_incremental）的檢查與量測
+
+用法：
+    python bench_incremental.py bench.jsonl
+    python bench_incremental.py --lexicon -n 500             # 省略語料則現場產生；--lexicon 不載模型
+
+每篇先分析一次（填分段快取），再模擬改一句、補一句、刪一句，分別用增量與完整流程重算並逐欄比對；
+有任何一篇不同就以非 0 結束，可直接當檢查用。另外回報分段/分塊快取的重用率與兩種流程的延遲
+"""
+from __future__ import annotations
+from typing import Callable, Dict, List, Optional, Tuple
+import argparse
+import random
+import sys
+import time
+from collections import defaultdict
+
+from benchmark import (corpus_args, load_impl, make_sentence, percentiles, prepare_env, print_report,
+                       read_corpus, warm_up)
+
+
+def make_edits(text: str, rng: random.Random, split: Callable[[str], List[str]]) -> List[Tuple[str, str]]:
+    """模擬使用者編修：改一句、在結尾補一句、刪一句；回傳 [(種類, 編修後文字)]"""
+    segments = split(text)
+    edits = [("append", text + make_sentence(rng))]
+    if len(segments) > 1:
+        i = rng.randrange(len(segments))
+        edits.append(("rewrite", "".join(segments[:i] + [make_sentence(rng)] + segments[i + 1:])))
+        edits.append(("delete", "".join(segments[:i] + segments[i + 1:])))
+    return edits
+
+
+def _full_result(mod, raw: str, lex) -> Dict:
+    """analyze_sentiment 快取未命中時的完整流程（不產生訊息）"""
+    return mod.engine.label(mod.engine.features(raw, lex))
+
+
+def bench_incremental(rows: List[Dict], lexicon: bool = False, seed: int = 0) -> Dict:
+    """
+    每篇先分析一次（填分段快取），再做幾種編修，分別用增量與完整流程重算並逐欄比對
+    exact：整個結果 dict 完全相同；float_only：只有模型分數在浮點誤差內不同（分段在不同批次 forward）
+    """
+    stub = prepare_env(lexicon, 0.0)
+    try:
+        mod = load_impl("backend")
+        from analysis_engine import split_segments
+        rng = random.Random(seed)
+        lex = mod.lexicons.current
+        warm_up(mod, 3)
+        timings: Dict[str, List[float]] = defaultdict(list)
+        outcome = {"exact": 0, "float_only": 0, "mismatch": 0}
+        mismatches = []
+        before = mod.cache_stats()
+
+        for row in rows:
+            raw = row["text"].strip()
+            if not raw:
+                continue
+            mod.engine.analyze_uncached_incremental(raw, lex)
+            for kind, edited in make_edits(raw, rng, split_segments):
+                edited = edited.strip()
+                t0 = time.perf_counter()
+                inc = mod.engine.analyze_uncached_incremental(edited, lex)
+                timings["incremental"].append(time.perf_counter() - t0)
+                t0 = time.perf_counter()
+                full = _full_result(mod, edited, lex)
+                timings["full"].append(time.perf_counter() - t0)
+
+                if inc == full:
+                    outcome["exact"] += 1
+                elif (all(inc[k] == full[k] for k in ("label", "keywords", "topics", "path"))
+                      and abs(inc["scores"]["final"] - full["scores"]["final"]) < 1e-6):
+                    outcome["float_only"] += 1
+                else:
+                    outcome["mismatch"] += 1
+                    mismatches.append({"id": row["id"], "edit": kind,
+                                       "incremental": inc["scores"], "full": full["scores"]})
+        after = mod.cache_stats()
+    finally:
+        stub.stop()
+
+    def reuse(name: str) -> Dict:
+        hits = after[name]["hits"] - before[name]["hits"]
+        misses = after[name]["misses"] - before[name]["misses"]
+        return {"hits": hits, "misses": misses, "reuse_rate": hits / (hits + misses) if hits + misses else 0.0}
+
+    return {
+        "texts": len(rows),
+        "edits": sum(outcome.values()),
+        "model": mod.model_registry.stats(),
+        "outcome": outcome,
+        "mismatches": mismatches[:20],
+        # 包含每篇第一次（冷）分析，重用率因此偏保守
+        "segments": reuse("segment"),
+        "chunks": reuse("chunk"),
+        "latency_ms": {name: percentiles(v) for name, v in timings.items()},
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="編修後的增量重算：與完整重算逐欄比對，並量重用率與延遲")
+    corpus_args(ap)
+    args = ap.parse_args(argv)
+
+    report = bench_incremental(read_corpus(args.corpus, args.n, args.seed), args.lexicon, args.seed)
+    print_report(report)
+    return 1 if report["outcome"]["mismatch"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
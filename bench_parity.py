@@ -0,0 +1,168 @@
+# backend/api/utils/bench_parity.py
+"""
+與舊版比對（例如兩套實作合併成 analysis_engine 前後）
+
+用法：
+    python bench_parity.py --baseline <rev> bench.jsonl
+    python bench_parity.py --baseline <rev> --lexicon -n 300   # 省略語料則現場產生；--lexicon 不載模型
+
+兩套實作各自在 baseline 版本（git archive 解到暫存目錄）與目前的工作目錄跑同一份語料，
+比對 label / keywords / topics，並並排列出延遲、forward 次數與峰值 RSS；
+標籤有任何一篇不同就以非 0 結束
+"""
+from __future__ import annotations
+from typing import Dict, List, Optional
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from benchmark import IMPLS, ROOT, corpus_args, percentiles, prepare_env, print_report, read_corpus
+
+# 在指定的程式碼目錄裡跑某個實作的 analyze_sentiment；只用新舊版都有的介面，結果寫成 JSON 檔
+_PARITY_RUNNER = r"""
+import json, os, resource, sys, threading, time
+root, impl, corpus, out_path = sys.argv[1:5]
+sys.path.insert(0, root)
+
+# forward 次數與段數：包住最外層的 torch 模型呼叫自己數（舊版沒有 metrics.py，不能靠它）
+counted = [0, 0]
+try:
+    import torch
+except ImportError:
+    torch = None
+if torch is not None:
+    depth = threading.local()
+    module_call = torch.nn.Module.__call__
+
+    def counting_call(self, *args, **kwargs):
+        outer = not getattr(depth, "n", 0)
+        depth.n = getattr(depth, "n", 0) + 1
+        try:
+            out = module_call(self, *args, **kwargs)
+        finally:
+            depth.n -= 1
+        if outer:
+            ids = kwargs.get("input_ids", args[0] if args else None)
+            counted[0] += 1
+            counted[1] += int(ids.shape[0]) if getattr(ids, "ndim", 0) else 0
+        return out
+
+    torch.nn.Module.__call__ = counting_call
+
+def forwards():
+    return counted[0], counted[1]
+
+if impl == "demo":
+    sys.path.insert(0, os.path.join(root, "ai_test_done"))
+    import emotion_model as mod
+else:
+    import emotion_models as mod
+
+texts = [json.loads(line)["text"] for line in open(corpus, encoding="utf-8")]
+mod.analyze_sentiment("今天去動物園，心情很好！😀")
+passes0, items0 = forwards()
+results, latency = [], []
+for text in texts:
+    t0 = time.perf_counter()
+    label, _, keywords, topics = mod.analyze_sentiment(text)
+    latency.append(time.perf_counter() - t0)
+    results.append([label, keywords, topics])
+passes, items = forwards()
+with open(out_path, "w", encoding="utf-8") as f:
+    json.dump({"results": results, "latency": latency,
+               "forward_passes": int(passes - passes0), "forward_items": int(items - items0),
+               "max_rss_kib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}, f, ensure_ascii=False)
+"""
+
+
+def _checkout(rev: str, dest: str) -> None:
+    """把某個 git 版本的檔案解到 dest（不動目前的工作目錄）"""
+    import io
+    import tarfile
+
+    archive = subprocess.run(["git", "archive", "--format=tar", rev], cwd=ROOT, capture_output=True, check=True)
+    with tarfile.open(fileobj=io.BytesIO(archive.stdout)) as tar:
+        tar.extractall(dest)
+
+
+def _parity_run(root: str, impl: str, corpus: str, workdir: str) -> Dict:
+    out_path = os.path.join(workdir, f"{impl}-{len(os.listdir(workdir))}.json")
+    proc = subprocess.run([sys.executable, "-c", _PARITY_RUNNER, root, impl, corpus, out_path],
+                          capture_output=True, text=True, cwd=root)
+    if proc.returncode != 0:
+        print(proc.stderr, file=sys.stderr)
+        raise RuntimeError(f"{impl}（{root}）執行失敗（exit {proc.returncode}）")
+    with open(out_path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def bench_parity(rows: List[Dict], baseline: str, lexicon: bool = False, gemini_delay: float = 0.0,
+                 examples: int = 10) -> Dict:
+    """
+    兩套實作各自在 baseline 版本與目前的工作目錄跑同一份語料（每次一個子行程），比對：
+    - label / keywords / topics 逐篇一致率與不一致的範例
+    - 端到端延遲百分位、forward pass 次數與送進模型的段數（兩邊都以包住 torch 模型呼叫的方式計數）、峰值 RSS
+    """
+    stub = prepare_env(lexicon, gemini_delay)
+    # 兩邊共用同一份 jieba 字典快取，不讓舊版的冷啟動算進比較
+    os.environ.setdefault("JIEBA_CACHE_DIR", os.path.join(ROOT, ".cache", "jieba"))
+    reports = {}
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            base_dir = os.path.join(tmp, "baseline")
+            work_dir = os.path.join(tmp, "out")
+            os.makedirs(work_dir)
+            _checkout(baseline, base_dir)
+            corpus = os.path.join(tmp, "corpus.jsonl")
+            with open(corpus, "w", encoding="utf-8") as f:
+                for row in rows:
+                    f.write(json.dumps({"text": row["text"]}, ensure_ascii=False) + "\n")
+
+            for impl in IMPLS:
+                old = _parity_run(base_dir, impl, corpus, work_dir)
+                new = _parity_run(ROOT, impl, corpus, work_dir)
+                agree = {"label": 0, "keywords": 0, "topics": 0}
+                diffs = []
+                for row, a, b in zip(rows, old["results"], new["results"]):
+                    for i, field in enumerate(agree):
+                        agree[field] += a[i] == b[i]
+                    if a != b and len(diffs) < examples:
+                        diffs.append({"id": row.get("id"), "text": row["text"][:80], "baseline": a, "current": b})
+                n = len(rows)
+                reports[impl] = {
+                    "agreement": {k: (v / n if n else 0.0) for k, v in agree.items()},
+                    "disagreements": diffs,
+                    **{side: {
+                        "latency_ms": percentiles(r["latency"]),
+                        "forward_passes": r["forward_passes"],
+                        "forward_items": r["forward_items"],
+                        "max_rss_mib": r["max_rss_kib"] / 1024,
+                    } for side, r in (("baseline", old), ("current", new))},
+                }
+    finally:
+        stub.stop()
+    return {"baseline": baseline, "texts": len(rows), "impls": reports}
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="與某個 git 版本的兩套實作比對結果、延遲與 forward 次數")
+    corpus_args(ap)
+    ap.add_argument("--baseline", required=True, help="比對對象的 git 版本（commit、tag 或 branch）")
+    args = ap.parse_args(argv)
+
+    report = bench_parity(read_corpus(args.corpus, args.n, args.seed), args.baseline, args.lexicon, args.gemini_delay)
+    print_report(report)
+    for impl, r in report["impls"].items():
+        a, old, new = r["agreement"], r["baseline"], r["current"]
+        print(f"{impl:<8} label {a['label']:.1%}  keywords {a['keywords']:.1%}  topics {a['topics']:.1%}  "
+              f"p50 {old['latency_ms'].get('p50', 0):.2f} → {new['latency_ms'].get('p50', 0):.2f} ms  "
+              f"forward {old['forward_passes']} → {new['forward_passes']}", file=sys.stderr)
+    # 標籤有任何一篇不同就以非 0 結束
+    return 1 if any(r["agreement"]["label"] < 1.0 for r in report["impls"].values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
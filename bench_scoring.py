@@ -0,0 +1,145 @@
+# backend/api/utils/bench_scoring.py
+"""
+詞典評分的量測：單次走訪（token_scorer）vs 原本的逐遍計算
+
+用法：
+    python bench_scoring.py bench.jsonl
+    python bench_scoring.py -n 5000 --lexicon-dir lexicons/demo   # 省略語料則現場產生；量配置建議 1000 篇以上
+
+同一份 tokens 兩種算法逐篇比對（有任何一篇不同就以非 0 結束），並量整批耗時、
+每篇的暫時配置高峰與留下來的結果大小
+"""
+from __future__ import annotations
+from typing import Dict, List, Optional, Tuple
+import argparse
+import os
+import sys
+
+from benchmark import ROOT, best_of, corpus_args, max_rss_mib, print_report, read_corpus
+
+
+def _old_score(text: str, lex) -> Tuple:
+    """原本的作法：斷詞成 list，再分別走詞典分數、驚嘆號、正負詞個數、關鍵詞、主題"""
+    import segmenter
+
+    tokens = segmenter.cut(text)
+    positive, negative, emoji = lex["positive"], lex["negative"], lex.emoji
+    negations, strong, weak = lex["negations"], lex["strong_intensifiers"], lex["weak_intensifiers"]
+    score = 0.0
+    hits = pos_hits = neg_hits = 0
+    for i, w in enumerate(tokens):
+        if w in positive:
+            base = 1.0
+        elif w in negative:
+            base = -1.0
+        elif w in emoji:
+            base = float(emoji[w])
+        else:
+            continue
+        modifier = 1.0
+        prev = tokens[i-1] if i > 0 else ""
+        if prev in negations:
+            base *= -1.0
+        if prev in strong:
+            modifier *= 1.5
+        elif prev in weak:
+            modifier *= 1.2
+        score += base * modifier
+        hits += 1
+        if base > 0:
+            pos_hits += 1
+        elif base < 0:
+            neg_hits += 1
+    score += min(0.3, sum(1 for t in tokens if t in ["!", "！", "!!!", "！！"]) * 0.1)
+    lex_s = max(-1.0, min(1.0, score / (hits * 1.5))) if hits else 0.0
+    if not hits:
+        pos_hits = neg_hits = 0
+    cats = [lex.matcher.categories(w) for w in tokens]
+    pos_count = sum(1 for c in cats if "positive" in c)
+    neg_count = sum(1 for c in cats if "negative" in c)
+    keywords = [w for w in tokens if (w in positive or w in negative or w in emoji)]
+    token_cats = {c for w in tokens for c in lex.matcher.categories(w)}
+    topics = [name for cat, name in (("awareness", "自我覺察"), ("control", "自我控制"), ("management", "自我管理"))
+              if cat in token_cats]
+    return lex_s, pos_hits, neg_hits, pos_count, neg_count, keywords, topics
+
+
+def _new_score(text: str, lex):
+    """token_scorer：邊斷詞邊評分，結果是 TokenScore（關鍵詞是 id 陣列）"""
+    import segmenter
+    from token_scorer import score_tokens
+
+    return score_tokens(segmenter.iter_cut(text), lex.table)
+
+
+def _score_tuple(sc, lex) -> Tuple:
+    from analysis_engine import TOPIC_NAMES
+
+    return (sc.lex_s, sc.pos_hits, sc.neg_hits, sc.pos_count, sc.neg_count,
+            lex.table.words(sc.keyword_ids), sc.topics(TOPIC_NAMES))
+
+
+def bench_scoring(rows: List[Dict], lexicon_dir: str, repeat: int = 3) -> Dict:
+    """
+    同一份 tokens 的兩種算法：逐篇比對結果，量整批耗時（best of repeat）、
+    每篇的暫時配置高峰（tracemalloc peak）與留下來的結果大小
+    """
+    import segmenter
+    import tracemalloc
+    from lexicon_bundle import LexiconStore
+
+    segmenter.initialize()
+    lex = LexiconStore(lexicon_dir).current
+    texts = [r["text"] for r in rows]
+
+    mismatches = []
+    for row in rows:
+        old, new = _old_score(row["text"], lex), _score_tuple(_new_score(row["text"], lex), lex)
+        if old != new and len(mismatches) < 20:
+            mismatches.append({"id": row.get("id"), "old": old, "new": new})
+
+    def measure(fn) -> Dict:
+        best = best_of(lambda: [fn(t, lex) for t in texts], repeat)
+        peaks, kept = [], []
+        tracemalloc.start()
+        try:
+            for t in texts:
+                tracemalloc.reset_peak()
+                base = tracemalloc.get_traced_memory()[0]
+                out = fn(t, lex)
+                current, peak = tracemalloc.get_traced_memory()
+                peaks.append(peak - base)
+                kept.append(current - base)
+                del out
+        finally:
+            tracemalloc.stop()
+        return {
+            "batch_ms": best * 1000,
+            "per_text_us": best / len(texts) * 1e6 if texts else 0.0,
+            "peak_bytes_per_text": sum(peaks) / len(peaks) if peaks else 0.0,
+            "retained_bytes_per_text": sum(kept) / len(kept) if kept else 0.0,
+        }
+
+    return {
+        "texts": len(texts),
+        "lexicon": lex.name,
+        "mismatches": mismatches,
+        "multi_pass": measure(_old_score),
+        "single_pass": measure(_new_score),
+        "max_rss_mib": max_rss_mib(),
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="單次走訪詞典評分 vs 逐遍計算：結果比對、耗時與每篇配置量")
+    corpus_args(ap, n=2000, env=False)
+    ap.add_argument("--lexicon-dir", default=os.path.join(ROOT, "lexicons", "backend"))
+    args = ap.parse_args(argv)
+
+    report = bench_scoring(read_corpus(args.corpus, args.n, args.seed), args.lexicon_dir)
+    print_report(report)
+    return 1 if report["mismatches"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,107 @@
+# backend/api/utils/bench_segmentation.py
+"""
+斷詞（segmenter.py）的量測：jieba 初始化（冷/暖快取）、首篇延遲、單篇與批次斷詞
+
+用法：
+    python bench_segmentation.py bench.jsonl
+    python bench_segmentation.py --processes 4 -n 5000      # 省略語料則現場產生；批次量測建議 1000 篇以上
+
+- cold_start / warm_cache_start：各開一個全新行程量 initialize 與第一篇 cut（空的快取目錄 / 上一步寫好的快取）
+- pretokenize：改版前 emoji、標點各一次 re.sub 與目前單次走訪的耗時（兩者結果必須相同）
+- cut_many：單行程與 --processes 個行程的整批斷詞
+"""
+from __future__ import annotations
+from typing import Dict, List, Optional
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmark import ROOT, best_of, corpus_args, max_rss_mib, percentiles, print_report, read_corpus
+
+# 改版前的前處理：emoji 與標點各做一次 re.sub，留著當對照組
+_OLD_EMOJI_RE = re.compile("[\U0001F300-\U0001F6FF\U0001F900-\U0001F9FF\U0001F1E6-\U0001F1FF\u2600-\u26FF\u2700-\u27BF]+")
+_OLD_PUNCT_RE = re.compile(r"([!?！？。，,.…~])")
+
+
+def _old_pretokenize(text: str) -> str:
+    text = _OLD_EMOJI_RE.sub(lambda m: f" {m.group(0)} ", text)
+    return _OLD_PUNCT_RE.sub(r" \1 ", text)
+
+
+def _init_in_subprocess(cache_dir: str) -> Dict:
+    """全新行程裡量 initialize 與第一篇 cut（本行程的 jieba 早就初始化過了，量不到）"""
+    code = (
+        "import json, time, segmenter\n"
+        "t = segmenter.initialize()\n"
+        "s = time.perf_counter(); segmenter.cut('今天去動物園好開心😀'); f = time.perf_counter() - s\n"
+        "print(json.dumps({'init_seconds': t, 'first_cut_ms': f * 1000}))\n"
+    )
+    env = dict(os.environ, JIEBA_CACHE_DIR=cache_dir)
+    proc = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, cwd=ROOT, env=env)
+    if proc.returncode != 0:
+        print(proc.stderr, file=sys.stderr)
+        raise RuntimeError(f"segmenter 初始化失敗（exit {proc.returncode}）")
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def bench_segmentation(rows: List[Dict], processes: int = 0, repeat: int = 3) -> Dict:
+    import segmenter
+
+    texts = [r["text"] for r in rows]
+    with tempfile.TemporaryDirectory(prefix="jieba-cache-") as d:
+        cold = _init_in_subprocess(d)   # 空目錄：要從 dict.txt 建 prefix dict 並寫快取
+        warm = _init_in_subprocess(d)   # 同一個目錄：直接讀上一步寫好的快取
+
+    segmenter.initialize()
+    for t in texts[:3]:
+        segmenter.cut(t)
+    per_text = []
+    for t in texts:
+        started = time.perf_counter()
+        segmenter.cut(t)
+        per_text.append(time.perf_counter() - started)
+
+    for t in texts:
+        assert _old_pretokenize(t) == segmenter.pretokenize(t), "前處理結果與舊版不同"
+    pretok = {
+        "two_pass_ms": best_of(lambda: [_old_pretokenize(t) for t in texts], repeat) * 1000,
+        "single_pass_ms": best_of(lambda: [segmenter.pretokenize(t) for t in texts], repeat) * 1000,
+    }
+
+    batch = {"texts": len(texts), "sequential_ms": best_of(lambda: segmenter.cut_many(texts), repeat) * 1000}
+    used = segmenter.enable_parallel(processes)
+    try:
+        if used:
+            segmenter.cut_many(texts)   # 讓行程池先把 worker 都開起來
+            batch["parallel_ms"] = best_of(lambda: segmenter.cut_many(texts), repeat) * 1000
+            batch["processes"] = used
+    finally:
+        segmenter.disable_parallel()
+
+    return {
+        "cold_start": cold,
+        "warm_cache_start": warm,
+        "cut_ms": percentiles(per_text),
+        "pretokenize": pretok,
+        "cut_many": batch,
+        "max_rss_mib": max_rss_mib(),
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="jieba 初始化（冷/暖快取）、首篇延遲、單篇與批次斷詞")
+    corpus_args(ap, n=2000, env=False)
+    ap.add_argument("--processes", type=int, default=0, help="cut_many 行程數（0 = CPU 核心數）")
+    args = ap.parse_args(argv)
+
+    print_report(bench_segmentation(read_corpus(args.corpus, args.n, args.seed), args.processes))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,115 @@
+# backend/api/utils/bench_student.py
+"""
+蒸餾小模型（MODEL_BACKEND=student）vs 老師：模型吞吐倍數與融合後標籤一致率
+
+用法：
+    python bench_student.py --teacher teacher.jsonl                  # 語料與老師分數取自 student_model.py label 的輸出
+    python bench_student.py bench.jsonl --student models/student.npz # 沒給 --teacher：整份語料現場跑一次老師
+
+融合後標籤一致率低於 --min-agreement 則以非 0 結束
+"""
+from __future__ import annotations
+from typing import Dict, List, Optional
+import argparse
+import os
+import sys
+
+from benchmark import corpus_args, max_rss_mib, print_report, read_corpus, texts_per_sec
+
+
+def bench_student(rows: List[Dict], student_path: str, teacher_path: Optional[str] = None,
+                  teacher_sample: int = 256, batch_size: int = 32, examples: int = 10) -> Dict:
+    """
+    老師是目前 MODEL_BACKEND 的模型（預設 torch fp32），學生是 student_path：
+    - 吞吐：兩者各自分批評分的每秒篇數（只量模型這一段，斷詞/詞典各自另算）與倍數
+    - 一致率：同一份詞典特徵分別配上老師/學生的 (score, conf) 走 engine.fuse，比較融合後標籤
+    給 --teacher（student_model.py label 的輸出）時，語料與老師分數都取自檔案，
+    老師只跑前 teacher_sample 篇量吞吐；沒給就整份語料都跑一次老師
+    """
+    from emotion_models import engine
+    from student_model import StudentClassifier, read_teacher
+
+    if teacher_path:
+        texts, mdl_s, mdl_conf, _ = read_teacher(teacher_path)
+        teacher = list(zip(mdl_s, mdl_conf))
+        timed = texts[:teacher_sample]
+    else:
+        texts = [r["text"].strip() for r in rows if r["text"].strip()]
+        timed = texts
+    engine.model_score_many(texts[:2])   # 載入模型，不算進吞吐
+    measured, teacher_tps = texts_per_sec(engine.model_score_many, timed, batch_size)
+    if not teacher_path:
+        teacher = measured
+    teacher_loaded = any(c != 0.0 for _, c in measured)
+    if not teacher_loaded:
+        print("⚠️ 老師模型沒有載入，老師吞吐沒有參考價值", file=sys.stderr)
+
+    student = StudentClassifier.load(student_path, engine.lexicons.src_dir)
+    student.score_many(texts[:2])
+    predicted, student_tps = texts_per_sec(student.score_many, texts, batch_size, repeat=3)
+
+    labels = ("negative", "neutral", "positive")
+    confusion = {t: {s: 0 for s in labels} for t in labels}
+    agree = sign_agree = 0
+    abs_err = 0.0
+    diffs = []
+    for text, (t_s, t_c), (s_s, s_c) in zip(texts, teacher, predicted):
+        f = engine.features(text)
+        a, b = engine.fuse(f, t_s, t_c)["label"], engine.fuse(f, s_s, s_c)["label"]
+        confusion[a][b] += 1
+        agree += a == b
+        sign_agree += (t_s > 0) == (s_s > 0)
+        abs_err += abs(t_s - s_s)
+        if a != b and len(diffs) < examples:
+            diffs.append({"text": text[:80], "teacher": a, "student": b,
+                          "teacher_score": t_s, "student_score": s_s})
+    n = len(texts)
+    return {
+        "texts": n,
+        "teacher": {
+            "backend": engine.model_registry.backend,
+            "loaded": teacher_loaded,
+            "timed_texts": len(timed),
+            "texts_per_sec": teacher_tps if teacher_loaded else None,
+        },
+        "student": {
+            "path": student_path,
+            "version": student.version,
+            "param_bytes": student.param_bytes,
+            "words": student.words,
+            "texts_per_sec": student_tps,
+        },
+        "speedup": student_tps / teacher_tps if teacher_loaded and teacher_tps else None,
+        "agreement": {
+            "fused_label": agree / n if n else 1.0,
+            "score_sign": sign_agree / n if n else 1.0,
+            "score_mae": abs_err / n if n else 0.0,
+        },
+        "confusion": confusion,
+        "disagreements": diffs,
+        "max_rss_mib": max_rss_mib(),
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="蒸餾小模型 vs 老師：模型吞吐倍數與融合後標籤一致率")
+    corpus_args(ap, n=500, env=False)
+    ap.add_argument("--student", default=os.getenv("STUDENT_MODEL_PATH") or os.path.join("models", "student.npz"))
+    ap.add_argument("--teacher", help="student_model.py label 的輸出（老師分數直接取用，此時不用給語料）")
+    ap.add_argument("--teacher-sample", type=int, default=256, help="給 --teacher 時，老師量吞吐的篇數")
+    ap.add_argument("--batch-size", type=int, default=32)
+    ap.add_argument("--min-agreement", type=float, default=0.9, help="融合後標籤一致率低於此值則回傳非 0")
+    args = ap.parse_args(argv)
+
+    rows = [] if args.teacher else read_corpus(args.corpus, args.n, args.seed)
+    report = bench_student(rows, args.student, args.teacher, args.teacher_sample, args.batch_size)
+    print_report(report)
+    t, st = report["teacher"], report["student"]
+    print(f"teacher {t['texts_per_sec'] or 0:8.1f} texts/s  student {st['texts_per_sec']:8.1f} texts/s  "
+          f"speedup {report['speedup'] or 0:.1f}x  fused-label agreement {report['agreement']['fused_label']:.1%}",
+          file=sys.stderr)
+    return 1 if report["agreement"]["fused_label"] < args.min_agreement else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
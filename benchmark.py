@@ -0,0 +1,481 @@
+# backend/api/utils/benchmark.py
+"""
+分析流程的基準測試與剖析工具（Gemini 一律打本機 stub，不會連到外部）
+
+子指令：
+    python benchmark.py corpus -n 500 -o bench.jsonl          # 產生合成日記語料（可重現，--seed）
+    python benchmark.py stages --impl backend bench.jsonl     # 各階段延遲百分位 + 端到端 + 記憶體高水位
+    python benchmark.py stages --impl demo bench.jsonl        # 同上，量 ai_test_done/emotion_model.py
+    python benchmark.py compare bench.jsonl                   # 兩套實作各開一個子行程跑 stages，並排比較
+    python benchmark.py load --concurrency 1 4 16 bench.jsonl # 對 Flask app 的 /analyze 做併發壓測
+
+針對單一元件的比對/量測各自一支（語料、計時與報表的工具都從這裡 import）：
+    python bench_segmentation.py --processes 4 bench.jsonl    # jieba 冷/暖啟動、首篇延遲、批次多行程斷詞
+    python bench_scoring.py bench.jsonl                       # 單次走訪詞典評分 vs 逐遍計算：結果比對、耗時、每篇配置量
+    python bench_incremental.py bench.jsonl                   # 編修後增量重算 vs 完整重算：結果比對 + 重用率
+    python bench_parity.py --baseline <rev> bench.jsonl       # 與某個 git 版本的兩套實作比對結果、延遲與 forward 次數
+    python bench_student.py --teacher teacher.jsonl           # 蒸餾小模型 vs 老師：吞吐倍數與融合後標籤一致率
+
+共用選項：
+    --lexicon        不載模型（MODEL_STARTUP_MODE=lexicon），只量模型以外的成本
+    --gemini-delay   stub 回應延遲（秒），模擬上游耗時
+
+stages 的各階段是 analysis_engine 的 stage 逐一計時（只有該實作的 labeler 實際讀到的 stage 才會跑）；
+「end_to_end」則是實際呼叫 analyze_sentiment（結果/訊息快取已關閉）。各階段加總與端到端不會完全相等，差額是串接本身的成本。
+記憶體高水位取 getrusage 的 ru_maxrss（整個行程的峰值 RSS），compare 用子行程量，彼此不互相污染。
+"""
+from __future__ import annotations
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+DEMO_DIR = os.path.join(ROOT, "ai_test_done")
+IMPLS = ("backend", "demo")
+
+# ───────────────────────────────────────────────────────────────
+# 合成語料
+# ───────────────────────────────────────────────────────────────
+_OPENERS = ["今天", "早上", "下午", "晚上", "這週", "最近", "剛剛", "放學後", "下班後"]
+_ACTIVITIES = [
+    "去動物園", "跟朋友聊天", "準備考試", "開會", "整理房間", "通勤", "參加婚禮", "去看醫生",
+    "練習報告", "處理工作", "出差", "跑步", "看電影", "寫作業", "跟家人吃飯", "搬家",
+]
+_FEELINGS_POS = ["很開心", "超期待", "覺得很放鬆", "有成就感", "很滿足", "心情很好", "超興奮", "被肯定"]
+_FEELINGS_NEG = ["很累", "有點焦慮", "很煩", "覺得失望", "壓力山大", "很難過", "心累", "覺得無助"]
+_FEELINGS_NEU = ["還好", "普普通通", "沒什麼特別", "跟平常一樣"]
+_MODIFIERS = ["", "", "真的", "超級", "有點", "不", "非常"]
+_TOPIC_BITS = ["我注意到自己", "我努力控制情緒", "我重新安排了時間", "我意識到", "我試著冷靜下來"]
+_EMOJIS = ["😀", "😭", "🥳", "😡", "😊", "😢", "👍", "💔", "🎉", "😴", "❤️", "😤"]
+_ENGLISH = [
+    "so tired today", "feeling chill", "deadline is killing me", "what a great day",
+    "meh", "super excited", "burned out", "not bad at all",
+]
+_PUNCT = ["。", "！", "…", "，", "!!!", "？"]
+KINDS = ("short", "long", "emoji", "mixed")
+
+
+def make_sentence(rng: random.Random) -> str:
+    feeling = rng.choice(rng.choice([_FEELINGS_POS, _FEELINGS_NEG, _FEELINGS_NEU]))
+    parts = [rng.choice(_OPENERS), rng.choice(_ACTIVITIES), "，", rng.choice(_MODIFIERS), feeling]
+    if rng.random() < 0.3:
+        parts += ["，", rng.choice(_TOPIC_BITS)]
+    parts.append(rng.choice(_PUNCT))
+    return "".join(parts)
+
+
+def make_entry(kind: str, rng: random.Random) -> str:
+    if kind == "short":
+        return make_sentence(rng)
+    if kind == "long":
+        # 大約 300～1500 字，會觸發模型的長文分段
+        return "".join(make_sentence(rng) for _ in range(rng.randint(20, 80)))
+    if kind == "emoji":
+        out = []
+        for _ in range(rng.randint(1, 4)):
+            out.append(make_sentence(rng))
+            out.append("".join(rng.choice(_EMOJIS) for _ in range(rng.randint(1, 5))))
+        return "".join(out)
+    if kind == "mixed":
+        out = []
+        for _ in range(rng.randint(2, 6)):
+            out.append(make_sentence(rng) if rng.random() < 0.6 else rng.choice(_ENGLISH) + rng.choice([". ", "! ", " "]))
+        return "".join(out)
+    raise ValueError(f"未知的語料類型：{kind!r}")
+
+
+def make_corpus(n: int, seed: int = 0, mix: Optional[Dict[str, float]] = None) -> List[Dict]:
+    """回傳 [{"id", "kind", "text"}, ...]；同一個 seed 每次產生的內容都一樣"""
+    rng = random.Random(seed)
+    mix = mix or {"short": 0.4, "long": 0.15, "emoji": 0.25, "mixed": 0.2}
+    kinds, weights = zip(*mix.items())
+    return [{"id": i, "kind": kind, "text": make_entry(kind, rng)}
+            for i, kind in enumerate(rng.choices(kinds, weights, k=n))]
+
+
+def read_corpus(path: Optional[str], n: int = 200, seed: int = 0) -> List[Dict]:
+    """讀 JSONL（text、kind 欄位）或純文字（每行一篇）；沒給檔案就現場產生"""
+    if not path:
+        return make_corpus(n, seed)
+    rows = []
+    with open(path, encoding="utf-8") as f:
+        for i, line in enumerate(f):
+            line = line.strip()
+            if not line:
+                continue
+            if path.endswith(".jsonl"):
+                rec = json.loads(line)
+                rows.append({"id": rec.get("id", i), "kind": rec.get("kind", "file"), "text": rec.get("text") or ""})
+            else:
+                rows.append({"id": i, "kind": "file", "text": line})
+    return rows
+
+
+# ───────────────────────────────────────────────────────────────
+# 統計工具
+# ───────────────────────────────────────────────────────────────
+def percentiles(values: List[float], ps: Iterable[int] = (50, 90, 99)) -> Dict[str, float]:
+    """nearest-rank 百分位（毫秒），另附 mean / max / n"""
+    if not values:
+        return {"n": 0}
+    xs = sorted(values)
+    out = {f"p{p}": xs[min(len(xs) - 1, max(0, -(-p * len(xs) // 100) - 1))] * 1000 for p in ps}
+    out.update(mean=sum(xs) / len(xs) * 1000, max=xs[-1] * 1000, n=len(xs))
+    return out
+
+
+def max_rss_mib() -> float:
+    """行程至今的峰值 RSS（Linux 的 ru_maxrss 單位是 KiB，macOS 是 byte）"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (2 ** 20 if sys.platform == "darwin" else 1024)
+
+
+def best_of(fn: Callable[[], object], repeat: int = 3) -> float:
+    """fn 跑 repeat 次，回傳最快一次的秒數"""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def texts_per_sec(score_many: Callable[[List[str]], List], texts: List[str], batch_size: int,
+                  repeat: int = 1) -> Tuple[List, float]:
+    """分批評分整份 texts，回傳 (結果, 每秒篇數)；repeat > 1 時取最快的一次"""
+    best, out = float("inf"), []
+    for _ in range(repeat):
+        out = []
+        started = time.perf_counter()
+        for i in range(0, len(texts), batch_size):
+            out += score_many(texts[i:i + batch_size])
+        best = min(best, time.perf_counter() - started)
+    return out, (len(texts) / best if best else 0.0)
+
+
+class _Clock:
+    """依序量測多個階段：lap(name) 記下距離上一次 lap 的耗時"""
+
+    def __init__(self, sink: Dict[str, List[float]]):
+        self.sink = sink
+        self.last = time.perf_counter()
+
+    def lap(self, name: str) -> None:
+        now = time.perf_counter()
+        self.sink[name].append(now - self.last)
+        self.last = now
+
+
+# ───────────────────────────────────────────────────────────────
+# 環境：stub Gemini、關閉快取、載入實作
+# ───────────────────────────────────────────────────────────────
+def prepare_env(lexicon: bool, gemini_delay: float):
+    """必須在 import 任一實作之前呼叫：環境變數在 import 時就被讀走"""
+    from gemini_stub import StubGeminiServer
+
+    stub = StubGeminiServer(delay=gemini_delay).start()
+    os.environ["GEMINI_API_URL"] = stub.url
+    os.environ["GEMINI_API_KEY"] = "stub"
+    # 合成語料內容不重複，但仍關掉結果/訊息快取，量到的才是每次真正的計算成本
+    os.environ["ANALYSIS_CACHE_SIZE"] = "0"
+    os.environ.pop("ANALYSIS_CACHE_DB", None)
+    if lexicon:
+        os.environ["MODEL_STARTUP_MODE"] = "lexicon"
+    elif os.environ.get("MODEL_STARTUP_MODE") == "eager":
+        # 背景暖身會和量測搶 CPU，改成 lazy，暖身由 --warmup 在量測前做
+        os.environ["MODEL_STARTUP_MODE"] = "lazy"
+    return stub
+
+
+def load_impl(name: str):
+    if name == "backend":
+        import emotion_models as mod
+    elif name == "demo":
+        if DEMO_DIR not in sys.path:
+            sys.path.insert(0, DEMO_DIR)
+        import emotion_model as mod
+    else:
+        raise ValueError(f"未知的實作：{name!r}（可用：{', '.join(IMPLS)}）")
+    return mod
+
+
+def _stages_engine(mod) -> Callable[[str, _Clock], None]:
+    """
+    兩套實作共用 analysis_engine：labeler 實際讀到的各個 stage（依讀取順序）→ 判定 → 訊息
+    沒被讀到的 stage 不會跑，也不會出現在結果裡（例如 demo 的 lexicon_count 沒有 model）
+    """
+    from analysis_engine import PROVIDERS, Features
+    from analysis_cache import make_key
+
+    class _TimedFeatures(Features):
+        def __init__(self, clock: _Clock, *args):
+            super().__init__(*args)
+            self.clock = clock
+
+        def __getitem__(self, key: str):
+            if key in self:
+                return super().__getitem__(key)
+            # stage 之間 labeler 本身的計算不算進任何 stage
+            self.clock.last = time.perf_counter()
+            value = super().__getitem__(key)
+            self.clock.lap(PROVIDERS[key])
+            return value
+
+    engine = mod.engine
+
+    def run(text: str, clock: _Clock) -> None:
+        raw = text.strip()
+        lex = engine.lexicons.current
+        f = _TimedFeatures(clock, engine, raw, lex)
+        result = engine.label(f)
+        clock.lap("label")
+        engine.support_message(result, make_key(raw, engine.analysis_version(lex)))
+        clock.lap("message")
+
+    return run
+
+
+def warm_up(mod, n: int) -> None:
+    for _ in range(n):
+        mod.analyze_sentiment("今天去動物園，心情很好！😀")
+
+
+def bench_stages(impl: str, rows: List[Dict], lexicon: bool = False, gemini_delay: float = 0.0,
+                 warmup: int = 3) -> Dict:
+    stub = prepare_env(lexicon, gemini_delay)
+    rss_start = max_rss_mib()
+    started = time.perf_counter()
+    mod = load_impl(impl)
+    import_seconds = time.perf_counter() - started
+    rss_after_import = max_rss_mib()
+    warm_up(mod, warmup)
+    rss_after_warmup = max_rss_mib()
+
+    stage_fn = _stages_engine(mod)
+    stages: Dict[str, List[float]] = defaultdict(list)
+    by_kind: Dict[str, List[float]] = defaultdict(list)
+    e2e: List[float] = []
+
+    try:
+        for row in rows:
+            stage_fn(row["text"], _Clock(stages))
+        started = time.perf_counter()
+        for row in rows:
+            t0 = time.perf_counter()
+            mod.analyze_sentiment(row["text"])
+            dt = time.perf_counter() - t0
+            e2e.append(dt)
+            by_kind[row["kind"]].append(dt)
+        e2e_seconds = time.perf_counter() - started
+    finally:
+        stub.stop()
+
+    return {
+        "impl": impl,
+        "texts": len(rows),
+        "model": mod.model_registry.stats(),
+        "import_seconds": import_seconds,
+        "stages_ms": {name: percentiles(v) for name, v in stages.items()},
+        "end_to_end_ms": percentiles(e2e),
+        "end_to_end_by_kind_ms": {k: percentiles(v) for k, v in sorted(by_kind.items())},
+        "throughput_per_sec": len(rows) / e2e_seconds if e2e_seconds else 0.0,
+        "max_rss_mib": {
+            "start": rss_start, "after_import": rss_after_import,
+            "after_warmup": rss_after_warmup, "end": max_rss_mib(),
+        },
+        "gemini_stub_calls": stub.calls,
+        "gemini_client": mod.gemini_client.stats(),
+    }
+
+
+# ───────────────────────────────────────────────────────────────
+# HTTP 壓測（Flask app）
+# ───────────────────────────────────────────────────────────────
+def _serve_app(gemini_delay: float, lexicon: bool):
+    """在本行程背景執行 ai_test_done/app.py（threaded werkzeug），回傳 (server, url, stub)"""
+    import threading
+    from werkzeug.serving import make_server
+
+    stub = prepare_env(lexicon, gemini_delay)
+    if DEMO_DIR not in sys.path:
+        sys.path.insert(0, DEMO_DIR)
+    from app import app
+
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="bench-flask", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}/analyze", stub
+
+
+def bench_load(rows: List[Dict], url: Optional[str], concurrency: List[int], requests_per_level: int,
+               lexicon: bool = False, gemini_delay: float = 0.0, timeout: float = 30.0) -> Dict:
+    import requests
+
+    server = stub = None
+    if not url:
+        server, url, stub = _serve_app(gemini_delay, lexicon)
+    session = requests.Session()
+    session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=max(concurrency)))
+
+    def one(text: str):
+        t0 = time.perf_counter()
+        try:
+            status = session.post(url, json={"text": text}, timeout=timeout).status_code
+        except requests.RequestException:
+            status = None
+        return status, time.perf_counter() - t0
+
+    levels = []
+    try:
+        one(rows[0]["text"])   # 第一個請求會觸發 lazy 載入，不算進結果
+        for c in concurrency:
+            texts = [rows[i % len(rows)]["text"] for i in range(requests_per_level)]
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=c) as pool:
+                results = list(pool.map(one, texts))
+            elapsed = time.perf_counter() - started
+            served = [dt for status, dt in results if status == 200]
+            levels.append({
+                "concurrency": c,
+                "requests": len(results),
+                # 503 是背壓（asgi.py 的排隊上限）主動拒絕，與真正的錯誤分開算
+                "rejected": sum(1 for status, _ in results if status == 503),
+                "errors": sum(1 for status, _ in results if status not in (200, 503)),
+                "throughput_per_sec": len(served) / elapsed if elapsed else 0.0,
+                "latency_ms": percentiles(served),
+            })
+    finally:
+        if server is not None:
+            server.shutdown()
+        if stub is not None:
+            stub.stop()
+
+    return {
+        "url": url,
+        "in_process": server is not None,
+        "levels": levels,
+        # 只有 in-process 時才包含伺服器本身的記憶體
+        "max_rss_mib": max_rss_mib(),
+    }
+
+
+# ───────────────────────────────────────────────────────────────
+# 兩套實作比較
+# ───────────────────────────────────────────────────────────────
+def compare(corpus_path: Optional[str], n: int, seed: int, lexicon: bool, gemini_delay: float, warmup: int) -> Dict:
+    """各開一個子行程跑 stages，記憶體峰值才不會互相疊加"""
+    reports = {}
+    for impl in IMPLS:
+        cmd = [sys.executable, os.path.abspath(__file__), "stages", "--impl", impl,
+               "-n", str(n), "--seed", str(seed), "--gemini-delay", str(gemini_delay), "--warmup", str(warmup)]
+        if corpus_path:
+            cmd.append(corpus_path)
+        if lexicon:
+            cmd.append("--lexicon")
+        proc = subprocess.run(cmd, capture_output=True, text=True, cwd=ROOT)
+        if proc.returncode != 0:
+            print(proc.stderr, file=sys.stderr)
+            raise RuntimeError(f"{impl} 基準測試失敗（exit {proc.returncode}）")
+        reports[impl] = json.loads(proc.stdout)
+    return reports
+
+
+def _print_table(reports: Dict[str, Dict]) -> None:
+    impls = list(reports)
+    names = []
+    for r in reports.values():
+        names += [s for s in r["stages_ms"] if s not in names]
+    print(f"{'stage (p50/p99 ms)':<20}" + "".join(f"{i:>22}" for i in impls), file=sys.stderr)
+    for name in names + ["end_to_end"]:
+        cells = []
+        for i in impls:
+            p = reports[i]["end_to_end_ms"] if name == "end_to_end" else reports[i]["stages_ms"].get(name)
+            cells.append(f"{p['p50']:>10.2f} / {p['p99']:>8.2f}" if p and p.get("n") else f"{'-':>22}")
+        print(f"{name:<20}" + "".join(f"{c:>22}" for c in cells), file=sys.stderr)
+    print(f"{'throughput /s':<20}" + "".join(f"{reports[i]['throughput_per_sec']:>22.1f}" for i in impls), file=sys.stderr)
+    print(f"{'max RSS MiB':<20}" + "".join(f"{reports[i]['max_rss_mib']['end']:>22.1f}" for i in impls), file=sys.stderr)
+
+
+# ───────────────────────────────────────────────────────────────
+# CLI
+# ───────────────────────────────────────────────────────────────
+def corpus_args(p: argparse.ArgumentParser, n: int = 200, env: bool = True) -> None:
+    """語料參數（各支 bench_*.py 共用）；env=True 時另加 --lexicon / --gemini-delay"""
+    p.add_argument("corpus", nargs="?", help="JSONL（text/kind 欄位）或每行一篇的文字檔；省略則現場產生")
+    p.add_argument("-n", type=int, default=n, help="現場產生的語料篇數")
+    p.add_argument("--seed", type=int, default=0)
+    if env:
+        p.add_argument("--lexicon", action="store_true", help="不載模型，只量詞典路徑")
+        p.add_argument("--gemini-delay", type=float, default=0.0, help="stub Gemini 的回應延遲（秒）")
+
+
+def print_report(report: Dict) -> None:
+    """完整報表（JSON）寫到 stdout；摘要行由各指令另外寫到 stderr"""
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="分析流程基準測試（Gemini 用本機 stub）")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("corpus", help="產生合成語料（JSONL）")
+    p.add_argument("-n", type=int, default=500)
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("-o", "--output", default="-")
+
+    p = sub.add_parser("stages", help="單一實作的各階段延遲與端到端吞吐")
+    corpus_args(p)
+    p.add_argument("--impl", choices=IMPLS, default="backend")
+    p.add_argument("--warmup", type=int, default=3)
+
+    p = sub.add_parser("compare", help="兩套實作並排比較（各自一個子行程）")
+    corpus_args(p)
+    p.add_argument("--warmup", type=int, default=3)
+
+    p = sub.add_parser("load", help="對 Flask /analyze 做併發壓測")
+    corpus_args(p)
+    p.add_argument("--url", help="已在執行的 /analyze 網址（例如 uvicorn asgi:app）；省略則在本行程啟動 ai_test_done/app.py")
+    p.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    p.add_argument("--requests", type=int, default=200, help="每個併發等級送幾個請求")
+
+    args = ap.parse_args(argv)
+
+    if args.cmd == "corpus":
+        out = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+        try:
+            for row in make_corpus(args.n, args.seed):
+                out.write(json.dumps(row, ensure_ascii=False) + "\n")
+        finally:
+            if out is not sys.stdout:
+                out.close()
+        return 0
+
+    if args.cmd == "compare":
+        reports = compare(args.corpus, args.n, args.seed, args.lexicon, args.gemini_delay, args.warmup)
+        print_report(reports)
+        _print_table(reports)
+        return 0
+
+    rows = read_corpus(args.corpus, args.n, args.seed)
+    if args.cmd == "stages":
+        print_report(bench_stages(args.impl, rows, args.lexicon, args.gemini_delay, args.warmup))
+        return 0
+
+    report = bench_load(rows, args.url, args.concurrency, args.requests, args.lexicon, args.gemini_delay)
+    print_report(report)
+    for lv in report["levels"]:
+        print(f"c={lv['concurrency']:<4} {lv['throughput_per_sec']:8.1f} req/s  "
+              f"p50 {lv['latency_ms'].get('p50', 0):8.1f} ms  p99 {lv['latency_ms'].get('p99', 0):8.1f} ms  "
+              f"rejected {lv['rejected']}  errors {lv['errors']}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
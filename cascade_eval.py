@@ -0,0 +1,95 @@
+# backend/api/utils/cascade_eval.py
+"""
+串接模式（CASCADE_MODE）評估：詞典先判定能省下多少次模型推論、會不會改變結果
+
+用法：
+    python cascade_eval.py diaries.jsonl
+    python cascade_eval.py diaries.txt --min-score 0.4 0.5 0.6 0.8 --min-hits 1 2 --limit 2000
+
+每篇只跑一次模型，當作「永遠跑模型」的基準標籤；再對每組門檻計算：
+- skip_rate          ：詞典直接判定、不必跑模型的比例
+- agreement          ：整體標籤與基準一致的比例
+- skipped_agreement  ：只看被跳過的那些文章，標籤與基準一致的比例
+- disagreements      ：不一致的前幾筆範例（文字、基準標籤、串接標籤）
+"""
+from __future__ import annotations
+from typing import Dict, List, Optional
+import argparse
+import json
+import sys
+import time
+
+from inference_backends import _read_corpus
+from emotion_models import CASCADE_MIN_HITS, CASCADE_MIN_SCORE, engine
+
+
+def evaluate(texts: List[str], min_scores: List[float], min_hits: List[int],
+             batch_size: int = 32, examples: int = 5) -> Dict:
+    texts = [t.strip() for t in texts if t and t.strip()]
+    feats = [engine.features(t) for t in texts]
+
+    started = time.perf_counter()
+    model_scores = []
+    for i in range(0, len(texts), batch_size):
+        model_scores += engine.model_score_many(texts[i:i + batch_size])
+    model_seconds = time.perf_counter() - started
+    if texts and all(conf == 0.0 for _, conf in model_scores):
+        print("⚠️ 模型沒有載入，基準等同純詞典，agreement 沒有參考價值", file=sys.stderr)
+
+    baseline = [engine.fuse(f, s, c)["label"] for f, (s, c) in zip(feats, model_scores)]
+    lexicon_only = [engine.fuse(f, 0.0, 0.0)["label"] for f in feats]
+
+    rows = []
+    for ms in min_scores:
+        for mh in min_hits:
+            skipped = agree = skipped_agree = 0
+            diffs = []
+            for text, f, base, lex in zip(texts, feats, baseline, lexicon_only):
+                decided = engine.cascade_decides(f, ms, mh)
+                label = lex if decided else base
+                if decided:
+                    skipped += 1
+                    skipped_agree += label == base
+                if label == base:
+                    agree += 1
+                elif len(diffs) < examples:
+                    diffs.append({"text": text[:80], "model": base, "cascade": label})
+            n = len(texts)
+            rows.append({
+                "min_score": ms,
+                "min_hits": mh,
+                "skip_rate": skipped / n if n else 0.0,
+                "agreement": agree / n if n else 0.0,
+                "skipped_agreement": skipped_agree / skipped if skipped else None,
+                "disagreements": diffs,
+            })
+
+    return {
+        "texts": len(texts),
+        "model_seconds": model_seconds,
+        "model_ms_per_text": (model_seconds * 1000 / len(texts)) if texts else 0.0,
+        "results": rows,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="評估串接模式的跳過率與標籤一致率")
+    ap.add_argument("corpus", nargs="?", help="每行一篇的文字檔，或 .jsonl（取 text 欄位）；省略則用內建範例")
+    ap.add_argument("--min-score", type=float, nargs="+", default=[CASCADE_MIN_SCORE], help="要掃描的 CASCADE_MIN_SCORE")
+    ap.add_argument("--min-hits", type=int, nargs="+", default=[CASCADE_MIN_HITS], help="要掃描的 CASCADE_MIN_HITS")
+    ap.add_argument("--batch-size", type=int, default=32)
+    ap.add_argument("--limit", type=int, default=None)
+    ap.add_argument("--examples", type=int, default=5, help="每組門檻列出幾筆不一致的範例")
+    args = ap.parse_args(argv)
+
+    report = evaluate(_read_corpus(args.corpus, args.limit), args.min_score, args.min_hits,
+                      args.batch_size, args.examples)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    for row in report["results"]:
+        print(f"min_score={row['min_score']:<5} min_hits={row['min_hits']:<3} "
+              f"skip {row['skip_rate']:6.1%}  agreement {row['agreement']:6.1%}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
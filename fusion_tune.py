@@ -0,0 +1,359 @@
+# backend/api/utils/fusion_tune.py
+"""
+融合參數離線調校：模型只跑一次，之後在 NumPy 上重算融合、掃描權重與門檻
+
+調 W_MODEL / W_LEX / T_NEU、信心門檻（0.55）與事件加權（±0.15）原本每試一組就要把整份標註語料
+重跑一次（含每篇的 RoBERTa forward）。融合本身只用到幾個分量，所以分兩步：
+
+    # 1) 每篇算一次分量（mdl_s、mdl_conf、lex_s、正/負事件、興奮詞），存成 .npz
+    python fusion_tune.py extract labelled.jsonl -o components.npz --label-field label
+
+    # 2) 在分量上向量化重算融合，網格搜尋；輸出報表與 analyze_sentiment 可載入的設定檔
+    python fusion_tune.py search components.npz --w-model 0.4:0.8:0.05 --t-neu 0.1 0.15 0.2 -o fusion.json
+    FUSION_CONFIG=fusion.json python app.py
+
+- 網格參數可給多個值，或 start:stop:step；沒給的參數固定在 extract 當時的設定
+- 重算與 AnalysisEngine.fuse 的算式、運算順序相同：extract 會用當時的設定逐篇比對，
+  replay_agreement 應為 1.0
+- 分量跟詞典與模型版本綁在一起（meta 裡有記）；換詞典或模型後要重新 extract
+- 串接模式（CASCADE_MODE）不影響 extract：每篇都跑模型
+"""
+from __future__ import annotations
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+import argparse
+import itertools
+import json
+import sys
+import time
+from array import array
+
+import numpy as np
+
+LABELS = ("negative", "neutral", "positive")
+# 搜尋的參數（與 analysis_engine.FUSION_PARAMS 相同），依迴圈由外到內的順序
+PARAMS = (
+    "conf_cutoff", "low_conf_w_model", "low_conf_w_lex", "w_model", "w_lex",
+    "event_bonus", "excitement_bonus", "t_neu",
+)
+METRICS = ("accuracy", "macro_f1")
+COMPONENTS = ("mdl_s", "mdl_conf", "lex_s", "pos_event", "neg_event", "excitement", "gold")
+
+
+# ───────────────────────────────────────────────────────────────
+# 分量
+# ───────────────────────────────────────────────────────────────
+class Components:
+    """每篇一列：float64 的 mdl_s / mdl_conf / lex_s，bool 的事件旗標，int8 的標註（-1 = 未標註）"""
+
+    def __init__(self, arrays: Dict[str, np.ndarray], meta: Dict):
+        self.arrays = arrays
+        self.meta = meta
+
+    def __len__(self) -> int:
+        return len(self.arrays["gold"])
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.arrays[name]
+
+    def labelled(self) -> "Components":
+        mask = self.arrays["gold"] >= 0
+        return Components({k: v[mask] for k, v in self.arrays.items()}, self.meta)
+
+    def save(self, path: str) -> None:
+        np.savez_compressed(path, meta=np.array(json.dumps(self.meta, ensure_ascii=False)), **self.arrays)
+
+    @classmethod
+    def load(cls, path: str) -> "Components":
+        with np.load(path, allow_pickle=False) as data:
+            missing = [k for k in COMPONENTS if k not in data]
+            if missing:
+                raise ValueError(f"{path} 缺少分量：{', '.join(missing)}")
+            return cls({k: data[k] for k in COMPONENTS}, json.loads(str(data["meta"])))
+
+
+def _read_rows(path: str, text_field: str, label_field: str, limit: Optional[int]) -> Iterator[Tuple[str, int]]:
+    """JSONL（text / label 欄位）或每行一篇的純文字（全部未標註）"""
+    fp = sys.stdin if path == "-" else open(path, encoding="utf-8")
+    try:
+        n = 0
+        for line in fp:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("{"):
+                rec = json.loads(line)
+                text, label = rec.get(text_field), rec.get(label_field)
+            else:
+                text, label = line, None
+            if not isinstance(text, str) or not text.strip():
+                continue
+            yield text, LABELS.index(label) if label in LABELS else -1
+            n += 1
+            if limit and n >= limit:
+                break
+    finally:
+        if fp is not sys.stdin:
+            fp.close()
+
+
+def extract(rows: Iterable[Tuple[str, int]], batch_size: int = 64) -> Components:
+    """用後端目前的設定算分量；同時以 engine.fuse 重放一次，確認向量化重算與線上結果一致"""
+    import segmenter
+    from emotion_models import FUSION, analysis_version, engine, model_registry
+
+    cols = {"mdl_s": array("d"), "mdl_conf": array("d"), "lex_s": array("d"),
+            "pos_event": array("b"), "neg_event": array("b"), "excitement": array("b"), "gold": array("b")}
+    online = array("b")
+    lex = engine.lexicons.current
+    started = time.perf_counter()
+
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            break
+        raws = [text.strip() for text, _ in batch]
+        tokenized = segmenter.cut_many(raws)
+        for (raw, tokens, (_, gold), (mdl_s, mdl_conf)) in zip(
+                raws, tokenized, batch, engine.model_score_many(raws)):
+            f = engine.features(raw, lex, tokens=tokens)
+            cols["mdl_s"].append(mdl_s)
+            cols["mdl_conf"].append(mdl_conf)
+            cols["lex_s"].append(f["lex_s"])
+            cols["pos_event"].append(bool(f["pos_events"]))
+            cols["neg_event"].append(bool(f["neg_events"]))
+            cols["excitement"].append(f["excitement"])
+            cols["gold"].append(gold)
+            online.append(LABELS.index(engine.fuse(f, mdl_s, mdl_conf)["label"]))
+
+    arrays = {
+        k: np.frombuffer(v, dtype=np.float64 if v.typecode == "d" else np.int8).copy() for k, v in cols.items()
+    }
+    for k in ("pos_event", "neg_event", "excitement"):
+        arrays[k] = arrays[k].astype(bool)
+    params = {k: float(v) for k, v in FUSION.items()}
+    comps = Components(arrays, {})
+    replayed = fuse(comps, params)
+    n = len(comps)
+    comps.meta = {
+        "analysis_version": analysis_version(lex),
+        "lexicon_version": lex.version,
+        "model": model_registry.model_name,
+        "backend": model_registry.backend,
+        "model_loaded": bool(n and np.any(arrays["mdl_conf"] != 0.0)),
+        "rows": n,
+        "labelled": int(np.count_nonzero(arrays["gold"] >= 0)),
+        "params": params,
+        "replay_agreement": float(np.mean(replayed == np.frombuffer(online, dtype=np.int8))) if n else 1.0,
+        "extract_seconds": time.perf_counter() - started,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+    return comps
+
+
+# ───────────────────────────────────────────────────────────────
+# 向量化融合（與 AnalysisEngine.fuse 相同的算式與運算順序）
+# ───────────────────────────────────────────────────────────────
+def _weights(c: Components, p: Dict[str, float]) -> Tuple[np.ndarray, np.ndarray]:
+    conf = c["mdl_conf"]
+    missing = conf == 0.0            # 沒模型或完全失敗 → 只看詞典
+    low = ~missing & (conf < p["conf_cutoff"])
+    w_model = np.where(missing, 0.0, np.where(low, p["low_conf_w_model"], p["w_model"]))
+    w_lex = np.where(missing, 1.0, np.where(low, p["low_conf_w_lex"], p["w_lex"]))
+    return w_model, w_lex
+
+
+def _bonus(c: Components, p: Dict[str, float]) -> np.ndarray:
+    events = c["pos_event"].astype(np.float64) - c["neg_event"]
+    return events * p["event_bonus"] + c["excitement"] * p["excitement_bonus"]
+
+
+def _labels(final: np.ndarray, t_neu: float) -> np.ndarray:
+    """0 = negative、1 = neutral、2 = positive"""
+    return (1 + (final > t_neu).astype(np.int8) - (final < -t_neu)).astype(np.int8)
+
+
+def fuse(c: Components, p: Dict[str, float]) -> np.ndarray:
+    w_model, w_lex = _weights(c, p)
+    final = np.clip(w_model * c["mdl_s"] + w_lex * c["lex_s"] + _bonus(c, p), -1.0, 1.0)
+    return _labels(final, p["t_neu"])
+
+
+def confusion(gold: np.ndarray, pred: np.ndarray) -> np.ndarray:
+    """3×3，列是標註、欄是預測"""
+    return np.bincount(gold.astype(np.int64) * 3 + pred, minlength=9).reshape(3, 3)
+
+
+def scores(conf: np.ndarray) -> Dict:
+    total = int(conf.sum())
+    tp = np.diag(conf).astype(np.float64)
+    predicted, actual = conf.sum(axis=0), conf.sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        precision = np.where(predicted > 0, tp / predicted, 0.0)
+        recall = np.where(actual > 0, tp / actual, 0.0)
+        f1 = np.where(precision + recall > 0, 2 * precision * recall / (precision + recall), 0.0)
+    return {
+        "accuracy": float(tp.sum() / total) if total else 0.0,
+        "macro_f1": float(f1.mean()),
+        "per_label": {
+            name: {"precision": float(precision[i]), "recall": float(recall[i]), "f1": float(f1[i])}
+            for i, name in enumerate(LABELS)
+        },
+    }
+
+
+def distribution(pred: np.ndarray) -> Dict[str, float]:
+    counts = np.bincount(pred, minlength=3)
+    n = int(counts.sum())
+    return {name: (int(counts[i]) / n if n else 0.0) for i, name in enumerate(LABELS)}
+
+
+def evaluate(c: Components, p: Dict[str, float]) -> Dict:
+    """單組參數的完整報表：正確率、各標籤 P/R/F1、混淆矩陣、預測與標註的標籤分布"""
+    pred = fuse(c, p)
+    out = {"params": dict(p), "rows": len(c), "distribution": distribution(pred)}
+    mask = c["gold"] >= 0
+    if np.any(mask):
+        conf = confusion(c["gold"][mask], pred[mask])
+        out.update(scores(conf))
+        out["confusion"] = {"labels": list(LABELS), "matrix": conf.tolist()}
+        out["gold_distribution"] = distribution(c["gold"][mask].astype(np.int64))
+    return out
+
+
+def grid_search(c: Components, grid: Dict[str, List[float]], metric: str = "accuracy",
+                top: int = 10) -> Tuple[List[Dict], int]:
+    """
+    只用有標註的列；迴圈由外到內是 權重 → 事件加權 → 中立門檻，
+    內層只重做必要的部分（權重 × 分量的加總在換門檻時不必重算）
+    回傳 (依 metric 排序的前 top 組, 總組數)；同分時偏好離 extract 當時設定較近的組合
+    """
+    c = c.labelled()
+    gold = c["gold"].astype(np.int64) * 3
+    base_params = c.meta.get("params", {})
+    results = []
+    for cutoff, lw_m, lw_l, w_m, w_l in itertools.product(*(grid[k] for k in PARAMS[:5])):
+        p = {"conf_cutoff": cutoff, "low_conf_w_model": lw_m, "low_conf_w_lex": lw_l, "w_model": w_m, "w_lex": w_l}
+        w_model, w_lex = _weights(c, p)
+        fused = w_model * c["mdl_s"] + w_lex * c["lex_s"]
+        for eb, xb in itertools.product(grid["event_bonus"], grid["excitement_bonus"]):
+            final = np.clip(fused + _bonus(c, {"event_bonus": eb, "excitement_bonus": xb}), -1.0, 1.0)
+            for t in grid["t_neu"]:
+                conf = np.bincount(gold + _labels(final, t), minlength=9).reshape(3, 3)
+                s = scores(conf)
+                params = dict(p, event_bonus=eb, excitement_bonus=xb, t_neu=t)
+                distance = sum(abs(params[k] - base_params.get(k, params[k])) for k in PARAMS)
+                results.append((-s[metric], distance, len(results), params, s))
+    results.sort(key=lambda r: r[:3])
+    return [dict(r[4], params=r[3]) for r in results[:top]], len(results)
+
+
+# ───────────────────────────────────────────────────────────────
+# CLI
+# ───────────────────────────────────────────────────────────────
+def _values(tokens: Optional[List[str]]) -> Optional[List[float]]:
+    """數值或 start:stop:step（含 stop）"""
+    if not tokens:
+        return None
+    out: List[float] = []
+    for tok in tokens:
+        if ":" in tok:
+            start, stop, step = (float(x) for x in tok.split(":"))
+            n = int(round((stop - start) / step))
+            out += [round(start + i * step, 10) for i in range(n + 1)]
+        else:
+            out.append(float(tok))
+    return list(dict.fromkeys(out))
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="融合參數離線調校（分量只算一次，向量化重算）")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("extract", help="每篇算一次分量（含模型 forward），存成 .npz")
+    p.add_argument("corpus", help="JSONL（text / label 欄位）或每行一篇的文字檔；- 代表 stdin")
+    p.add_argument("-o", "--output", required=True, help="輸出的 .npz")
+    p.add_argument("--text-field", default="text")
+    p.add_argument("--label-field", default="label", help="標註欄位（positive / neutral / negative）")
+    p.add_argument("--batch-size", type=int, default=64)
+    p.add_argument("--limit", type=int, default=None)
+    p.add_argument("--seg-processes", type=int, default=0, help="批次斷詞的行程數（0 = 不開行程池）")
+
+    p = sub.add_parser("search", help="在分量上網格搜尋，輸出報表（-o 另存設定檔）")
+    p.add_argument("components", help="extract 產生的 .npz")
+    for name in PARAMS:
+        p.add_argument("--" + name.replace("_", "-"), nargs="+", metavar="V",
+                       help="多個值或 start:stop:step；省略則固定在 extract 當時的設定")
+    p.add_argument("--metric", choices=METRICS, default="accuracy")
+    p.add_argument("--top", type=int, default=10)
+    p.add_argument("-o", "--output", help="把最佳參數寫成 FUSION_CONFIG 可載入的 JSON")
+    args = ap.parse_args(argv)
+
+    if args.cmd == "extract":
+        import segmenter
+
+        if args.seg_processes:
+            from emotion_models import lexicons
+
+            segmenter.enable_parallel(args.seg_processes, lexicons)
+        try:
+            comps = extract(_read_rows(args.corpus, args.text_field, args.label_field, args.limit), args.batch_size)
+        finally:
+            segmenter.disable_parallel()
+        comps.save(args.output)
+        print(json.dumps(comps.meta, ensure_ascii=False, indent=2))
+        if comps.meta["rows"] and not comps.meta["model_loaded"]:
+            print("⚠️ 模型沒有載入，mdl_s / mdl_conf 全是 0，調出來的權重沒有參考價值", file=sys.stderr)
+        if comps.meta["replay_agreement"] < 1.0:
+            print(f"⚠️ 向量化重算與線上結果不一致（{comps.meta['replay_agreement']:.4%}）", file=sys.stderr)
+            return 1
+        return 0
+
+    comps = Components.load(args.components)
+    base = comps.meta["params"]
+    grid = {name: _values(getattr(args, name)) or [base[name]] for name in PARAMS}
+    combos = 1
+    for values in grid.values():
+        combos *= len(values)
+
+    started = time.perf_counter()
+    best, searched = grid_search(comps, grid, args.metric, args.top)
+    seconds = time.perf_counter() - started
+    if not best:
+        print("沒有標註資料可以搜尋（--label-field 對嗎？）", file=sys.stderr)
+        return 1
+    report = {
+        "components": args.components,
+        "rows": len(comps),
+        "labelled": int(np.count_nonzero(comps["gold"] >= 0)),
+        "combinations": searched,
+        "search_seconds": seconds,
+        "metric": args.metric,
+        "baseline": evaluate(comps, base),
+        "best": evaluate(comps, best[0]["params"]),
+        "top": best,
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    b, o = report["baseline"], report["best"]
+    print(f"{searched} 組 / {len(comps)} 篇，{seconds:.2f}s；{args.metric} "
+          f"{b.get(args.metric, 0):.4f} → {o.get(args.metric, 0):.4f}", file=sys.stderr)
+
+    if args.output:
+        config = {
+            "params": o["params"],
+            "metric": args.metric,
+            "score": o.get(args.metric),
+            "baseline_score": b.get(args.metric),
+            "analysis_version": comps.meta.get("analysis_version"),
+            "lexicon_version": comps.meta.get("lexicon_version"),
+            "model": comps.meta.get("model"),
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        }
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(config, f, ensure_ascii=False, indent=2)
+        print(f"✅ 設定檔：{args.output}（FUSION_CONFIG={args.output}）", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,241 @@
+# backend/api/utils/gemini_client.py
+"""
+Gemini 客戶端：連線池 + 硬性時限 + 斷路器 + 訊息快取
+
+- 共用 requests.Session（keep-alive 連線池），不再每次重新建線
+- generate() / agenerate()：超過 deadline 立刻回 None，呼叫端改用規則式訊息；
+  上游請求本身也以 deadline 為讀取時限，不會在背景無限期佔住連線
+- 連續失敗達門檻 → 斷路器打開，冷卻期間直接回 None，不再打上游；
+  呼叫端等到 deadline 逾時也算一次失敗（之後背景那次的結果不再重複計入或把斷路器關回去）
+- 排隊 + 執行中的上游呼叫最多 max_pending 個，滿了直接回 None（overloaded），不讓佇列無限長
+- 以摘要字串為 key 快取產生的訊息
+- generate_with_outcome()：同時回傳結果類別（success / cache_hit / timeout / error /
+  circuit_open / overloaded / empty / disabled），給量測與日誌用
+
+GEMINI_API_URL 可以指到本機 stub（見 gemini_stub.py）做測試。
+"""
+from __future__ import annotations
+from typing import Callable, Dict, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+import asyncio
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from analysis_cache import LRUCache
+from safe_logging import get_logger
+
+log = get_logger("gemini")
+
+
+def extract_text(data: Dict) -> Optional[str]:
+    """從 generateContent 回應取出第一段文字；沒有就回 None"""
+    cands = data.get("candidates") or []
+    if not cands:
+        return None
+    content = (cands[0] or {}).get("content") or {}
+    parts = content.get("parts") or []
+    if not parts:
+        return None
+    text = (parts[0] or {}).get("text")
+    return text.strip() if isinstance(text, str) and text.strip() else None
+
+
+class CircuitBreaker:
+    """closed → (連續失敗 failure_threshold 次) → open → (冷卻 reset_after 秒) → half-open 試一次"""
+
+    def __init__(self, failure_threshold: int = 5, reset_after: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.reset_after:
+                self.state = "half_open"   # 只放一個試探請求
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self.state = "closed"
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self.state == "half_open" or self._failures >= self.failure_threshold:
+                self.state = "open"
+                self._opened_at = time.monotonic()
+
+
+class _Call:
+    """一次上游呼叫的斷路器記帳：呼叫端逾時（abandoned）與背景完成（settled）只有先到的那個算數"""
+    __slots__ = ("abandoned", "settled")
+
+    def __init__(self):
+        self.abandoned = False
+        self.settled = False
+
+
+class GeminiClient:
+    def __init__(
+        self,
+        api_key: Optional[str],
+        url: str,
+        build_prompt: Callable[[str], str],
+        deadline: float = 3.0,
+        pool_size: int = 8,
+        max_pending: int = 32,
+        failure_threshold: int = 5,
+        reset_after: float = 30.0,
+        cache_size: int = 512,
+        cache_ttl: Optional[float] = 3600.0,
+    ):
+        self.api_key = api_key
+        self.url = url
+        self.build_prompt = build_prompt
+        self.deadline = deadline
+
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+        self._executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="gemini")
+        self.max_pending = max(1, max_pending)
+        self._pending = 0
+
+        self.breaker = CircuitBreaker(failure_threshold, reset_after)
+        self._cache = LRUCache(cache_size, cache_ttl)
+        self._lock = threading.Lock()
+        self._counts = {"success": 0, "cache_hit": 0, "timeout": 0, "error": 0, "circuit_open": 0,
+                        "overloaded": 0, "empty": 0}
+
+    # ── 對外介面 ────────────────────────────────────────────────
+    def generate(self, summary: str, deadline: Optional[float] = None) -> Optional[str]:
+        """同步版：最多等 deadline 秒，逾時回 None"""
+        return self.generate_with_outcome(summary, deadline)[0]
+
+    def generate_with_outcome(self, summary: str, deadline: Optional[float] = None) -> Tuple[Optional[str], str]:
+        outcome, value = self._start(summary)
+        if outcome is not None:
+            return value, outcome
+        future, call = value
+        try:
+            return future.result(timeout=self.deadline if deadline is None else deadline)
+        except FutureTimeout:
+            self._timed_out(call)
+            return None, "timeout"
+
+    async def agenerate(self, summary: str, deadline: Optional[float] = None) -> Optional[str]:
+        """asyncio 版：不佔用 event loop，逾時回 None"""
+        return (await self.agenerate_with_outcome(summary, deadline))[0]
+
+    async def agenerate_with_outcome(self, summary: str, deadline: Optional[float] = None) -> Tuple[Optional[str], str]:
+        outcome, value = self._start(summary)
+        if outcome is not None:
+            return value, outcome
+        future, call = value
+        try:
+            # shield：逾時只放棄等待，不取消背景那次呼叫（完成後照樣寫入快取）
+            return await asyncio.wait_for(
+                asyncio.shield(asyncio.wrap_future(future)),
+                timeout=self.deadline if deadline is None else deadline,
+            )
+        except asyncio.TimeoutError:
+            self._timed_out(call)
+            return None, "timeout"
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return dict(self._counts, circuit=self.breaker.state, cached=len(self._cache), pending=self._pending)
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False)
+        self._session.close()
+
+    # ── 內部 ────────────────────────────────────────────────────
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._counts[name] += 1
+
+    def _start(self, summary: str):
+        """回傳 (outcome, 結果)：不必呼叫上游時 outcome 已確定；否則 (None, (背景 Future, _Call))"""
+        if not self.api_key:
+            return "disabled", None
+        cached = self._cache.get(summary)
+        if cached is not None:
+            self._count("cache_hit")
+            return "cache_hit", cached
+        with self._lock:
+            full = self._pending >= self.max_pending
+            if full:
+                self._counts["overloaded"] += 1
+            else:
+                self._pending += 1
+        if full:
+            return "overloaded", None
+        if not self.breaker.allow():
+            self._done()
+            self._count("circuit_open")
+            return "circuit_open", None
+        call = _Call()
+        try:
+            future = self._executor.submit(self._fetch, summary, call)
+        except RuntimeError:   # 已 close()
+            self._done()
+            self._count("error")
+            return "error", None
+        future.add_done_callback(self._done)
+        return None, (future, call)
+
+    def _done(self, future=None) -> None:
+        with self._lock:
+            self._pending -= 1
+
+    def _timed_out(self, call: _Call) -> None:
+        """呼叫端等到 deadline：算一次斷路器失敗（背景那次若已先完成就不算）"""
+        with self._lock:
+            self._counts["timeout"] += 1
+            first = not call.settled and not call.abandoned
+            call.abandoned = True
+        if first:
+            self.breaker.record_failure()
+
+    def _settle(self, call: _Call) -> bool:
+        """背景呼叫完成；呼叫端已逾時（已計入失敗）就回 False，不再更新斷路器"""
+        with self._lock:
+            call.settled = True
+            return not call.abandoned
+
+    def _fetch(self, summary: str, call: _Call) -> Tuple[Optional[str], str]:
+        headers = {"Content-Type": "application/json", "X-goog-api-key": self.api_key}
+        payload = {"contents": [{"parts": [{"text": self.build_prompt(summary)}]}]}
+        try:
+            # 上游本身也設時限：讀取超時算失敗，讓斷路器能打開
+            r = self._session.post(self.url, headers=headers, json=payload,
+                                   timeout=(min(2.0, self.deadline), self.deadline))
+            r.raise_for_status()
+            text = extract_text(r.json())
+        except Exception as e:
+            if self._settle(call):
+                self.breaker.record_failure()
+            self._count("error")
+            log.warning("❌ Gemini API 錯誤：%s %s", type(e).__name__, e)
+            return None, "error"
+
+        if self._settle(call):
+            self.breaker.record_success()
+        if not text:
+            self._count("empty")
+            return None, "empty"
+        self._count("success")
+        self._cache.set(summary, text)
+        return text, "success"
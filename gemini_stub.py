@@ -0,0 +1,101 @@
+# backend/api/utils/gemini_stub.py
+"""
+本機 Gemini stub：回應格式與 generateContent 相同，可設定延遲與失敗率，
+給 GeminiClient 測試、壓測時取代真正的上游。
+
+    python gemini_stub.py --port 8765 --delay 0.3 --fail-rate 0.1
+    GEMINI_API_URL=http://127.0.0.1:8765/v1beta/models/stub:generateContent GEMINI_API_KEY=stub ...
+
+程式內使用：
+    with StubGeminiServer(delay=0.05) as stub:
+        client = GeminiClient("stub", stub.url, build_prompt=str)
+"""
+from __future__ import annotations
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import json
+import random
+import threading
+import time
+
+
+class StubGeminiServer:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, delay: float = 0.0,
+                 fail_rate: float = 0.0, reply: str = "謝謝你願意寫下來，今天辛苦了。"):
+        self.delay = delay
+        self.fail_rate = fail_rate
+        self.reply = reply
+        self.calls = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                self.rfile.read(length)
+                stub.calls += 1
+                if stub.delay:
+                    time.sleep(stub.delay)
+                if stub.fail_rate and random.random() < stub.fail_rate:
+                    self.send_response(503)
+                    self.end_headers()
+                    return
+                body = json.dumps({
+                    "candidates": [{"content": {"parts": [{"text": stub.reply}]}}]
+                }, ensure_ascii=False).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                try:
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass   # 客戶端已逾時離開
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1beta/models/stub:generateContent"
+
+    def start(self) -> "StubGeminiServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="本機 Gemini stub server")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--delay", type=float, default=0.0, help="每個回應延遲秒數")
+    ap.add_argument("--fail-rate", type=float, default=0.0, help="回 503 的機率")
+    args = ap.parse_args(argv)
+
+    stub = StubGeminiServer(args.host, args.port, args.delay, args.fail_rate)
+    print(f"✅ Gemini stub：{stub.url}")
+    try:
+        stub._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stub._server.server_close()
+
+
+if __name__ == "__main__":
+    main()
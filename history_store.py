@@ -0,0 +1,455 @@
+# backend/api/utils/history_store.py
+"""
+分析歷史：每篇日記的分析結果存進 SQLite，依使用者與時間查趨勢
+
+表格：
+- entries    ：一篇一列（使用者、時間、標籤、final_score 與模型/詞典分量、關鍵詞、主題），
+               索引 (user_id, ts)；帶 diary_id 的同一篇再存一次會取代舊的那列（日記編修）
+- daily      ：每位使用者每一天的累加值（篇數、分數總和、各標籤篇數）
+- daily_terms：每位使用者每一天，每個關鍵詞/主題出現在幾篇
+
+daily / daily_terms 在寫入 entries 的同一個交易裡增減（取代、刪除會先扣掉舊值），
+查詢時整天落在區間內的部分直接加總日累計，只有區間頭尾不滿一天的部分才用索引掃原始列，
+所以查一年的趨勢只讀約 365 列，不必掃過該使用者的每一篇日記。
+
+「一天」依 HISTORY_TZ_OFFSET_MINUTES（預設 +480，台灣時間）切分。
+
+    python history_store.py check history.db              # 用原始列重算累計，確認兩者一致
+    python history_store.py trend history.db USER --days 30
+"""
+from __future__ import annotations
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+import json
+import math
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+HISTORY_DB = os.getenv("HISTORY_DB") or None
+HISTORY_TZ_OFFSET_MINUTES = int(os.getenv("HISTORY_TZ_OFFSET_MINUTES", "480"))
+
+LABELS = ("positive", "neutral", "negative")
+TERM_KINDS = ("keyword", "topic")
+DAY = 86400
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    diary_id TEXT,
+    ts REAL NOT NULL,
+    day INTEGER NOT NULL,
+    label TEXT NOT NULL,
+    final_score REAL,
+    model_score REAL,
+    model_conf REAL,
+    lexicon_score REAL,
+    event_bonus REAL,
+    keywords TEXT NOT NULL,
+    topics TEXT NOT NULL,
+    version TEXT
+);
+CREATE INDEX IF NOT EXISTS entries_user_ts ON entries (user_id, ts);
+CREATE UNIQUE INDEX IF NOT EXISTS entries_user_diary ON entries (user_id, diary_id) WHERE diary_id IS NOT NULL;
+CREATE TABLE IF NOT EXISTS daily (
+    user_id TEXT NOT NULL,
+    day INTEGER NOT NULL,
+    n INTEGER NOT NULL,
+    n_scored INTEGER NOT NULL,
+    score_sum REAL NOT NULL,
+    n_positive INTEGER NOT NULL,
+    n_neutral INTEGER NOT NULL,
+    n_negative INTEGER NOT NULL,
+    PRIMARY KEY (user_id, day)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS daily_terms (
+    user_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    day INTEGER NOT NULL,
+    term TEXT NOT NULL,
+    n INTEGER NOT NULL,
+    PRIMARY KEY (user_id, kind, day, term)
+) WITHOUT ROWID;
+"""
+
+# 寫進 entries 的分數欄位 ← 分析結果 scores 裡的鍵
+_SCORE_COLUMNS = (
+    ("final_score", "final"), ("model_score", "model"), ("model_conf", "model_conf"),
+    ("lexicon_score", "lexicon"), ("event_bonus", "event_bonus"),
+)
+_ENTRY_COLUMNS = ("id", "user_id", "diary_id", "ts", "day", "label") + tuple(c for c, _ in _SCORE_COLUMNS) + (
+    "keywords", "topics", "version")
+
+TimeLike = Union[float, int, str, datetime, None]
+
+
+# ───────────────────────────────────────────────────────────────
+# 時間與日界
+# ───────────────────────────────────────────────────────────────
+def _tz() -> timezone:
+    return timezone(timedelta(minutes=HISTORY_TZ_OFFSET_MINUTES))
+
+
+def parse_time(value: TimeLike, default: Optional[float] = None) -> Optional[float]:
+    """epoch 秒、ISO 8601 字串（沒有時區就當 HISTORY_TZ_OFFSET_MINUTES）或 datetime → epoch 秒"""
+    if value is None or value == "":
+        return default
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            return float(value)
+        except ValueError:
+            value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=_tz())
+    return value.timestamp()
+
+
+def day_of(ts: float) -> int:
+    return math.floor((ts + HISTORY_TZ_OFFSET_MINUTES * 60) / DAY)
+
+
+def day_start(day: int) -> float:
+    return day * DAY - HISTORY_TZ_OFFSET_MINUTES * 60
+
+
+def day_label(day: int) -> str:
+    return datetime.fromtimestamp(day * DAY, timezone.utc).date().isoformat()
+
+
+def _full_days(start: float, end: float) -> Tuple[int, int]:
+    """[start, end) 內「整天」的範圍 [first, last)；沒有整天時 first >= last"""
+    first = day_of(start)
+    if day_start(first) < start:
+        first += 1
+    return first, day_of(end)
+
+
+# ───────────────────────────────────────────────────────────────
+# 儲存
+# ───────────────────────────────────────────────────────────────
+class HistoryStore:
+    """WAL 模式，每個執行緒各自一條連線；fork 後子行程會重開連線（與 analysis_cache.SQLiteCache 相同）"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        d = os.path.dirname(os.path.abspath(path))
+        os.makedirs(d, exist_ok=True)
+        with self._conn() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    # ── 寫入 ──────────────────────────────────────────────────
+    def record(self, user_id: str, label: str, keywords: Iterable[str] = (), topics: Iterable[str] = (),
+               scores: Optional[Dict[str, float]] = None, ts: TimeLike = None,
+               diary_id: Optional[str] = None, version: Optional[str] = None) -> int:
+        """
+        存一篇分析結果，回傳 entry id
+        scores 用分析結果的 scores（final / model / model_conf / lexicon / event_bonus），缺的欄位存 NULL；
+        同一位使用者的同一個 diary_id 再存一次會取代舊的（累計值先扣舊、再加新）
+        """
+        if label not in LABELS:
+            raise ValueError(f"未知的標籤：{label!r}")
+        ts = parse_time(ts, time.time())
+        scores = scores or {}
+        row = {
+            "user_id": str(user_id), "diary_id": None if diary_id is None else str(diary_id),
+            "ts": ts, "day": day_of(ts), "label": label,
+            "keywords": json.dumps(list(dict.fromkeys(keywords)), ensure_ascii=False),
+            "topics": json.dumps(list(dict.fromkeys(topics)), ensure_ascii=False),
+            "version": version,
+        }
+        for column, key in _SCORE_COLUMNS:
+            value = scores.get(key)
+            row[column] = None if value is None else float(value)
+
+        with self._conn() as conn:
+            if row["diary_id"] is not None:
+                old = self._fetch(conn, "user_id = ? AND diary_id = ?", (row["user_id"], row["diary_id"]))
+                for prev in old:
+                    self._apply(conn, prev, -1)
+                    conn.execute("DELETE FROM entries WHERE id = ?", (prev["id"],))
+            columns = [c for c in _ENTRY_COLUMNS if c != "id"]
+            cur = conn.execute(
+                f"INSERT INTO entries ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                [row[c] for c in columns],
+            )
+            row["id"] = cur.lastrowid
+            self._apply(conn, row, +1)
+        return row["id"]
+
+    def record_result(self, user_id: str, result: Dict, ts: TimeLike = None,
+                      diary_id: Optional[str] = None, version: Optional[str] = None) -> int:
+        """直接收分析結果 dict（label / keywords / topics，另有 scores 就一併存）"""
+        return self.record(user_id, result["label"], result.get("keywords") or (), result.get("topics") or (),
+                           result.get("scores"), ts, diary_id, version)
+
+    def delete(self, user_id: str, diary_id: str) -> bool:
+        with self._conn() as conn:
+            old = self._fetch(conn, "user_id = ? AND diary_id = ?", (str(user_id), str(diary_id)))
+            for prev in old:
+                self._apply(conn, prev, -1)
+                conn.execute("DELETE FROM entries WHERE id = ?", (prev["id"],))
+        return bool(old)
+
+    @staticmethod
+    def _fetch(conn: sqlite3.Connection, where: str, params: Tuple) -> List[Dict]:
+        rows = conn.execute(f"SELECT {', '.join(_ENTRY_COLUMNS)} FROM entries WHERE {where} ORDER BY ts, id",
+                            params).fetchall()
+        return [dict(zip(_ENTRY_COLUMNS, r)) for r in rows]
+
+    @staticmethod
+    def _apply(conn: sqlite3.Connection, row: Dict, sign: int) -> None:
+        """把一列加進（sign=+1）或扣出（-1）日累計；篇數歸零的日子與詞直接刪掉"""
+        user, day = row["user_id"], row["day"]
+        scored = row["final_score"] is not None
+        conn.execute(
+            "INSERT INTO daily (user_id, day, n, n_scored, score_sum, n_positive, n_neutral, n_negative)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+            " ON CONFLICT (user_id, day) DO UPDATE SET"
+            " n = n + excluded.n, n_scored = n_scored + excluded.n_scored,"
+            " score_sum = score_sum + excluded.score_sum, n_positive = n_positive + excluded.n_positive,"
+            " n_neutral = n_neutral + excluded.n_neutral, n_negative = n_negative + excluded.n_negative",
+            (user, day, sign, sign * scored, sign * (row["final_score"] or 0.0),
+             *(sign * (row["label"] == lb) for lb in LABELS)),
+        )
+        conn.execute("DELETE FROM daily WHERE user_id = ? AND day = ? AND n <= 0", (user, day))
+        for kind, column in (("keyword", "keywords"), ("topic", "topics")):
+            for term in json.loads(row[column]):
+                conn.execute(
+                    "INSERT INTO daily_terms (user_id, kind, day, term, n) VALUES (?, ?, ?, ?, ?)"
+                    " ON CONFLICT (user_id, kind, day, term) DO UPDATE SET n = n + excluded.n",
+                    (user, kind, day, term, sign),
+                )
+            if sign < 0:
+                conn.execute("DELETE FROM daily_terms WHERE user_id = ? AND kind = ? AND day = ? AND n <= 0",
+                             (user, kind, day))
+
+    # ── 查詢 ──────────────────────────────────────────────────
+    def entries(self, user_id: str, start: TimeLike = None, end: TimeLike = None, limit: int = 100) -> List[Dict]:
+        """區間內的原始紀錄（新到舊）"""
+        start, end = parse_time(start, 0.0), parse_time(end, time.time() + DAY)
+        rows = self._conn().execute(
+            f"SELECT {', '.join(_ENTRY_COLUMNS)} FROM entries WHERE user_id = ? AND ts >= ? AND ts < ?"
+            " ORDER BY ts DESC, id DESC LIMIT ?", (str(user_id), start, end, limit)).fetchall()
+        out = []
+        for r in rows:
+            row = dict(zip(_ENTRY_COLUMNS, r))
+            row["keywords"], row["topics"] = json.loads(row["keywords"]), json.loads(row["topics"])
+            out.append(row)
+        return out
+
+    def _edges(self, user_id: str, start: float, end: float) -> List[Dict]:
+        """區間頭尾不滿一天的部分（走 (user_id, ts) 索引）"""
+        first, last = _full_days(start, end)
+        if first >= last:
+            return self._fetch(self._conn(), "user_id = ? AND ts >= ? AND ts < ?", (user_id, start, end))
+        return self._fetch(
+            self._conn(), "user_id = ? AND ((ts >= ? AND ts < ?) OR (ts >= ? AND ts < ?))",
+            (user_id, start, day_start(first), day_start(last), end),
+        )
+
+    def summary(self, user_id: str, start: TimeLike = None, end: TimeLike = None) -> Dict:
+        """區間內的篇數、平均 final_score 與各標籤篇數"""
+        user_id = str(user_id)
+        start, end = parse_time(start, 0.0), parse_time(end, time.time() + DAY)
+        first, last = _full_days(start, end)
+        totals = {"n": 0, "n_scored": 0, "score_sum": 0.0, **{lb: 0 for lb in LABELS}}
+        if first < last:
+            row = self._conn().execute(
+                "SELECT COALESCE(SUM(n), 0), COALESCE(SUM(n_scored), 0), COALESCE(SUM(score_sum), 0.0),"
+                " COALESCE(SUM(n_positive), 0), COALESCE(SUM(n_neutral), 0), COALESCE(SUM(n_negative), 0)"
+                " FROM daily WHERE user_id = ? AND day >= ? AND day < ?", (user_id, first, last)).fetchone()
+            for k, v in zip(("n", "n_scored", "score_sum") + LABELS, row):
+                totals[k] += v
+        for e in self._edges(user_id, start, end):
+            totals["n"] += 1
+            totals[e["label"]] += 1
+            if e["final_score"] is not None:
+                totals["n_scored"] += 1
+                totals["score_sum"] += e["final_score"]
+        return {
+            "entries": totals["n"],
+            "average_score": totals["score_sum"] / totals["n_scored"] if totals["n_scored"] else None,
+            "labels": {lb: totals[lb] for lb in LABELS},
+        }
+
+    def label_distribution(self, user_id: str, start: TimeLike = None, end: TimeLike = None) -> Dict:
+        s = self.summary(user_id, start, end)
+        n = s["entries"]
+        return {
+            "total": n,
+            "counts": s["labels"],
+            "ratios": {lb: (c / n if n else 0.0) for lb, c in s["labels"].items()},
+        }
+
+    def term_frequencies(self, user_id: str, start: TimeLike = None, end: TimeLike = None,
+                         kind: str = "keyword", limit: int = 20) -> List[Tuple[str, int]]:
+        """區間內每個關鍵詞（kind="topic" 為主題）出現在幾篇，多到少"""
+        if kind not in TERM_KINDS:
+            raise ValueError(f"kind 必須是 {' / '.join(TERM_KINDS)}")
+        user_id = str(user_id)
+        start, end = parse_time(start, 0.0), parse_time(end, time.time() + DAY)
+        first, last = _full_days(start, end)
+        counts: Counter = Counter()
+        if first < last:
+            for term, n in self._conn().execute(
+                "SELECT term, SUM(n) FROM daily_terms WHERE user_id = ? AND kind = ? AND day >= ? AND day < ?"
+                " GROUP BY term", (user_id, kind, first, last)):
+                counts[term] += n
+        column = "keywords" if kind == "keyword" else "topics"
+        for e in self._edges(user_id, start, end):
+            counts.update(json.loads(e[column]))
+        return sorted(counts.items(), key=lambda kv: (-kv[1], kv[0]))[:limit]
+
+    def keyword_frequencies(self, user_id: str, start: TimeLike = None, end: TimeLike = None,
+                            limit: int = 20) -> List[Tuple[str, int]]:
+        return self.term_frequencies(user_id, start, end, "keyword", limit)
+
+    def rolling_average(self, user_id: str, start: TimeLike = None, end: TimeLike = None,
+                        window_days: int = 7) -> List[Dict]:
+        """
+        [start, end) 內每一天一個點：往前 window_days 天（含當天）的平均 final_score 與篇數
+        只讀 daily 表：一次範圍查詢 + 滑動視窗加減，跟日記篇數無關
+        """
+        user_id = str(user_id)
+        window_days = max(1, int(window_days))
+        now = time.time()
+        first = day_of(parse_time(start, now - 30 * DAY))
+        last = day_of(parse_time(end, now) - 1e-6) + 1
+        rows = {
+            day: (n, n_scored, score_sum)
+            for day, n, n_scored, score_sum in self._conn().execute(
+                "SELECT day, n, n_scored, score_sum FROM daily WHERE user_id = ? AND day >= ? AND day < ?",
+                (user_id, first - window_days + 1, last))
+        }
+        points = []
+        n = n_scored = 0
+        score_sum = 0.0
+        for day in range(first - window_days + 1, last):
+            add = rows.get(day)
+            if add:
+                n, n_scored, score_sum = n + add[0], n_scored + add[1], score_sum + add[2]
+            drop = rows.get(day - window_days)
+            if drop:
+                n, n_scored, score_sum = n - drop[0], n_scored - drop[1], score_sum - drop[2]
+            if day >= first:
+                points.append({
+                    "day": day_label(day), "entries": n,
+                    "average_score": score_sum / n_scored if n_scored else None,
+                })
+        return points
+
+    # ── 自我檢查 ──────────────────────────────────────────────
+    def check(self, user_id: Optional[str] = None) -> List[str]:
+        """用 entries 原始列重算 daily / daily_terms，回傳不一致之處（空 list = 一致）"""
+        where, params = ("WHERE user_id = ?", (str(user_id),)) if user_id is not None else ("", ())
+        conn = self._conn()
+        expected: Dict[Tuple[str, int], List] = {}
+        terms: Counter = Counter()
+        for e in self._fetch(conn, f"1 = 1 {'AND user_id = ?' if params else ''}", params):
+            agg = expected.setdefault((e["user_id"], e["day"]), [0, 0, 0.0, 0, 0, 0])
+            agg[0] += 1
+            if e["final_score"] is not None:
+                agg[1] += 1
+                agg[2] += e["final_score"]
+            agg[3 + LABELS.index(e["label"])] += 1
+            for kind, column in (("keyword", "keywords"), ("topic", "topics")):
+                for term in json.loads(e[column]):
+                    terms[(e["user_id"], kind, e["day"], term)] += 1
+
+        problems = []
+        actual = {(u, d): list(rest) for u, d, *rest in conn.execute(
+            "SELECT user_id, day, n, n_scored, score_sum, n_positive, n_neutral, n_negative"
+            f" FROM daily {where}", params)}
+        for key in set(expected) | set(actual):
+            a, b = expected.get(key), actual.get(key)
+            if a is None or b is None or a[:2] != b[:2] or a[3:] != b[3:] or abs(a[2] - b[2]) > 1e-6:
+                problems.append(f"daily {key}: 應為 {a}，實際 {b}")
+        actual_terms = {(u, k, d, t): n for u, k, d, t, n in conn.execute(
+            f"SELECT user_id, kind, day, term, n FROM daily_terms {where}", params)}
+        for key in set(terms) | set(actual_terms):
+            if terms.get(key) != actual_terms.get(key):
+                problems.append(f"daily_terms {key}: 應為 {terms.get(key)}，實際 {actual_terms.get(key)}")
+        return problems
+
+
+_store: Optional[HistoryStore] = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> Optional[HistoryStore]:
+    """HISTORY_DB 有設定才啟用；沒設定回 None（呼叫端就不記錄）"""
+    global _store
+    if HISTORY_DB is None:
+        return None
+    with _store_lock:
+        if _store is None:
+            _store = HistoryStore(HISTORY_DB)
+    return _store
+
+
+def record_request(body: Dict, label: str, keywords: Iterable[str], topics: Iterable[str],
+                   version: Optional[str] = None, scores: Optional[Dict[str, float]] = None) -> Optional[int]:
+    """
+    /analyze 用：請求 body 帶 user_id（可另帶 created_at、diary_id）且有設定 HISTORY_DB 才記錄
+    scores 是分析結果的 scores（趨勢的滾動平均靠 final）；回傳 entry id，沒記錄回 None
+    """
+    store = get_store()
+    if store is None or body.get("user_id") is None:
+        return None
+    return store.record(body["user_id"], label, keywords, topics, scores,
+                        body.get("created_at"), body.get("diary_id"), version)
+
+
+def main(argv=None) -> int:
+    import argparse
+
+    ap = argparse.ArgumentParser(description="分析歷史查詢與檢查")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("check", help="用原始列重算日累計，確認一致")
+    p.add_argument("db")
+    p.add_argument("--user")
+    p = sub.add_parser("trend", help="某位使用者的滾動平均、標籤分布與常見關鍵詞")
+    p.add_argument("db")
+    p.add_argument("user")
+    p.add_argument("--days", type=int, default=30)
+    p.add_argument("--window", type=int, default=7)
+    args = ap.parse_args(argv)
+
+    store = HistoryStore(args.db)
+    if args.cmd == "check":
+        problems = store.check(args.user)
+        for line in problems:
+            print(f"❌ {line}")
+        print("✅ 累計值與原始紀錄一致" if not problems else f"共 {len(problems)} 處不一致")
+        return 1 if problems else 0
+
+    now = time.time()
+    start = day_start(day_of(now) - args.days + 1)
+    print(json.dumps({
+        "rolling_average": store.rolling_average(args.user, start, now, args.window),
+        "labels": store.label_distribution(args.user, start, now),
+        "keywords": store.keyword_frequencies(args.user, start, now),
+        "topics": store.term_frequencies(args.user, start, now, kind="topic"),
+    }, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,258 @@
+# backend/api/utils/inference_backends.py
+"""
+情緒模型的推論後端（MODEL_BACKEND）
+
+- torch      ：原本的 PyTorch fp32
+- torch-int8 ：PyTorch 動態量化（Linear 權重 int8），CPU 上通常快 1.5～2 倍
+- onnx       ：匯出的 ONNX Runtime session
+- student    ：蒸餾出來的線性小模型（student_model.py），不需要 torch
+
+前三者對外都長得像 HF 模型：model(**inputs).logits，回傳 (batch, num_labels) 的 torch tensor，
+所以 2/3 類的分數換算（probs_to_scores）完全不用改。student 沒有 HF tokenizer（回傳的 tokenizer 是 None），
+直接以 model.score_many(texts) 回傳每篇 (score, conf)，由 AnalysisEngine 另走一條路徑。
+
+匯出與驗證（和 fp32 比 label 一致率與分數漂移）：
+    python inference_backends.py export --output models/erlangshen-sentiment.onnx
+    python inference_backends.py verify --backend onnx --corpus diaries.txt
+    python inference_backends.py verify --backend torch-int8 --corpus diaries.jsonl --limit 500
+"""
+from __future__ import annotations
+from typing import Dict, Iterable, List, Optional, Tuple
+from types import SimpleNamespace
+import argparse
+import json
+import os
+import sys
+import time
+
+# verify 只比得了 HF 形式的後端；student 與老師的比較見 bench_student.py
+HF_BACKENDS = ("torch", "torch-int8", "onnx")
+BACKENDS = HF_BACKENDS + ("student",)
+DEFAULT_ONNX_PATH = os.path.join("models", "erlangshen-sentiment.onnx")
+
+# 沒給語料時的驗證範例
+SAMPLE_TEXTS = [
+    "今天去動物園，超開心🥳🥳",
+    "考試失敗了，覺得很沮喪，壓力山大。",
+    "早上開會，下午整理報告，晚上回家煮飯。",
+    "和朋友吵架了，心好累，不知道該怎麼辦😭",
+    "終於完成專案，有成就感！",
+    "天氣普通，沒什麼特別的事。",
+    "被主管稱讚了，好驕傲😎",
+    "最近一直失眠，焦慮到崩潰。",
+]
+
+
+def probs_to_scores(probs):
+    """
+    probs: (batch, num_labels) → (scores, confs)，兩者皆為 (batch,) tensor
+    - 3 類 (neg, neu, pos) 與 2 類 (neg, pos) 都是 score = p_pos - p_neg
+    - 其他 label 數：回傳 None
+    """
+    num_labels = probs.shape[-1]
+    if num_labels not in (2, 3):
+        return None
+    scores = probs[:, -1] - probs[:, 0]
+    confs = probs.max(dim=-1).values
+    return scores, confs
+
+
+class OnnxSequenceClassifier:
+    """ONNX Runtime session 包成 HF 模型的呼叫方式"""
+
+    def __init__(self, path: str, intra_op_threads: Optional[int] = None):
+        import onnxruntime as ort
+        opts = ort.SessionOptions()
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads:
+            opts.intra_op_num_threads = intra_op_threads
+        self.path = path
+        self.session = ort.InferenceSession(path, opts, providers=["CPUExecutionProvider"])
+        self.input_names = [i.name for i in self.session.get_inputs()]
+        self.param_bytes = os.path.getsize(path)
+
+    def eval(self):
+        return self
+
+    def __call__(self, **inputs):
+        import torch
+        feed = {}
+        for name in self.input_names:
+            v = inputs[name]
+            feed[name] = v.numpy() if hasattr(v, "numpy") else v
+        logits = self.session.run(None, feed)[0]
+        return SimpleNamespace(logits=torch.from_numpy(logits))
+
+
+def quantize_int8(model):
+    import torch
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def load_backend(model_name: str, backend: str = "torch", onnx_path: Optional[str] = None,
+                 student_path: Optional[str] = None, lexicon_dir: Optional[str] = None) -> Tuple[object, object]:
+    """
+    回傳 (tokenizer, model)；model 可用 model(**inputs).logits 呼叫（student 例外，見模組說明）
+    lexicon_dir：上線用的詞庫，student 載入時拿來比對訓練時的詞庫版本
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"未知的 MODEL_BACKEND：{backend!r}（可用：{', '.join(BACKENDS)}）")
+    if backend == "student":
+        from student_model import DEFAULT_STUDENT_PATH, StudentClassifier
+        path = student_path or DEFAULT_STUDENT_PATH
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"找不到 {path}，請先執行：python student_model.py train <老師標註> -o {path}")
+        return None, StudentClassifier.load(path, lexicon_dir)
+    from transformers import AutoTokenizer
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+
+    if backend == "onnx":
+        path = onnx_path or DEFAULT_ONNX_PATH
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"找不到 {path}，請先執行：python inference_backends.py export --output {path}")
+        threads = int(os.getenv("ORT_INTRA_OP_THREADS", "0")) or None
+        return tokenizer, OnnxSequenceClassifier(path, threads)
+
+    from transformers import AutoModelForSequenceClassification
+    model = AutoModelForSequenceClassification.from_pretrained(model_name)
+    model.eval()
+    if backend == "torch-int8":
+        model = quantize_int8(model)
+    return tokenizer, model
+
+
+def _forward_order(model, sample) -> List[str]:
+    """
+    torch.onnx.export 以位置參數傳入，順序必須照 forward 的簽章（BERT 是 input_ids, attention_mask,
+    token_type_ids），不能照 tokenizer 輸出的 key 順序，否則 attention_mask 與 token_type_ids 會對調
+    """
+    import inspect
+    params = list(inspect.signature(model.forward).parameters)
+    names = [p for p in params if p in sample]
+    if names != params[:len(names)] or len(names) != len(sample):
+        raise ValueError(f"tokenizer 輸出 {list(sample.keys())} 無法依 forward 簽章 {params[:len(sample)]} 依序傳入")
+    return names
+
+
+def onnx_parity(tokenizer, model, path: str, texts: List[str], atol: float = 1e-3) -> float:
+    """同一批輸入分別跑 torch 與匯出的 ONNX，回傳 logits 的最大絕對差；超過 atol 就丟 ValueError"""
+    import torch
+    inputs = tokenizer(texts, return_tensors="pt", padding=True)
+    with torch.no_grad():
+        expected = model(**inputs).logits
+    actual = OnnxSequenceClassifier(path)(**inputs).logits
+    diff = float((expected - actual).abs().max())
+    if diff > atol:
+        raise ValueError(f"ONNX 與 torch 的 logits 最大差 {diff:.2e} 超過 {atol:g}（{path}）")
+    return diff
+
+
+def export_onnx(model_name: str, output: str, opset: int = 14) -> Tuple[str, float]:
+    """
+    fp32 模型匯出成 ONNX（batch 與序列長度都是動態維度）
+    匯出後用 SAMPLE_TEXTS（不同長度、有 padding）比對 ONNX 與 torch 的 logits，回傳 (路徑, 最大差)
+    """
+    import torch
+    tokenizer, model = load_backend(model_name, "torch")
+    sample = tokenizer(["今天心情很好", "有點累但還可以"], return_tensors="pt", padding=True)
+    names = _forward_order(model, sample)
+    dynamic = {n: {0: "batch", 1: "sequence"} for n in names}
+    dynamic["logits"] = {0: "batch"}
+
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with torch.no_grad():
+        torch.onnx.export(
+            model, tuple(sample[n] for n in names), output,
+            input_names=names, output_names=["logits"],
+            dynamic_axes=dynamic, opset_version=opset,
+        )
+    return output, onnx_parity(tokenizer, model, output, SAMPLE_TEXTS)
+
+
+def _score_all(bundle, texts: List[str], batch_size: int, max_len: int):
+    import torch
+    tokenizer, model = bundle
+    scores, labels = [], []
+    started = time.perf_counter()
+    for i in range(0, len(texts), batch_size):
+        inputs = tokenizer(texts[i:i + batch_size], return_tensors="pt",
+                           truncation=True, padding=True, max_length=max_len)
+        with torch.no_grad():
+            probs = torch.softmax(model(**inputs).logits, dim=-1)
+        out = probs_to_scores(probs)
+        if out is None:
+            raise ValueError(f"不支援的 label 數：{probs.shape[-1]}")
+        scores.extend(out[0].tolist())
+        labels.extend(probs.argmax(dim=-1).tolist())
+    return scores, labels, time.perf_counter() - started
+
+
+def verify(model_name: str, backend: str, texts: List[str], onnx_path: Optional[str] = None,
+           batch_size: int = 16, max_len: int = 256) -> Dict:
+    """和 fp32 比較：label 一致率、分數（p_pos - p_neg）漂移、吞吐量"""
+    ref = load_backend(model_name, "torch")
+    cand = load_backend(model_name, backend, onnx_path)
+    ref_s, ref_l, ref_t = _score_all(ref, texts, batch_size, max_len)
+    cand_s, cand_l, cand_t = _score_all(cand, texts, batch_size, max_len)
+    drift = [abs(a - b) for a, b in zip(ref_s, cand_s)]
+    n = len(texts)
+    return {
+        "backend": backend,
+        "texts": n,
+        "label_agreement": sum(a == b for a, b in zip(ref_l, cand_l)) / n if n else 1.0,
+        "score_drift_mean": sum(drift) / n if n else 0.0,
+        "score_drift_max": max(drift) if drift else 0.0,
+        "fp32_texts_per_sec": n / ref_t if ref_t else None,
+        "backend_texts_per_sec": n / cand_t if cand_t else None,
+    }
+
+
+def _read_corpus(path: Optional[str], limit: Optional[int]) -> List[str]:
+    if not path:
+        return SAMPLE_TEXTS[:limit] if limit else list(SAMPLE_TEXTS)
+    texts: List[str] = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if path.endswith(".jsonl"):
+                line = (json.loads(line) or {}).get("text") or ""
+            if line:
+                texts.append(line)
+            if limit and len(texts) >= limit:
+                break
+    return texts
+
+
+def main(argv: Optional[Iterable[str]] = None) -> int:
+    from emotion_models import MODEL_NAME, MAX_LEN
+
+    ap = argparse.ArgumentParser(description="推論後端匯出與驗證")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    ex = sub.add_parser("export", help="匯出 ONNX")
+    ex.add_argument("--output", default=DEFAULT_ONNX_PATH)
+    ex.add_argument("--opset", type=int, default=14)
+    ve = sub.add_parser("verify", help="和 fp32 比 label 一致率與分數漂移")
+    ve.add_argument("--backend", choices=HF_BACKENDS, required=True)
+    ve.add_argument("--onnx-path", default=None)
+    ve.add_argument("--corpus", default=None, help="一行一篇的 .txt 或含 text 欄位的 .jsonl")
+    ve.add_argument("--limit", type=int, default=None)
+    ve.add_argument("--min-agreement", type=float, default=0.98, help="低於此一致率則回傳非 0")
+    ve.add_argument("--max-drift", type=float, default=0.1, help="平均分數漂移上限")
+    args = ap.parse_args(argv)
+
+    if args.cmd == "export":
+        path, diff = export_onnx(MODEL_NAME, args.output, args.opset)
+        print(f"✅ 已匯出：{path}（與 torch 的 logits 最大差 {diff:.2e}）")
+        return 0
+
+    report = verify(MODEL_NAME, args.backend, _read_corpus(args.corpus, args.limit), args.onnx_path, max_len=MAX_LEN)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    ok = report["label_agreement"] >= args.min_agreement and report["score_drift_mean"] <= args.max_drift
+    print("✅ 通過" if ok else "❌ 未通過", file=sys.stderr)
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
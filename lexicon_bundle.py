@@ -0,0 +1,325 @@
+# backend/api/utils/lexicon_bundle.py
+"""
+詞典檔 → 編譯快照 → 執行期熱更新
+
+來源是一個目錄（例如 lexicons/backend/）：
+- <類別>.txt ：一行一詞，# 開頭為註解，檔名就是類別名（positive、negative_event、negations…）
+- emoji.tsv  ：emoji<TAB>極性分數
+
+編譯（compile_lexicons）：
+- 去重（保留第一次出現的順序），並回報重複、正負向衝突、含空白（進不了 jieba）的詞
+- 版本戳 = 內容的 sha1（只動 mtime 不會換版）
+- 建好 Aho–Corasick 自動機（lexicon_matcher.py），連同詞表一起 pickle 成快照
+
+載入（load_bundle）：快照裡記著每個來源檔的 (大小, mtime)，全部沒變就直接讀快照，
+跳過解析與建自動機；有變就重新編譯並原子地（暫存檔 + os.replace）寫回快照。
+
+jieba：快照旁寫一份 user dict（<快照名>.jieba.txt，一行一詞，不給詞頻 → jieba 自動給
+「剛好能切成整詞」的頻率），載入時註冊，斷詞結果才會和查表用的是同一份詞。
+只註冊評分時以整個 token 查表的類別（正負向詞、主題詞，見 JIEBA_CATEGORIES）：事件詞、興奮詞
+是全文掃描（自動機），不需要整詞；若也註冊，「超期待」「超興奮」這類複合詞會變成一個 token，
+把裡面的「期待」「興奮」藏起來，詞典分數反而歸零。
+
+熱更新（LexiconStore）：
+- reload() 在旁邊建好新 bundle、註冊 jieba 後，才一次換掉 store.current 的參考
+- 呼叫端在每個請求開頭取一次 store.current，整個請求都用那一份，不會看到新舊混雜
+- jieba 詞典是全域的：換版瞬間正在斷詞的請求可能已用到新詞，但詞表查詢仍是舊版一致的
+- start_watcher(interval)：背景輪詢來源檔，有變就 reload（fork 後子行程會自己重開輪詢）
+
+    python lexicon_bundle.py lexicons/backend        # 編譯並列出統計與警告
+"""
+from __future__ import annotations
+from typing import Dict, FrozenSet, Iterable, List, Optional, Tuple
+import hashlib
+import os
+import pickle
+import sys
+import tempfile
+import threading
+import time
+
+from lexicon_matcher import LexiconMatcher
+from safe_logging import get_logger
+from token_scorer import TOPIC_FLAGS, TokenTable
+
+log = get_logger("lexicon")
+
+# 2：jieba user dict 只收 JIEBA_CATEGORIES（舊快照的 user dict 要重寫）
+SNAPSHOT_FORMAT = 2
+EMOJI_FILE = "emoji.tsv"
+# 修飾詞只看前一個 token，不進自動機（不然「有」「超」這種單字會在全文到處命中）
+MODIFIER_CATEGORIES = ("negations", "strong_intensifiers", "weak_intensifiers")
+# 註冊成 jieba 使用者詞的類別：token_scorer 以整個 token 查表的正負向詞與主題詞
+JIEBA_CATEGORIES = ("positive", "negative") + tuple(c for c, _ in TOPIC_FLAGS)
+
+
+class LexiconBundle:
+    """一份不可變的詞典版本：詞表、emoji 極性、自動機、token id 表、版本戳"""
+
+    def __init__(self, name: str, version: str, words: Dict[str, Tuple[str, ...]],
+                 emoji: Dict[str, float], matcher: LexiconMatcher, warnings: List[str]):
+        self.name = name
+        self.version = version
+        self.words = words
+        self.emoji = emoji
+        self.matcher = matcher
+        self.warnings = warnings
+        self._sets: Dict[str, FrozenSet[str]] = {c: frozenset(ws) for c, ws in words.items()}
+        # 單次走訪評分用（見 token_scorer.py）；建表很快，不放進快照
+        self.table = TokenTable(words, emoji)
+
+    def __getitem__(self, category: str) -> FrozenSet[str]:
+        """類別不存在時回空集合（例如後端沒有 neutral_event）"""
+        return self._sets.get(category, frozenset())
+
+    def jieba_words(self) -> List[str]:
+        out = []
+        for category in JIEBA_CATEGORIES:
+            ws = self.words.get(category, ())
+            out += [w for w in ws if len(w) > 1 and not any(ch.isspace() for ch in w)]
+        return list(dict.fromkeys(out))
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state.pop("_sets")
+        state.pop("table")
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._sets = {c: frozenset(ws) for c, ws in self.words.items()}
+        self.table = TokenTable(self.words, self.emoji)
+
+
+# ───────────────────────────────────────────────────────────────
+# 編譯
+# ───────────────────────────────────────────────────────────────
+def _read_lines(path: str) -> Iterable[str]:
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                yield line
+
+
+def _source_files(src_dir: str) -> List[str]:
+    return sorted(f for f in os.listdir(src_dir) if f.endswith(".txt") or f == EMOJI_FILE)
+
+
+def _fingerprint(src_dir: str) -> Dict[str, Tuple[int, int]]:
+    out = {}
+    for f in _source_files(src_dir):
+        st = os.stat(os.path.join(src_dir, f))
+        out[f] = (st.st_size, st.st_mtime_ns)
+    return out
+
+
+def compile_lexicons(src_dir: str, name: Optional[str] = None) -> LexiconBundle:
+    name = name or os.path.basename(os.path.normpath(src_dir))
+    words: Dict[str, Tuple[str, ...]] = {}
+    emoji: Dict[str, float] = {}
+    warnings: List[str] = []
+
+    for fname in _source_files(src_dir):
+        path = os.path.join(src_dir, fname)
+        if fname == EMOJI_FILE:
+            for line in _read_lines(path):
+                try:
+                    ch, score = line.split("\t")
+                    score = float(score)
+                except ValueError:
+                    warnings.append(f"{fname}：無法解析 {line!r}")
+                    continue
+                if ch in emoji:
+                    warnings.append(f"{fname}：{ch} 重複，保留第一個")
+                    continue
+                emoji[ch] = score
+            continue
+        category = fname[:-4]
+        raw = list(_read_lines(path))
+        uniq = tuple(dict.fromkeys(raw))
+        if len(uniq) != len(raw):
+            warnings.append(f"{fname}：去掉 {len(raw) - len(uniq)} 個重複詞")
+        for w in uniq:
+            if any(ch.isspace() for ch in w):
+                warnings.append(f"{fname}：{w!r} 含空白，jieba 不會把它切成一個詞")
+        words[category] = uniq
+
+    both = set(words.get("positive", ())) & set(words.get("negative", ()))
+    if both:
+        warnings.append(f"同時在 positive 與 negative：{', '.join(sorted(both))}")
+
+    h = hashlib.sha1()
+    for category in sorted(words):
+        h.update(repr((category, words[category])).encode("utf-8"))
+    h.update(repr(sorted(emoji.items())).encode("utf-8"))
+    # 註冊給 jieba 的類別會改變斷詞結果，也算進版本
+    h.update(repr(JIEBA_CATEGORIES).encode("utf-8"))
+    version = h.hexdigest()[:12]
+
+    lexicons = {c: ws for c, ws in words.items() if c not in MODIFIER_CATEGORIES}
+    if emoji:
+        lexicons["emoji"] = emoji.keys()
+    matcher = LexiconMatcher.from_lexicons(lexicons)
+    return LexiconBundle(name, version, words, emoji, matcher, warnings)
+
+
+# ───────────────────────────────────────────────────────────────
+# 快照
+# ───────────────────────────────────────────────────────────────
+def _snapshot_paths(src_dir: str, snapshot_dir: Optional[str]) -> Tuple[str, str]:
+    name = os.path.basename(os.path.normpath(src_dir))
+    d = snapshot_dir or os.path.join(os.path.dirname(os.path.normpath(src_dir)), ".build")
+    return os.path.join(d, f"{name}.lexicon.pkl"), os.path.join(d, f"{name}.jieba.txt")
+
+
+def _atomic_write(path: str, data: bytes) -> None:
+    d = os.path.dirname(path)
+    os.makedirs(d, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=d, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+def load_bundle(src_dir: str, snapshot_dir: Optional[str] = None) -> Tuple[LexiconBundle, str]:
+    """回傳 (bundle, jieba user dict 路徑)；來源沒變就直接讀快照"""
+    snap_path, dict_path = _snapshot_paths(src_dir, snapshot_dir)
+    fingerprint = _fingerprint(src_dir)
+    try:
+        with open(snap_path, "rb") as f:
+            snap = pickle.load(f)
+        if (snap.get("format") == SNAPSHOT_FORMAT and snap.get("sources") == fingerprint
+                and os.path.exists(dict_path)):
+            return snap["bundle"], dict_path
+    except Exception:
+        pass   # 沒有快照、格式不符或檔案損毀：重新編譯
+
+    bundle = compile_lexicons(src_dir)
+    for w in bundle.warnings:
+        log.warning("詞典 %s：%s", bundle.name, w)
+    try:
+        _atomic_write(dict_path, "".join(w + "\n" for w in bundle.jieba_words()).encode("utf-8"))
+        _atomic_write(snap_path, pickle.dumps(
+            {"format": SNAPSHOT_FORMAT, "sources": fingerprint, "bundle": bundle},
+            protocol=pickle.HIGHEST_PROTOCOL,
+        ))
+    except OSError as e:
+        # 唯讀環境：照樣可用，只是每次啟動都重新編譯
+        log.warning("詞典快照寫入失敗：%s", e)
+        dict_path = None
+    return bundle, dict_path
+
+
+# ───────────────────────────────────────────────────────────────
+# 執行期：原子替換 + 熱更新
+# ───────────────────────────────────────────────────────────────
+def _register_jieba(bundle: LexiconBundle, dict_path: Optional[str], previous: Optional[LexiconBundle]) -> None:
+    import jieba
+
+    if dict_path:
+        jieba.load_userdict(dict_path)
+    else:
+        for w in bundle.jieba_words():
+            jieba.add_word(w)
+    if previous is not None:
+        for w in set(previous.jieba_words()) - set(bundle.jieba_words()):
+            jieba.del_word(w)
+
+
+class LexiconStore:
+    def __init__(self, src_dir: str, snapshot_dir: Optional[str] = None, register_jieba: bool = True):
+        self.src_dir = src_dir
+        self.snapshot_dir = snapshot_dir
+        self.register_jieba = register_jieba
+        self._reload_lock = threading.Lock()
+        self._fingerprint = _fingerprint(src_dir)
+        bundle, dict_path = load_bundle(src_dir, snapshot_dir)
+        if register_jieba:
+            _register_jieba(bundle, dict_path, None)
+        self.current: LexiconBundle = bundle
+        self.reloads = 0
+        self._watch_interval = 0.0
+        self._watch_pid = None
+
+    def reload(self, force: bool = False) -> bool:
+        """來源檔有變（或 force）才重建；回傳是否換了版本"""
+        with self._reload_lock:
+            fingerprint = _fingerprint(self.src_dir)
+            if not force and fingerprint == self._fingerprint:
+                return False
+            bundle, dict_path = load_bundle(self.src_dir, self.snapshot_dir)
+            self._fingerprint = fingerprint
+            if bundle.version == self.current.version:
+                return False
+            previous = self.current
+            if self.register_jieba:
+                _register_jieba(bundle, dict_path, previous)
+            self.current = bundle   # 單一參考賦值：讀取端不是拿到舊版就是新版
+            self.reloads += 1
+        log.info("詞典 %s 已更新：%s → %s", bundle.name, previous.version, bundle.version)
+        return True
+
+    def start_watcher(self, interval: float) -> None:
+        """每 interval 秒檢查一次來源檔；fork 出來的子行程會自己重開輪詢執行緒"""
+        if interval <= 0:
+            return
+        first = self._watch_interval == 0.0
+        self._watch_interval = interval
+        self._spawn_watcher()
+        if first and hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._spawn_watcher)
+
+    def _spawn_watcher(self) -> None:
+        if self._watch_pid == os.getpid():
+            return
+        self._reload_lock = threading.Lock()
+        self._watch_pid = os.getpid()
+        threading.Thread(target=self._watch, name="lexicon-watch", daemon=True).start()
+
+    def _watch(self) -> None:
+        while True:
+            time.sleep(self._watch_interval)
+            try:
+                self.reload()
+            except Exception as e:
+                # 改到一半的檔案可能暫時解析失敗：保留舊版，下一輪再試
+                log.warning("詞典重新載入失敗：%s", e)
+
+    def stats(self) -> Dict:
+        b = self.current
+        return {
+            "name": b.name,
+            "version": b.version,
+            "words": {c: len(ws) for c, ws in b.words.items()},
+            "emoji": len(b.emoji),
+            "reloads": self.reloads,
+            "warnings": list(b.warnings),
+        }
+
+
+def main(argv=None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv:
+        print(__doc__)
+        return 1
+    for src in argv:
+        bundle = compile_lexicons(src)
+        print(f"{bundle.name}  version={bundle.version}  matcher={len(bundle.matcher)} 詞")
+        for c, ws in bundle.words.items():
+            print(f"  {c:<20} {len(ws):>5}")
+        if bundle.emoji:
+            print(f"  {'emoji':<20} {len(bundle.emoji):>5}")
+        for w in bundle.warnings:
+            print(f"  ⚠️ {w}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
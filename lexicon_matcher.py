@@ -0,0 +1,109 @@
+# backend/api/utils/lexicon_matcher.py
+"""
+多詞典一次比對（Aho–Corasick 自動機）
+
+把所有詞典（情緒詞、事件詞、主題詞、emoji…）編成一個自動機，import 時建一次；
+之後對文字只掃一遍，就能拿到每個命中的 (start, end, word, category)。
+比對成本只跟文字長度與命中數有關，跟詞典大小無關。
+
+    m = LexiconMatcher.from_lexicons({"positive": ["開心"], "event": ["生日"]})
+    m.find_all("生日好開心")  # [Match(0, 2, '生日', 'event'), Match(3, 5, '開心', 'positive')]
+    m.categories("開心")      # ('positive',) —— 整詞查表，給 jieba token 用
+"""
+from __future__ import annotations
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Tuple
+from collections import deque
+
+
+class Match(NamedTuple):
+    start: int
+    end: int
+    word: str
+    category: str
+
+
+class LexiconMatcher:
+    def __init__(self):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[Tuple[Tuple[str, str], ...]] = [()]
+        self._exact: Dict[str, Tuple[str, ...]] = {}
+        self._built = False
+
+    @classmethod
+    def from_lexicons(cls, lexicons: Dict[str, Iterable[str]]) -> "LexiconMatcher":
+        m = cls()
+        for category, words in lexicons.items():
+            for w in words:
+                m.add(w, category)
+        m.build()
+        return m
+
+    # ── 建置 ────────────────────────────────────────────────────
+    def add(self, word: str, category: str) -> None:
+        if self._built:
+            raise RuntimeError("自動機已建好，不能再加詞")
+        if not word:
+            return
+        cats = self._exact.get(word, ())
+        if category in cats:
+            return
+        self._exact[word] = cats + (category,)
+
+        state = 0
+        for ch in word:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append(())
+                self._goto[state][ch] = nxt
+            state = nxt
+        self._out[state] = self._out[state] + ((word, category),)
+
+    def build(self) -> None:
+        """BFS 補 fail link，並把 fail 鏈上的輸出合併到每個節點"""
+        q = deque(self._goto[0].values())
+        while q:
+            state = q.popleft()
+            for ch, nxt in self._goto[state].items():
+                q.append(nxt)
+                f = self._fail[state]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                f = self._goto[f].get(ch, 0)
+                self._fail[nxt] = f
+                if self._out[f]:
+                    self._out[nxt] = self._out[nxt] + self._out[f]
+        self._built = True
+
+    # ── 查詢 ────────────────────────────────────────────────────
+    def finditer(self, text: str) -> Iterator[Match]:
+        """單次線性掃描，依結束位置依序產生所有命中（可重疊）"""
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        for i, ch in enumerate(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                end = i + 1
+                for word, category in out[state]:
+                    yield Match(end - len(word), end, word, category)
+
+    def find_all(self, text: str) -> List[Match]:
+        return list(self.finditer(text))
+
+    def categories(self, word: str) -> Tuple[str, ...]:
+        """整詞查詢所屬類別（不是子字串比對）"""
+        return self._exact.get(word, ())
+
+    def __len__(self) -> int:
+        return len(self._exact)
+
+
+def first_hits(matches: Iterable[Match], *categories: str) -> List[str]:
+    """指定類別的命中詞，依第一次出現的位置排序、去重"""
+    hits = sorted((m for m in matches if m.category in categories), key=lambda m: (m.start, m.end))
+    return list(dict.fromkeys(m.word for m in hits))
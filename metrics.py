@@ -0,0 +1,312 @@
+# backend/api/utils/metrics.py
+"""
+分析流程的量測：各階段耗時直方圖、計數器，以 Prometheus 文字格式輸出（不依賴 prometheus_client）
+
+    with stage("tokenize"):
+        tokens = ...
+
+- stage(name)：計時並寫入 focusbridge_stage_seconds{stage=name}；若目前有請求追蹤（Trace），
+  也把耗時累加到該請求上，請求結束時一次寫成一行結構化日誌；observe_stage(name, 秒) 記已量好的耗時
+- Trace：每個請求一個，放在 contextvar 裡（Flask threaded / asyncio 都各自獨立）
+- 慢請求剖析：PROFILE_SAMPLE_RATE 比例的請求會開 cProfile，總耗時超過 PROFILE_SLOW_MS
+  才把 .prof 檔寫到 PROFILE_DIR（python -m pstats 檔名 可檢視）
+- 指標存在行程內；gunicorn 多 worker 時每個 worker 各自一份，由 Prometheus 依 instance 分開抓
+
+render() 時會呼叫已註冊的 collector，把模型載入時間、快取命中數等「現值」一併輸出。
+"""
+from __future__ import annotations
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from bisect import bisect_left
+from contextlib import contextmanager
+import contextvars
+import cProfile
+import itertools
+import os
+import random
+import threading
+import time
+
+from safe_logging import get_logger
+
+log = get_logger("metrics")
+
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "1000"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+
+# ───────────────────────────────────────────────────────────────
+# 指標型別
+# ───────────────────────────────────────────────────────────────
+def _fmt_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{k}="{_escape(v)}"' for k, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(v) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt_value(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if not float(v).is_integer() else str(int(v))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return self.header() + [f"{self.name}{_fmt_labels(self.labelnames, k)} {_fmt_value(v)}" for k, v in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets: Iterable[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # 每組 label：[各 bucket 計數（非累積）..., +Inf 計數, 總和]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        idx = bisect_left(self.buckets, value)
+        with self._lock:
+            row = self._values.get(key)
+            if row is None:
+                row = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            row[idx] += 1
+            row[-1] += value
+
+    def count(self, **labels) -> int:
+        """某組 label 目前的觀測次數"""
+        with self._lock:
+            row = self._values.get(self._key(labels))
+            return int(sum(row[:-1])) if row else 0
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._values.items())
+        out = self.header()
+        for key, row in items:
+            acc = 0
+            for le, n in zip(self.buckets + (float("inf"),), row[:-1]):
+                acc += n
+                le_label = 'le="%s"' % _fmt_value(le)
+                out.append(f"{self.name}_bucket{_fmt_labels(self.labelnames, key, le_label)} {acc}")
+            out.append(f"{self.name}_sum{_fmt_labels(self.labelnames, key)} {_fmt_value(row[-1])}")
+            out.append(f"{self.name}_count{_fmt_labels(self.labelnames, key)} {acc}")
+        return out
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], Iterable[Tuple[str, str, str, Dict[str, str], float]]]] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, fn) -> None:
+        """fn() 產生 (name, kind, help, labels, value)；render 時才呼叫，用來輸出現值（gauge）"""
+        with self._lock:
+            self._collectors.append(fn)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for m in list(self._metrics):
+            lines += m.render()
+        samples: Dict[str, list] = {}
+        for fn in list(self._collectors):
+            try:
+                for name, kind, help, labels, value in fn():
+                    if value is None:
+                        continue
+                    samples.setdefault(name, [kind, help, []])[2].append((labels, value))
+            except Exception as e:
+                log.warning("metrics collector 失敗：%s", type(e).__name__)
+        for name, (kind, help, rows) in samples.items():
+            lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+            for labels, value in rows:
+                names = tuple(labels)
+                lines.append(f"{name}{_fmt_labels(names, tuple(labels[n] for n in names))} {_fmt_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# ── 分析流程共用的指標 ─────────────────────────────────────────
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "focusbridge_stage_seconds", "Time spent in each analysis stage", ["stage"]))
+CHUNKS_PER_TEXT = REGISTRY.register(Histogram(
+    "focusbridge_model_chunks", "Model windows (chunks) per analyzed text", buckets=SIZE_BUCKETS))
+FORWARD_BATCH_SIZES = REGISTRY.register(Histogram(
+    "focusbridge_model_batch_size", "Sequences per model forward pass", buckets=SIZE_BUCKETS))
+GEMINI_SECONDS = REGISTRY.register(Histogram(
+    "focusbridge_gemini_seconds", "Gemini message generation time by outcome", ["outcome"]))
+REQUESTS = REGISTRY.register(Counter(
+    "focusbridge_requests_total", "HTTP requests by endpoint and status", ["endpoint", "status"]))
+
+
+# ───────────────────────────────────────────────────────────────
+# 請求追蹤與階段計時
+# ───────────────────────────────────────────────────────────────
+_ids = itertools.count(1)
+_current: contextvars.ContextVar = contextvars.ContextVar("focusbridge_trace", default=None)
+_profile_lock = threading.Lock()
+
+
+class Trace:
+    def __init__(self, endpoint: str):
+        self.id = f"{os.getpid():x}-{next(_ids):x}"
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.fields: Dict[str, object] = {}
+        self.status = None
+        self._token = None
+        self._profiler: Optional[cProfile.Profile] = None
+
+    def add(self, name: str, seconds: float) -> None:
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def note(self, **fields) -> None:
+        """附加到這個請求日誌的欄位（不要放使用者原文）"""
+        self.fields.update(fields)
+
+
+def begin_trace(endpoint: str) -> Trace:
+    trace = Trace(endpoint)
+    trace._token = _current.set(trace)
+    if PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+        # 同一時間只剖析一個請求，避免多個 profiler 互相干擾
+        if _profile_lock.acquire(blocking=False):
+            try:
+                trace._profiler = cProfile.Profile()
+                trace._profiler.enable()
+            except ValueError:   # 已有其他剖析工具在跑
+                trace._profiler = None
+                _profile_lock.release()
+    return trace
+
+
+def end_trace(trace: Trace) -> float:
+    total = time.perf_counter() - trace.started
+    if trace._profiler is not None:
+        trace._profiler.disable()
+        try:
+            if total * 1000 >= PROFILE_SLOW_MS:
+                os.makedirs(PROFILE_DIR, exist_ok=True)
+                path = os.path.join(PROFILE_DIR, f"{int(time.time())}-{trace.id}.prof")
+                trace._profiler.dump_stats(path)
+                trace.note(profile=path)
+        finally:
+            trace._profiler = None
+            _profile_lock.release()
+    if trace._token is not None:
+        try:
+            _current.reset(trace._token)
+        except ValueError:
+            pass   # 在別的 context 結束（例如 async generator 被回收時才跑到 finally）
+        trace._token = None
+
+    STAGE_SECONDS.observe(total, stage="total")
+    REQUESTS.inc(endpoint=trace.endpoint or "unknown", status=trace.status or "")
+    log.info("request", extra={"fields": {
+        "request_id": trace.id, "endpoint": trace.endpoint, "status": trace.status,
+        "total_ms": round(total * 1000, 2),
+        "stages_ms": {k: round(v * 1000, 2) for k, v in trace.stages.items()},
+        **trace.fields,
+    }})
+    return total
+
+
+def current_trace() -> Optional[Trace]:
+    return _current.get()
+
+
+@contextmanager
+def stage(name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(name, time.perf_counter() - started)
+
+
+def observe_stage(name: str, seconds: float) -> None:
+    """直接記一段已量好的耗時（兩個階段交錯執行、無法各包一個 with stage 時用）"""
+    STAGE_SECONDS.observe(seconds, stage=name)
+    trace = _current.get()
+    if trace is not None:
+        trace.add(name, seconds)
+
+
+def observe_gemini(outcome: str, seconds: float) -> None:
+    GEMINI_SECONDS.observe(seconds, outcome=outcome)
+    STAGE_SECONDS.observe(seconds, stage="gemini")
+    trace = _current.get()
+    if trace is not None:
+        trace.add("gemini", seconds)
+        trace.note(gemini_outcome=outcome)
+
+
+# ───────────────────────────────────────────────────────────────
+# 常用 collector
+# ───────────────────────────────────────────────────────────────
+def model_registry_collector(registry) -> Callable:
+    def collect():
+        s = registry.stats()
+        labels = {"backend": s["backend"], "mode": s["mode"]}
+        yield "focusbridge_model_loaded", "gauge", "1 if the model is loaded", labels, int(bool(s["loaded"]))
+        yield "focusbridge_model_ready", "gauge", "1 once warm-up finished", labels, int(bool(s["ready"]))
+        yield "focusbridge_model_load_seconds", "gauge", "Model load time", labels, s["load_seconds"]
+        yield "focusbridge_model_warmup_seconds", "gauge", "Model warm-up time", labels, s["warmup_seconds"]
+        yield "focusbridge_model_rss_delta_bytes", "gauge", "RSS growth while loading the model", labels, s["rss_delta_bytes"]
+    return collect
+
+
+def cache_collector(stats_fn: Callable[[], Dict[str, Dict[str, int]]]) -> Callable:
+    def collect():
+        for cache, stats in stats_fn().items():
+            for event in ("memory_hits", "disk_hits", "misses", "sets"):
+                yield ("focusbridge_cache_events_total", "counter", "Analysis cache events",
+                       {"cache": cache, "event": event}, stats.get(event, 0))
+            yield "focusbridge_cache_size", "gauge", "Entries in the in-memory cache", {"cache": cache}, stats.get("size", 0)
+    return collect
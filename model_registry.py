@@ -0,0 +1,154 @@
+# backend/api/utils/model_registry.py
+"""
+情緒模型的載入管理（取代 import 時就下載/載入模型）
+
+三種啟動模式（MODEL_STARTUP_MODE）：
+- lazy    ：第一次用到模型才載入（預設）
+- eager   ：start() 時立刻載入並跑一次暖身推論，暖身完才算 ready
+- lexicon ：永遠不載入，只用詞典（批次工具、測試、CLI 用）
+
+多執行緒同時第一次呼叫 get() 也只會載入一次；載入失敗會記住並回 None，
+呼叫端照原本的方式退回純詞典分數。
+
+推論後端（torch / torch-int8 / onnx / student）見 inference_backends.py。
+"""
+from __future__ import annotations
+from typing import Dict, Optional, Tuple
+import os
+import threading
+import time
+
+from inference_backends import load_backend
+from safe_logging import get_logger
+
+log = get_logger("model")
+
+MODES = ("lazy", "eager", "lexicon")
+
+
+def rss_bytes() -> int:
+    """目前行程的常駐記憶體（RSS）"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class ModelRegistry:
+    def __init__(self, model_name: str, mode: str = "lazy", backend: str = "torch",
+                 onnx_path: Optional[str] = None, warmup_text: str = "今天去動物園，心情很好！",
+                 student_path: Optional[str] = None, lexicon_dir: Optional[str] = None):
+        if mode not in MODES:
+            raise ValueError(f"未知的 MODEL_STARTUP_MODE：{mode!r}（可用：{', '.join(MODES)}）")
+        self.model_name = model_name
+        self.mode = mode
+        self.backend = backend
+        self.onnx_path = onnx_path
+        self.student_path = student_path
+        self.lexicon_dir = lexicon_dir   # student 載入時比對訓練時的詞庫版本
+        self.warmup_text = warmup_text
+
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._bundle: Optional[Tuple[object, object]] = None
+        self._ready = threading.Event()
+        if mode != "eager":
+            self._ready.set()
+
+        self.load_seconds = None
+        self.warmup_seconds = None
+        self.param_bytes = None
+        self.rss_delta_bytes = None
+        self.error = None
+
+    # ── 取得模型 ────────────────────────────────────────────────
+    def get(self) -> Optional[Tuple[object, object]]:
+        """回傳 (tokenizer, model)；lexicon 模式或載入失敗回 None"""
+        if self.mode == "lexicon":
+            return None
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self._load()
+        return self._bundle
+
+    def _load(self) -> None:
+        started = time.perf_counter()
+        rss_before = rss_bytes()
+        try:
+            tokenizer, model = load_backend(self.model_name, self.backend, self.onnx_path, self.student_path,
+                                            self.lexicon_dir)
+            self._bundle = (tokenizer, model)
+            if hasattr(model, "parameters"):
+                # 動態量化後的 Linear 權重不在 parameters() 裡，這裡量到的是剩下的 fp32 部分
+                self.param_bytes = sum(
+                    t.numel() * t.element_size() for t in list(model.parameters()) + list(model.buffers())
+                )
+            else:
+                self.param_bytes = getattr(model, "param_bytes", None)
+        except Exception as e:
+            log.error("❌ 模型載入失敗：%s", e)
+            self.error = str(e)
+            self._bundle = None
+        self.load_seconds = time.perf_counter() - started
+        self.rss_delta_bytes = rss_bytes() - rss_before
+        self._loaded = True
+        if self._bundle is not None:
+            log.info("✅ 模型載入完成（%s）：%.1fs，RSS +%.0f MiB", self.backend, self.load_seconds, self.rss_delta_bytes / 2**20)
+
+    # ── 啟動與暖身 ──────────────────────────────────────────────
+    def warmup(self) -> None:
+        """跑一次小批次推論，把第一次 forward 的配置/初始化成本先付掉"""
+        bundle = self.get()
+        if bundle is None:
+            return
+        tokenizer, model = bundle
+        started = time.perf_counter()
+        if self.backend == "student":
+            model.score_many([self.warmup_text, self.warmup_text * 4])
+            self.warmup_seconds = time.perf_counter() - started
+            return
+        import torch
+        with torch.no_grad():
+            inputs = tokenizer([self.warmup_text, self.warmup_text * 4], return_tensors="pt", padding=True)
+            model(**inputs)
+        self.warmup_seconds = time.perf_counter() - started
+
+    def start(self, background: bool = False) -> None:
+        """eager 模式：載入 + 暖身，完成後 ready；其他模式不做事"""
+        if self.mode != "eager":
+            return
+        if background:
+            threading.Thread(target=self._start, name="model-warmup", daemon=True).start()
+        else:
+            self._start()
+
+    def _start(self) -> None:
+        try:
+            self.warmup()
+        except Exception as e:
+            log.error("❌ 模型暖身失敗：%s", e)
+        finally:
+            self._ready.set()
+
+    def is_ready(self) -> bool:
+        return self._ready.is_set()
+
+    def wait_ready(self, timeout: Optional[float] = None) -> bool:
+        return self._ready.wait(timeout)
+
+    def stats(self) -> Dict:
+        return {
+            "model": self.model_name,
+            "mode": self.mode,
+            "backend": self.backend,
+            "loaded": self._loaded and self._bundle is not None,
+            "ready": self.is_ready(),
+            "load_seconds": self.load_seconds,
+            "warmup_seconds": self.warmup_seconds,
+            "param_bytes": self.param_bytes,
+            "rss_delta_bytes": self.rss_delta_bytes,
+            "error": self.error,
+        }
@@ -0,0 +1,98 @@
+# backend/api/utils/safe_logging.py
+"""
+不洩漏敏感資料的日誌設定
+
+- 日記原文一律不寫進日誌：要追查時用 text_fingerprint(text)（長度 + 雜湊前綴）對照
+- RedactFilter 會把訊息裡像金鑰的字串遮掉（Google API key、key=...、Bearer token，
+  以及 GEMINI_API_KEY 環境變數的實際值），避免例外訊息夾帶金鑰
+- LOG_FORMAT=json 時每行一個 JSON 物件（附帶 extra={"fields": {...}} 的結構化欄位），
+  預設為人看的文字格式；LOG_LEVEL 控制等級（預設 INFO）
+"""
+from __future__ import annotations
+from typing import Optional
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+import time
+
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+
+_SECRET_PATTERNS = [
+    re.compile(r"AIza[0-9A-Za-z_\-]{20,}"),
+    re.compile(r"(?i)(\b(?:api[_-]?key|key|token|secret)=)[^&\s\"']+"),
+    re.compile(r"(?i)(\bBearer\s+)[A-Za-z0-9._\-]+"),
+]
+_configured = False
+
+
+def text_fingerprint(text: Optional[str]) -> str:
+    """代替原文寫進日誌：同一篇日記得到同一個指紋，但看不出內容"""
+    text = text or ""
+    digest = hashlib.sha256(text.encode("utf-8")).hexdigest()[:10]
+    return f"len={len(text)} sha={digest}"
+
+
+def redact(message: str) -> str:
+    secret = os.getenv("GEMINI_API_KEY")
+    if secret and len(secret) >= 8:
+        message = message.replace(secret, "***")
+    for pat in _SECRET_PATTERNS:
+        message = pat.sub(lambda m: (m.group(1) if m.groups() else "") + "***", message)
+    return message
+
+
+class RedactFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.msg = redact(record.getMessage())
+        record.args = None
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        out = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        out.update(getattr(record, "fields", None) or {})
+        if record.exc_info:
+            # 只留例外型別與遮罩過的訊息，不輸出 traceback 裡的區域變數
+            out["error"] = redact(f"{record.exc_info[0].__name__}: {record.exc_info[1]}")
+        return json.dumps(out, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        line = f"{time.strftime('%H:%M:%S', time.localtime(record.created))} {record.levelname[0]} {record.name}: {record.getMessage()}"
+        fields = getattr(record, "fields", None)
+        if fields:
+            line += " " + json.dumps(fields, ensure_ascii=False, default=str)
+        if record.exc_info:
+            line += " | " + redact(f"{record.exc_info[0].__name__}: {record.exc_info[1]}")
+        return line
+
+
+def setup_logging(level: Optional[str] = None, fmt: Optional[str] = None) -> None:
+    """只設定 focusbridge.* 這一支 logger，不動 root（避免跟 gunicorn/werkzeug 的設定打架）"""
+    global _configured
+    logger = logging.getLogger("focusbridge")
+    if _configured:
+        return
+    handler = logging.StreamHandler(sys.stderr)
+    handler.addFilter(RedactFilter())
+    handler.setFormatter(JsonFormatter() if (fmt or LOG_FORMAT) == "json" else TextFormatter())
+    logger.addHandler(handler)
+    logger.setLevel(level or LOG_LEVEL)
+    logger.propagate = False
+    _configured = True
+
+
+def get_logger(name: str) -> logging.Logger:
+    setup_logging()
+    return logging.getLogger(f"focusbridge.{name}")
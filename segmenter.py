@@ -0,0 +1,185 @@
+# backend/api/utils/segmenter.py
+"""
+斷詞層：jieba 預先初始化 + 持久化字典快取 + 批次多行程 + 單次前處理正則
+
+- jieba 第一次 cut 才建 prefix dict（解析 dict.txt 要好幾秒，有快取檔也要零點幾秒），
+  每個 worker、每次重啟的第一篇日記都要付這筆。initialize() 在 import 時就先建好；
+  gunicorn preload 時只在父行程建一次，worker 以 copy-on-write 共用
+- jieba 預設把快取檔放在 /tmp，容器重啟就沒了：改放 JIEBA_CACHE_DIR（預設 <專案>/.cache/jieba），
+  部署前可先跑 `python segmenter.py build-cache` 把快取做進映像檔
+- pretokenize()：emoji 與標點用同一個編譯好的正則一次處理（原本是兩次 re.sub），結果相同
+- iter_cut()：邊切邊產出 token，給 token_scorer 單次走訪用；cut() 是它的 list 版。
+  可另給 private_tokenizer() 建的獨立 Tokenizer（例如學生模型要用訓練當時的詞表，不受全域詞典影響）
+- cut_many()：批次工作可用 enable_parallel(n, lexicons) 開行程池。jieba 內建的 enable_parallel 只把
+  「一篇」依換行拆開平行，對大量短日記反而更慢，所以這裡改成以「篇」為單位分給各行程。
+  行程用 forkserver（沒有就 spawn）開，不從已有背景執行緒的行程 fork；子行程自己初始化 jieba、
+  註冊同一份詞庫的 user dict，斷詞結果與本行程相同
+"""
+from __future__ import annotations
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator, List, Optional
+import multiprocessing
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import jieba
+
+if TYPE_CHECKING:
+    from lexicon_bundle import LexiconStore
+
+JIEBA_CACHE_DIR = os.getenv("JIEBA_CACHE_DIR") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), ".cache", "jieba")
+# 批次斷詞的行程數（0 = 不開行程池）
+SEGMENT_PROCESSES = int(os.getenv("SEGMENT_PROCESSES", "0"))
+# 每個行程一次拿幾篇（太小會被行程間傳遞的成本吃掉）
+SEGMENT_CHUNK = 64
+
+_EMOJI_CLASS = (
+    "\U0001F300-\U0001F6FF"
+    "\U0001F900-\U0001F9FF"
+    "\U0001F1E6-\U0001F1FF"
+    "\u2600-\u26FF"
+    "\u2700-\u27BF"
+)
+_PUNCT_CLASS = "!?！？。，,.…~"
+# emoji 整串、或單一個標點：前後補空白，讓 jieba 把它們切成獨立 token
+# 開頭的 lookahead 是合併後的字元集，讓 re 能用它快速跳過不相關的字（少了它，兩個分支的
+# 交替比原本兩次 re.sub 還慢）
+_PRETOKEN_RE = re.compile(f"(?=[{_EMOJI_CLASS}{_PUNCT_CLASS}])([{_EMOJI_CLASS}]+|[{_PUNCT_CLASS}])")
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_size = 0
+init_seconds: Optional[float] = None
+
+
+def configure(cache_dir: str = JIEBA_CACHE_DIR) -> None:
+    """必須在 jieba 初始化前呼叫（之後改快取位置沒有作用）"""
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        jieba.dt.tmp_dir = cache_dir
+    except OSError:
+        pass   # 唯讀環境：退回 jieba 預設的暫存目錄
+
+
+def initialize(cache_dir: str = JIEBA_CACHE_DIR) -> float:
+    """建好 prefix dict（有快取就直接讀），回傳花費秒數；已初始化過則幾乎不花時間"""
+    global init_seconds
+    if jieba.dt.initialized:
+        return init_seconds or 0.0
+    configure(cache_dir)
+    started = time.perf_counter()
+    jieba.initialize()
+    init_seconds = time.perf_counter() - started
+    return init_seconds
+
+
+def pretokenize(text: str) -> str:
+    return _PRETOKEN_RE.sub(r" \1 ", text)
+
+
+def iter_cut(text: str, tokenizer: Optional[jieba.Tokenizer] = None) -> Iterator[str]:
+    """前處理 + jieba，邊切邊產出（去掉空白 token）；只走一遍的呼叫端不必先建 list"""
+    for t in (tokenizer or jieba.dt).cut(pretokenize(text)):
+        t = t.strip()
+        if t:
+            yield t
+
+
+def cut(text: str) -> List[str]:
+    return list(iter_cut(text))
+
+
+def private_tokenizer(words: Iterable[str] = (), cache_dir: str = JIEBA_CACHE_DIR) -> jieba.Tokenizer:
+    """
+    獨立的 jieba Tokenizer：自己一份 prefix dict（約多 50 MiB）加上給定的使用者詞，
+    全域詞典之後註冊或移除什麼詞都不影響它；加詞方式與 lexicon_bundle 註冊 user dict 相同（不給詞頻）
+    """
+    tokenizer = jieba.Tokenizer()
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        tokenizer.tmp_dir = cache_dir
+    except OSError:
+        pass
+    tokenizer.initialize()
+    for w in words:
+        tokenizer.add_word(w)
+    return tokenizer
+
+
+def _cut_chunk(texts: List[str]) -> List[List[str]]:
+    return [cut(t) for t in texts]
+
+
+def _init_worker(cache_dir: str, lexicon_dir: Optional[str], snapshot_dir: Optional[str]) -> None:
+    initialize(cache_dir)
+    if lexicon_dir:
+        from lexicon_bundle import LexiconStore
+        LexiconStore(lexicon_dir, snapshot_dir)   # 讀同一份快照並註冊 jieba user dict
+
+
+def enable_parallel(processes: int = 0, lexicons: Optional["LexiconStore"] = None) -> int:
+    """
+    開行程池給 cut_many 用（0 = CPU 核心數）；lexicons 是本行程斷詞用的詞庫，子行程會註冊同一份 user dict
+    呼叫端此時多半已有模型載入、Gemini、詞庫監看等執行緒，fork 可能卡在它們持有的鎖上
+    （import lock、torch、logging），所以用 forkserver / spawn。子行程會重新 import __main__，
+    呼叫端的 CLI 模組頂層不要 import emotion_models。詞庫熱更新不會同步到子行程
+    """
+    global _pool, _pool_size
+    disable_parallel()
+    processes = processes or multiprocessing.cpu_count()
+    if processes <= 1:
+        return 0
+    initialize()
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    _pool = ProcessPoolExecutor(
+        processes, mp_context=multiprocessing.get_context(method), initializer=_init_worker,
+        initargs=(jieba.dt.tmp_dir or JIEBA_CACHE_DIR,
+                  lexicons.src_dir if lexicons else None, lexicons.snapshot_dir if lexicons else None),
+    )
+    _pool_size = processes
+    return processes
+
+
+def disable_parallel() -> None:
+    global _pool, _pool_size
+    if _pool is not None:
+        _pool.shutdown(wait=True)
+    _pool, _pool_size = None, 0
+
+
+def cut_many(texts: List[str]) -> List[List[str]]:
+    """批次斷詞，順序與 texts 對齊；篇數不到兩個 chunk 時直接在本行程做"""
+    texts = list(texts)
+    if _pool is None or len(texts) < SEGMENT_CHUNK * 2:
+        return _cut_chunk(texts)
+    chunks = [texts[i:i + SEGMENT_CHUNK] for i in range(0, len(texts), SEGMENT_CHUNK)]
+    out: List[List[str]] = []
+    for part in _pool.map(_cut_chunk, chunks):
+        out.extend(part)
+    return out
+
+
+def stats() -> Dict:
+    return {
+        "initialized": bool(jieba.dt.initialized),
+        "init_seconds": init_seconds,
+        "cache_dir": jieba.dt.tmp_dir,
+        "processes": _pool_size,
+    }
+
+
+def main(argv=None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] != ["build-cache"]:
+        print("用法：python segmenter.py build-cache [目錄]   # 預先產生 jieba 字典快取")
+        return 1
+    cache_dir = argv[1] if len(argv) > 1 else JIEBA_CACHE_DIR
+    seconds = initialize(cache_dir)
+    print(f"✅ jieba 字典快取：{cache_dir}（{seconds:.2f}s）")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,352 @@
+# backend/api/utils/student_model.py
+"""
+蒸餾小模型（MODEL_BACKEND=student）：用 RoBERTa（老師）的分數訓練一個 CPU 上很快的線性模型
+
+多數日記很短，110M 參數的 Erlangshen 對它們太重，卻決定了每個核心的吞吐上限。學生模型：
+- 特徵：字元 1～3-gram + jieba 詞，以 crc32 雜湊到固定維度（不存詞表；跨行程結果一致）
+- 兩個線性頭（logistic）：score 頭學老師的 p_pos - p_neg，conf 頭學老師的平均信心；
+  輸出同樣是 (score in [-1,1], conf)，融合、串接、事件加權完全不用改
+- 訓練只用 NumPy（小批次 AdaGrad + L2），不需要 GPU 或 torch
+
+流程：
+    # 1) 老師標註：每篇跑一次 RoBERTa（model_score_many），記下 mdl_s / mdl_conf 與融合後標籤
+    python student_model.py label diaries.txt -o teacher.jsonl
+    # 2) 訓練學生
+    python student_model.py train teacher.jsonl -o models/student.npz --lexicon-dir lexicons/backend
+    # 3) 與老師比吞吐與融合後標籤一致率
+    python bench_student.py --teacher teacher.jsonl
+    # 4) 上線
+    MODEL_BACKEND=student STUDENT_MODEL_PATH=models/student.npz python app.py
+
+jieba 詞特徵用訓練當時詞庫的使用者詞（存在模型檔裡），以獨立的 jieba Tokenizer 斷詞：
+訓練與上線的特徵空間一定相同，不受行程裡全域 jieba 詞典註冊了什麼影響。
+模型 meta 記錄詞庫版本，載入時與上線詞庫不同會警告（詞庫大改後建議重新訓練）
+"""
+from __future__ import annotations
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+from array import array
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+import zlib
+
+import numpy as np
+
+from safe_logging import get_logger
+
+log = get_logger("student")
+
+DEFAULT_STUDENT_PATH = os.path.join("models", "student.npz")
+# 與後端（emotion_models.LEXICON_DIR）相同的預設詞庫
+DEFAULT_LEXICON_DIR = os.getenv("LEXICON_DIR") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "lexicons", "backend")
+HASH_BITS = 18
+CHAR_NGRAMS = (1, 3)
+
+
+def _sigmoid(z: np.ndarray) -> np.ndarray:
+    return 1.0 / (1.0 + np.exp(-np.clip(z, -30.0, 30.0)))
+
+
+class StudentClassifier:
+    """
+    weights：(2, 2**hash_bits) float32，第 0 列是 score 頭、第 1 列是 conf 頭
+    user_words：jieba 詞特徵用的使用者詞（訓練當時詞庫的 jieba_words），斷詞用自己的 Tokenizer
+    """
+
+    def __init__(self, weights: np.ndarray, bias: np.ndarray, hash_bits: int = HASH_BITS,
+                 char_ngrams: Tuple[int, int] = CHAR_NGRAMS, words: bool = True, meta: Optional[Dict] = None,
+                 user_words: Sequence[str] = ()):
+        self.weights = weights
+        self.bias = bias
+        self.hash_bits = hash_bits
+        self.char_ngrams = tuple(char_ngrams)
+        self.words = words
+        self.user_words = tuple(user_words)
+        self.meta = meta or {}
+        self.param_bytes = weights.nbytes + bias.nbytes
+        self.version = hashlib.sha1(
+            weights.tobytes() + bias.tobytes() + "\n".join(self.user_words).encode("utf-8")).hexdigest()[:12]
+        self._tokenizer = None
+        self._tokenizer_lock = threading.Lock()
+
+    @classmethod
+    def empty(cls, hash_bits: int = HASH_BITS, char_ngrams: Tuple[int, int] = CHAR_NGRAMS,
+              words: bool = True, user_words: Sequence[str] = ()) -> "StudentClassifier":
+        return cls(np.zeros((2, 1 << hash_bits), dtype=np.float32), np.zeros(2), hash_bits, char_ngrams, words,
+                   user_words=user_words)
+
+    # ── 特徵 ──────────────────────────────────────────────────
+    def tokenizer(self):
+        """第一次用到才建（jieba prefix dict 要一秒左右）"""
+        if self._tokenizer is None:
+            with self._tokenizer_lock:
+                if self._tokenizer is None:
+                    import segmenter
+                    self._tokenizer = segmenter.private_tokenizer(self.user_words)
+        return self._tokenizer
+
+    def featurize(self, text: str) -> array:
+        """一篇 → 去重後的特徵 id（字元 n-gram 與 jieba 詞分開雜湊，不會互撞成同一個字串）"""
+        mask = (1 << self.hash_bits) - 1
+        text = text.strip().lower()
+        feats = set()
+        lo, hi = self.char_ngrams
+        for n in range(lo, hi + 1):
+            for i in range(len(text) - n + 1):
+                feats.add("c" + text[i:i + n])
+        if self.words:
+            import segmenter
+            feats.update("w" + t for t in segmenter.iter_cut(text, self.tokenizer()))
+        return array("I", sorted({zlib.crc32(f.encode("utf-8")) & mask for f in feats}))
+
+    def design(self, texts: Iterable[str]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """CSR：(indptr, indices, values)；每列二元特徵做 L2 正規化"""
+        rows = [self.featurize(t) for t in texts]
+        lengths = np.fromiter((len(r) for r in rows), dtype=np.int64, count=len(rows))
+        indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=indptr[1:])
+        indices = np.frombuffer(b"".join(r.tobytes() for r in rows), dtype=np.uint32).astype(np.int64)
+        values = np.repeat(1.0 / np.sqrt(np.maximum(lengths, 1)), lengths)
+        return indptr, indices, values
+
+    # ── 推論 ──────────────────────────────────────────────────
+    def _logits(self, owners: np.ndarray, indices: np.ndarray, values: np.ndarray, n: int) -> np.ndarray:
+        return np.stack([
+            np.bincount(owners, weights=self.weights[k, indices] * values, minlength=n) + self.bias[k]
+            for k in range(2)
+        ])
+
+    def predict(self, texts: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """回傳 (scores, confs)，皆為 (n,) float64"""
+        indptr, indices, values = self.design(texts)
+        n = len(texts)
+        owners = np.repeat(np.arange(n), np.diff(indptr))
+        z = self._logits(owners, indices, values, n)
+        return 2.0 * _sigmoid(z[0]) - 1.0, _sigmoid(z[1])
+
+    def score_many(self, texts: Sequence[str]) -> List[Tuple[float, float]]:
+        """與 AnalysisEngine.model_score_many 相同的輸出：[(score, conf)]"""
+        if not texts:
+            return []
+        scores, confs = self.predict(texts)
+        return list(zip(scores.tolist(), confs.tolist()))
+
+    # ── 存取 ──────────────────────────────────────────────────
+    def save(self, path: str) -> str:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        config = {"hash_bits": self.hash_bits, "char_ngrams": list(self.char_ngrams), "words": self.words,
+                  "user_words": list(self.user_words)}
+        with open(path, "wb") as f:   # 直接給檔案物件，np.savez 不會自動補 .npz
+            np.savez_compressed(f, weights=self.weights, bias=self.bias,
+                                config=np.array(json.dumps(config)),
+                                meta=np.array(json.dumps(self.meta, ensure_ascii=False)))
+        return path
+
+    @classmethod
+    def load(cls, path: str, lexicon_dir: Optional[str] = None) -> "StudentClassifier":
+        """lexicon_dir 是上線用的詞庫：版本與訓練時不同就警告（特徵仍用模型裡的詞表，結果不受影響）"""
+        with np.load(path, allow_pickle=False) as data:
+            config = json.loads(str(data["config"]))
+            # 舊模型沒存 user_words：當時是在沒有使用者詞典的 jieba 上訓練的
+            student = cls(data["weights"], data["bias"], config["hash_bits"], tuple(config["char_ngrams"]),
+                          config["words"], json.loads(str(data["meta"])), config.get("user_words", ()))
+        trained = student.meta.get("lexicon_version")
+        if lexicon_dir and student.words:
+            from lexicon_bundle import LexiconStore
+            current = LexiconStore(lexicon_dir, register_jieba=False).current.version
+            if trained != current:
+                log.warning("⚠️ 學生模型 %s 訓練時的詞庫版本是 %s，目前詞庫是 %s；詞特徵仍用訓練時的詞表，"
+                            "詞庫大改後建議重新訓練", path, trained or "未記錄", current)
+        return student
+
+
+# ───────────────────────────────────────────────────────────────
+# 訓練
+# ───────────────────────────────────────────────────────────────
+def _gather(indptr: np.ndarray, rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """CSR 裡取出幾列：回傳 (每個非零元素屬於第幾列（0..len(rows)-1）, 在 indices 裡的位置)"""
+    starts, lengths = indptr[rows], indptr[rows + 1] - indptr[rows]
+    owners = np.repeat(np.arange(len(rows)), lengths)
+    offsets = np.cumsum(lengths) - lengths
+    return owners, np.arange(lengths.sum()) - np.repeat(offsets, lengths) + np.repeat(starts, lengths)
+
+
+def _errors(student: StudentClassifier, design, rows: np.ndarray, targets: np.ndarray) -> Dict:
+    indptr, indices, values = design
+    owners, pos = _gather(indptr, rows)
+    z = student._logits(owners, indices[pos], values[pos], len(rows))
+    score, conf = 2.0 * _sigmoid(z[0]) - 1.0, _sigmoid(z[1])
+    teacher_s, teacher_c = 2.0 * targets[0, rows] - 1.0, targets[1, rows]
+    return {
+        "rows": int(len(rows)),
+        "score_mae": float(np.mean(np.abs(score - teacher_s))) if len(rows) else 0.0,
+        "conf_mae": float(np.mean(np.abs(conf - teacher_c))) if len(rows) else 0.0,
+        "sign_agreement": float(np.mean(np.sign(score) == np.sign(teacher_s))) if len(rows) else 1.0,
+    }
+
+
+def train(texts: Sequence[str], mdl_s: Sequence[float], mdl_conf: Sequence[float],
+          hash_bits: int = HASH_BITS, char_ngrams: Tuple[int, int] = CHAR_NGRAMS, words: bool = True,
+          epochs: int = 8, batch_size: int = 256, lr: float = 0.5, l2: float = 1e-6,
+          valid: float = 0.1, seed: int = 0, lexicon=None) -> StudentClassifier:
+    """
+    兩個頭都是帶軟目標的 logistic 迴歸（score 頭的目標是 (mdl_s + 1) / 2），小批次 AdaGrad
+    老師 conf == 0 的列（推論失敗）不拿來訓練；valid 比例的列留作驗證，結果記在 meta
+    lexicon（LexiconBundle）：詞特徵用它的 jieba 使用者詞，版本記在 meta；None = 不加使用者詞
+    """
+    user_words = lexicon.jieba_words() if lexicon is not None and words else ()
+    student = StudentClassifier.empty(hash_bits, char_ngrams, words, user_words)
+    started = time.perf_counter()
+    design = student.design(texts)
+    tokenizer = student._tokenizer
+    indptr, indices, values = design
+    targets = np.stack([(np.clip(np.asarray(mdl_s, dtype=np.float64), -1.0, 1.0) + 1.0) / 2.0,
+                        np.asarray(mdl_conf, dtype=np.float64)])
+    usable = np.flatnonzero(targets[1] > 0.0)
+    rng = np.random.default_rng(seed)
+    rng.shuffle(usable)
+    n_valid = int(len(usable) * valid)
+    valid_rows, train_rows = usable[:n_valid], usable[n_valid:]
+
+    dim = 1 << hash_bits
+    weights = np.zeros((2, dim))
+    bias = np.zeros(2)
+    g_weights = np.full((2, dim), 1e-8)
+    g_bias = np.full(2, 1e-8)
+    for _ in range(epochs):
+        rng.shuffle(train_rows)
+        for start in range(0, len(train_rows), batch_size):
+            rows = train_rows[start:start + batch_size]
+            owners, pos = _gather(indptr, rows)
+            cols, vals = indices[pos], values[pos]
+            m = len(rows)
+            z = np.stack([np.bincount(owners, weights=weights[k, cols] * vals, minlength=m) + bias[k]
+                          for k in range(2)])
+            err = _sigmoid(z) - targets[:, rows]
+            for k in range(2):
+                grad = np.bincount(cols, weights=err[k, owners] * vals, minlength=dim) / m
+                touched = np.flatnonzero(grad)
+                grad = grad[touched] + l2 * weights[k, touched]
+                g_weights[k, touched] += grad * grad
+                weights[k, touched] -= lr * grad / np.sqrt(g_weights[k, touched])
+            grad_b = err.mean(axis=1)
+            g_bias += grad_b * grad_b
+            bias -= lr * grad_b / np.sqrt(g_bias)
+
+    student = StudentClassifier(weights.astype(np.float32), bias, hash_bits, char_ngrams, words,
+                                user_words=user_words)
+    student._tokenizer = tokenizer   # 同一份詞表，不必再建一次
+    student.meta = {
+        "lexicon_version": lexicon.version if lexicon is not None else None,
+        "train": _errors(student, design, train_rows, targets),
+        "valid": _errors(student, design, valid_rows, targets),
+        "skipped": int(len(texts) - len(usable)),
+        "epochs": epochs,
+        "train_seconds": time.perf_counter() - started,
+    }
+    return student
+
+
+# ───────────────────────────────────────────────────────────────
+# CLI：老師標註 / 訓練
+# ───────────────────────────────────────────────────────────────
+def label_corpus(texts: Iterable[str], out, batch_size: int = 32) -> Dict:
+    """每篇跑一次老師（model_score_many，不走串接），寫出 {text, mdl_s, mdl_conf, label} 的 JSONL"""
+    from emotion_models import engine
+
+    n = loaded = 0
+    model_seconds = 0.0
+    texts = (t.strip() for t in texts if t and t.strip())
+    while True:
+        batch = list(itertools.islice(texts, batch_size))
+        if not batch:
+            break
+        started = time.perf_counter()
+        scores = engine.model_score_many(batch)
+        model_seconds += time.perf_counter() - started
+        for text, (s, c) in zip(batch, scores):
+            label = engine.fuse(engine.features(text), s, c)["label"]
+            out.write(json.dumps({"text": text, "mdl_s": s, "mdl_conf": c, "label": label}, ensure_ascii=False) + "\n")
+            n += 1
+            loaded += c != 0.0
+    return {
+        "texts": n,
+        "model": engine.model_registry.model_name,
+        "backend": engine.model_registry.backend,
+        "model_scored": loaded,
+        "teacher_texts_per_sec": n / model_seconds if model_seconds else None,
+    }
+
+
+def read_teacher(path: str) -> Tuple[List[str], List[float], List[float], List[str]]:
+    texts, scores, confs, labels = [], [], [], []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                rec = json.loads(line)
+                texts.append(rec["text"])
+                scores.append(float(rec["mdl_s"]))
+                confs.append(float(rec["mdl_conf"]))
+                labels.append(rec.get("label"))
+    return texts, scores, confs, labels
+
+
+def main(argv: Optional[Iterable[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="蒸餾小模型：老師標註與訓練")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("label", help="用 RoBERTa（老師）標註未標註語料")
+    p.add_argument("corpus", help="一行一篇的 .txt 或含 text 欄位的 .jsonl")
+    p.add_argument("-o", "--output", required=True, help="老師標註 JSONL")
+    p.add_argument("--limit", type=int, default=None)
+    p.add_argument("--batch-size", type=int, default=32)
+    p = sub.add_parser("train", help="用老師標註訓練學生模型")
+    p.add_argument("teacher", help="label 產生的 JSONL")
+    p.add_argument("-o", "--output", default=DEFAULT_STUDENT_PATH)
+    p.add_argument("--hash-bits", type=int, default=HASH_BITS)
+    p.add_argument("--char-ngrams", type=int, nargs=2, default=list(CHAR_NGRAMS), metavar=("MIN", "MAX"))
+    p.add_argument("--no-words", action="store_true", help="不用 jieba 詞特徵（只有字元 n-gram，推論更快）")
+    p.add_argument("--lexicon-dir", default=DEFAULT_LEXICON_DIR,
+                   help="詞特徵用的詞庫（與上線的 LEXICON_DIR 相同）；它的使用者詞與版本會存進模型")
+    p.add_argument("--epochs", type=int, default=8)
+    p.add_argument("--batch-size", type=int, default=256)
+    p.add_argument("--lr", type=float, default=0.5)
+    p.add_argument("--l2", type=float, default=1e-6)
+    p.add_argument("--valid", type=float, default=0.1, help="留作驗證的比例")
+    p.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args(argv)
+
+    if args.cmd == "label":
+        from inference_backends import _read_corpus
+        texts = _read_corpus(args.corpus, args.limit)
+        with open(args.output, "w", encoding="utf-8") as out:
+            report = label_corpus(texts, out, args.batch_size)
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        if report["texts"] and not report["model_scored"]:
+            print("⚠️ 模型沒有載入，老師分數全是 0，無法拿來訓練", file=sys.stderr)
+            return 1
+        return 0
+
+    from lexicon_bundle import LexiconStore
+
+    texts, scores, confs, _ = read_teacher(args.teacher)
+    lexicon = LexiconStore(args.lexicon_dir, register_jieba=False).current
+    student = train(texts, scores, confs, args.hash_bits, tuple(args.char_ngrams), not args.no_words,
+                    args.epochs, args.batch_size, args.lr, args.l2, args.valid, args.seed, lexicon)
+    student.meta.update({"teacher": os.path.abspath(args.teacher), "texts": len(texts),
+                         "lexicon_dir": os.path.abspath(args.lexicon_dir),
+                         "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z")})
+    student.save(args.output)
+    print(json.dumps(dict(student.meta, version=student.version, param_bytes=student.param_bytes),
+                     ensure_ascii=False, indent=2))
+    print(f"✅ 學生模型：{args.output}（MODEL_BACKEND=student STUDENT_MODEL_PATH={args.output}）", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
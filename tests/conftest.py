@@ -0,0 +1,12 @@
+# 測試直接 import 專案根目錄的模組（與 batch_score.py 等工具相同的平面結構）
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+# 測試一律不載模型、不打 Gemini，分析結果只看詞典（環境變數必須在 import emotion_models 之前設好）
+os.environ.setdefault("MODEL_STARTUP_MODE", "lexicon")
+os.environ["GEMINI_API_KEY"] = ""
+os.environ.pop("ANALYSIS_CACHE_DB", None)
@@ -0,0 +1,81 @@
+"""快取開關與降級結果：0 要連磁碟層一起關；模型載入失敗時的詞典結果不能進快取；磁碟層有列數上限"""
+import time
+
+import pytest
+
+from analysis_cache import build_cache
+
+
+def test_zero_size_disables_both_tiers(tmp_path):
+    db = str(tmp_path / "cache.db")
+    off = build_cache("result", 0, 60, db)
+    assert off.disk is None
+    off.set("k", {"label": "positive"})
+    assert off.get("k") is None
+    assert not (tmp_path / "cache.db").exists()
+
+    on = build_cache("result", 8, 60, db)
+    assert on.disk is not None
+    on.set("k", {"label": "positive"})
+    assert build_cache("result", 8, 60, db).get("k") == {"label": "positive"}
+
+
+class _BrokenRegistry:
+    """模式是 eager，但模型載入失敗（get() 回 None、error 有值）"""
+    model_name = "fake"
+    backend = "torch"
+    onnx_path = None
+    student_path = None
+    mode = "eager"
+    error = "load failed"
+
+    def get(self):
+        return None
+
+
+def test_degraded_results_are_not_cached(tmp_path):
+    pytest.importorskip("jieba")
+    from analysis_engine import AnalysisEngine
+    from emotion_models import DEFAULT_MSG, gemini_client, lexicons
+
+    engine = AnalysisEngine("test", lexicons, _BrokenRegistry(), gemini_client, DEFAULT_MSG,
+                            cache_db=str(tmp_path / "cache.db"))
+    text = "今天被主管稱讚，好開心"
+    assert engine.analyze(text) == engine.analyze(text)
+    stats = engine.cache_stats()
+    assert stats["result"]["sets"] == 0
+    assert stats["message"]["sets"] == 0
+
+    # 串接模式由詞典判定的結果與模型無關，照常快取
+    cascade = AnalysisEngine("test", lexicons, _BrokenRegistry(), gemini_client, DEFAULT_MSG,
+                             cascade=True, cascade_min_score=0.0, cascade_min_hits=0)
+    cascade.analyze(text)
+    assert cascade.cache_stats()["result"]["sets"] == 1
+
+
+def _rows(cache):
+    return cache._conn().execute("SELECT COUNT(*) FROM cache WHERE ns = ?", (cache.namespace,)).fetchone()[0]
+
+
+def test_disk_tier_is_capped_and_purged(tmp_path, monkeypatch):
+    from analysis_cache import SQLiteCache
+
+    db = str(tmp_path / "cache.db")
+    capped = SQLiteCache(db, "result", ttl=None, max_rows=10, purge_every=5)
+    other = SQLiteCache(db, "message", ttl=None, max_rows=10, purge_every=5)
+    other.set("keep", 1)
+    for i in range(50):
+        capped.set(f"k{i}", i)
+    assert _rows(capped) <= 10 + capped.purge_every
+    assert capped.get("k49") == 49          # 留下最近寫入的
+    assert capped.get("k0") is None
+    assert other.get("keep") == 1           # 不動其他 namespace
+
+    # 過期列不必等到同一個 key 再被讀，定期就會清掉
+    expiring = SQLiteCache(db, "segment", ttl=60, purge_every=3)
+    expiring.set("a", 1)
+    expiring.set("b", 2)
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 120)
+    expiring.set("c", 3)
+    assert _rows(expiring) == 1             # 只剩剛寫入的 c
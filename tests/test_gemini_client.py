@@ -0,0 +1,45 @@
+"""GeminiClient：呼叫端逾時要計入斷路器；排隊中的上游呼叫有上限"""
+import time
+
+import pytest
+
+pytest.importorskip("requests")
+
+from gemini_client import GeminiClient
+from gemini_stub import StubGeminiServer
+
+
+def _wait_idle(client, timeout=5.0):
+    end = time.monotonic() + timeout
+    while client.stats()["pending"] and time.monotonic() < end:
+        time.sleep(0.02)
+
+
+def test_caller_timeouts_open_the_breaker():
+    with StubGeminiServer(delay=0.3) as stub:
+        client = GeminiClient("stub", stub.url, build_prompt=str, deadline=2.0, failure_threshold=2)
+        try:
+            assert client.generate_with_outcome("a", deadline=0.05) == (None, "timeout")
+            assert client.generate_with_outcome("b", deadline=0.05) == (None, "timeout")
+            assert client.breaker.state == "open"
+            assert client.generate_with_outcome("c")[1] == "circuit_open"
+            # 背景那兩次晚到的成功不能把斷路器關回去
+            _wait_idle(client)
+            assert client.breaker.state == "open"
+        finally:
+            client.close()
+
+
+def test_pending_fetches_are_bounded():
+    with StubGeminiServer(delay=0.3) as stub:
+        client = GeminiClient("stub", stub.url, build_prompt=str, deadline=2.0,
+                              pool_size=1, max_pending=2, failure_threshold=100)
+        try:
+            outcomes = [client.generate_with_outcome(f"s{i}", deadline=0.01)[1] for i in range(3)]
+            assert outcomes == ["timeout", "timeout", "overloaded"]
+            assert client.stats()["overloaded"] == 1
+            _wait_idle(client)
+            assert client.stats()["pending"] == 0
+            assert client.generate_with_outcome("s0")[1] == "cache_hit"
+        finally:
+            client.close()
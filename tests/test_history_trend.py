@@ -0,0 +1,40 @@
+"""/analyze 記錄的分析歷史要帶分數，/history/<user>/trend 的滾動平均才不會是 null"""
+import os
+
+import pytest
+
+DEMO_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ai_test_done")
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    pytest.importorskip("flask")
+    pytest.importorskip("jieba")
+    import history_store
+
+    monkeypatch.setattr(history_store, "HISTORY_DB", str(tmp_path / "history.db"))
+    monkeypatch.setattr(history_store, "_store", None)
+    monkeypatch.syspath_prepend(DEMO_DIR)
+    from app import app
+    return app.test_client()
+
+
+def _scored_days(client, user):
+    trend = client.get(f"/history/{user}/trend").get_json()
+    return [p["average_score"] for p in trend["rolling_average"] if p["average_score"] is not None]
+
+
+def test_analyze_records_scores(client):
+    resp = client.post("/analyze", json={"text": "今天超開心，被主管稱讚了", "user_id": "u1"})
+    assert resp.status_code == 200
+    scores = _scored_days(client, "u1")
+    assert scores and scores[-1] > 0
+
+
+def test_streamed_analyze_records_scores_without_sending_them(client):
+    resp = client.post("/analyze", json={"text": "考試失敗了，好難過", "user_id": "u2"},
+                       headers={"Accept": "text/event-stream"})
+    body = resp.get_data(as_text=True)
+    assert "event: result" in body and '"scores"' not in body
+    scores = _scored_days(client, "u2")
+    assert scores and scores[-1] < 0
@@ -0,0 +1,91 @@
+"""analyze_incremental 在編修、插入、刪除句子後，結果都要與完整重算的 analyze 相同（含分段快取關閉）"""
+import pytest
+
+pytest.importorskip("jieba")
+
+from analysis_engine import AnalysisEngine, _token_windows
+from emotion_models import DEFAULT_MSG, gemini_client, lexicons
+from metrics import begin_trace, end_trace
+
+BASE = [
+    "今天早上被鬧鐘吵醒，心情有點煩躁。",
+    "上班的路上塞車，差點遲到。",
+    "中午和同事一起吃飯，聊得很開心！",
+    "下午的會議很順利，主管稱讚了我的報告。",
+    "晚上回家覺得好累，但也有點期待明天。",
+]
+
+EDITS = [
+    ("原稿", BASE),
+    ("改一句", BASE[:1] + ["上班的路上很順，還提早到了。"] + BASE[2:]),
+    ("插入", BASE[:3] + ["傍晚突然下大雨，整個人很沮喪。"] + BASE[3:]),
+    ("刪除", BASE[:2] + BASE[3:]),
+    ("改回原稿", BASE),
+    ("全部換掉", ["什麼都不想做。", "好難過，好想哭。"]),
+]
+
+
+class _FakeRegistry:
+    """不載真的模型：engine 只需要這些屬性，get() 非 None 代表模型可用"""
+    model_name = "fake"
+    backend = "torch"
+    onnx_path = None
+    student_path = None
+    mode = "eager"
+    error = None
+
+    def get(self):
+        return object(), object()
+
+
+def _encode_windows(self, texts):
+    # 以字元碼當 token id，照 engine 的切段規則切
+    windows, owners = [], []
+    for idx, text in enumerate(texts):
+        for w in _token_windows([ord(c) for c in text], self.chunk_tokens, self.chunk_stride, {ord("。")}):
+            windows.append(w)
+            owners.append(idx)
+    return windows, owners
+
+
+def _score_batch(self, windows):
+    # 每段分數只由該段內容決定，與同批有哪些段無關
+    return [((sum(w) % 201) / 100.0 - 1.0, 0.5 + (len(w) % 5) / 10.0) for w in windows]
+
+
+@pytest.fixture(autouse=True)
+def fake_model(monkeypatch):
+    monkeypatch.setattr(AnalysisEngine, "_encode_windows", _encode_windows)
+    monkeypatch.setattr(AnalysisEngine, "_score_batch", _score_batch)
+
+
+def _engine(incremental_cache_size):
+    # 結果快取關閉，analyze 與 analyze_incremental 每次都真的重算
+    return AnalysisEngine(
+        "test", lexicons, _FakeRegistry(), gemini_client, DEFAULT_MSG,
+        chunk_tokens=12, max_len=16, cache_size=0, incremental_cache_size=incremental_cache_size,
+    )
+
+
+@pytest.mark.parametrize("incremental_cache_size", [0, 1024])
+def test_incremental_matches_full_analysis(incremental_cache_size):
+    full, incremental = _engine(0), _engine(incremental_cache_size)
+    reused = 0
+    for name, sentences in EDITS:
+        text = "".join(sentences)
+        trace = begin_trace("test")
+        try:
+            got = incremental.analyze_incremental(text)
+        finally:
+            end_trace(trace)
+        assert got == full.analyze(text), name
+        assert trace.fields["chunks"] > 0, name   # 確實走到模型分段
+        reused += trace.fields["segments_reused"] + trace.fields["chunks_reused"]
+    if incremental_cache_size:
+        assert reused > 0
+    else:
+        assert reused == 0
+
+
+def test_incremental_blank_text():
+    assert _engine(1024).analyze_incremental("   ") == _engine(0).analyze("   ")
@@ -0,0 +1,20 @@
+"""ONNX 匯出的輸入順序：必須照 forward 簽章，不能照 tokenizer 的 key 順序"""
+import pytest
+
+from inference_backends import _forward_order
+
+
+class _Bert:
+    def forward(self, input_ids=None, attention_mask=None, token_type_ids=None, position_ids=None):
+        pass
+
+
+def test_forward_order_follows_signature_not_tokenizer_keys():
+    sample = {"input_ids": 0, "token_type_ids": 0, "attention_mask": 0}
+    assert _forward_order(_Bert(), sample) == ["input_ids", "attention_mask", "token_type_ids"]
+
+
+def test_forward_order_rejects_gaps():
+    # 缺了 attention_mask，token_type_ids 依位置會被當成 attention_mask
+    with pytest.raises(ValueError):
+        _forward_order(_Bert(), {"input_ids": 0, "token_type_ids": 0})
@@ -0,0 +1,34 @@
+"""jieba 使用者詞只收正負向詞與主題詞：複合的興奮詞/事件詞不能把裡面的情緒詞藏起來"""
+import os
+
+import pytest
+
+from lexicon_bundle import JIEBA_CATEGORIES, compile_lexicons
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND_LEXICONS = os.path.join(ROOT, "lexicons", "backend")
+
+
+def test_jieba_words_only_whole_token_categories():
+    bundle = compile_lexicons(BACKEND_LEXICONS)
+    registered = set(bundle.jieba_words())
+    scored = {w for c in JIEBA_CATEGORIES for w in bundle[c]}
+    assert registered <= scored
+    for compound in ("超期待", "超級期待", "超興奮"):
+        assert compound not in registered
+    assert "壓力山大" in registered
+
+
+@pytest.mark.parametrize("text, label, keyword", [
+    ("今天超期待", "positive", "期待"),
+    ("我超興奮", "positive", "興奮"),
+    ("超級期待明天的旅行", "positive", "期待"),
+    ("今天壓力山大", "negative", "壓力山大"),
+])
+def test_compound_words_keep_polarity(text, label, keyword):
+    pytest.importorskip("jieba")
+    from emotion_models import engine
+
+    result = engine.label(engine.features(text))
+    assert result["label"] == label
+    assert keyword in result["keywords"]
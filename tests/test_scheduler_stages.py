@@ -0,0 +1,48 @@
+"""有 micro-batch scheduler 時，model 階段只在整批推論時記一次；各請求的等待另記在 model_wait"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+pytest.importorskip("jieba")
+
+from analysis_engine import AnalysisEngine
+from emotion_models import DEFAULT_MSG, gemini_client, lexicons
+from metrics import STAGE_SECONDS
+
+DEMO_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ai_test_done")
+
+
+class _FakeRegistry:
+    model_name = "fake"
+    backend = "torch"
+    onnx_path = None
+    student_path = None
+    mode = "eager"
+    error = None
+
+    def get(self):
+        return object(), object()
+
+
+def test_model_stage_counts_batches_not_requests(monkeypatch):
+    monkeypatch.syspath_prepend(DEMO_DIR)
+    from inference_scheduler import MicroBatchScheduler
+
+    monkeypatch.setattr(AnalysisEngine, "_encode_windows", lambda self, texts: ([[1]] * len(texts), list(range(len(texts)))))
+    monkeypatch.setattr(AnalysisEngine, "_score_batch", lambda self, windows: [(0.5, 0.9)] * len(windows))
+    engine = AnalysisEngine("test", lexicons, _FakeRegistry(), gemini_client, DEFAULT_MSG, cache_size=0)
+    scheduler = MicroBatchScheduler(engine.model_score_many, max_batch_size=8, max_wait_ms=50)
+    engine.use_scheduler(scheduler)
+
+    model_before = STAGE_SECONDS.count(stage="model")
+    wait_before = STAGE_SECONDS.count(stage="model_wait")
+    texts = [f"第 {i} 篇：今天還好" for i in range(6)]
+    try:
+        with ThreadPoolExecutor(len(texts)) as pool:
+            list(pool.map(engine.analyze, texts))
+    finally:
+        scheduler.close()
+
+    assert STAGE_SECONDS.count(stage="model_wait") - wait_before == len(texts)
+    assert STAGE_SECONDS.count(stage="model") - model_before == scheduler.stats()["batches"]
@@ -0,0 +1,21 @@
+"""斷詞行程池：不用 fork，子行程也要註冊同一份詞庫 user dict，結果與本行程斷詞相同"""
+import pytest
+
+pytest.importorskip("jieba")
+
+import segmenter
+
+
+def test_parallel_cut_matches_in_process():
+    from emotion_models import lexicons
+
+    texts = [f"第{i}天：今天壓力山大，但還是很期待週末！" for i in range(segmenter.SEGMENT_CHUNK * 2 + 5)]
+    expected = [segmenter.cut(t) for t in texts]
+    assert "壓力山大" in expected[0]   # 只有註冊了詞庫 user dict 才切得出這個詞
+
+    assert segmenter.enable_parallel(2, lexicons) == 2
+    try:
+        assert segmenter._pool._mp_context.get_start_method() != "fork"
+        assert segmenter.cut_many(texts) == expected
+    finally:
+        segmenter.disable_parallel()
@@ -0,0 +1,22 @@
+"""單篇分析的 trace 要分別記到 tokenize、lexicon 與 scan，不能全擠進同一個 stage"""
+import os
+
+import pytest
+
+DEMO_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ai_test_done")
+
+
+def test_single_text_stages(monkeypatch):
+    pytest.importorskip("jieba")
+    monkeypatch.syspath_prepend(DEMO_DIR)
+    from emotion_model import engine
+    from metrics import begin_trace, end_trace
+
+    trace = begin_trace("test")
+    try:
+        engine.classify("今天和朋友去動物園，真的好開心")
+    finally:
+        end_trace(trace)
+    assert {"tokenize", "lexicon", "scan"} <= set(trace.stages)
+    assert "score" not in trace.stages
+    assert all(seconds >= 0 for seconds in trace.stages.values())
@@ -0,0 +1,72 @@
+"""學生模型的詞特徵不受全域 jieba 詞典影響：訓練與上線用同一份詞表，並記錄詞庫版本"""
+import logging
+
+import pytest
+
+pytest.importorskip("jieba")
+pytest.importorskip("numpy")
+
+import jieba
+
+from lexicon_bundle import LexiconStore
+from student_model import StudentClassifier, train
+
+TEXTS = ["今天壓力山大，好累", "超期待週末出去玩", "被主管稱讚了好開心", "普通的一天"] * 4
+SCORES = [-0.8, 0.7, 0.9, 0.0] * 4
+CONFS = [0.9, 0.8, 0.9, 0.6] * 4
+
+
+@pytest.fixture(scope="module")
+def lexicons():
+    from emotion_models import LEXICON_DIR
+    return LexiconStore(LEXICON_DIR, register_jieba=False)
+
+
+@pytest.fixture(scope="module")
+def saved(lexicons, tmp_path_factory):
+    student = train(TEXTS, SCORES, CONFS, hash_bits=12, epochs=2, valid=0.0, lexicon=lexicons.current)
+    path = str(tmp_path_factory.mktemp("student") / "student.npz")
+    return student.save(path), student
+
+
+def _features(student):
+    return [student.featurize(t).tolist() for t in TEXTS], student.score_many(TEXTS)
+
+
+def test_features_ignore_global_user_dictionary(saved, lexicons):
+    path, trained = saved
+    words = lexicons.current.jieba_words()
+    assert "壓力山大" in words
+
+    # 只有註冊了全域使用者詞典
+    for w in words:
+        jieba.add_word(w)
+    with_dict = _features(StudentClassifier.load(path))
+    # 全域詞典完全沒有使用者詞
+    for w in words:
+        jieba.del_word(w)
+    try:
+        without_dict = _features(StudentClassifier.load(path))
+    finally:
+        for w in words:
+            jieba.add_word(w)
+
+    assert with_dict == without_dict
+    assert with_dict[0] == [trained.featurize(t).tolist() for t in TEXTS]
+    assert "壓力山大" in list(jieba.cut("今天壓力山大"))
+    assert "壓力山大" in list(StudentClassifier.load(path).tokenizer().cut("今天壓力山大"))
+
+
+def test_lexicon_version_recorded_and_checked(saved, lexicons, caplog, monkeypatch):
+    path, trained = saved
+    assert trained.meta["lexicon_version"] == lexicons.current.version
+
+    with caplog.at_level(logging.WARNING):
+        StudentClassifier.load(path, lexicons.src_dir)
+    assert "詞庫版本" not in caplog.text
+
+    monkeypatch.setattr(lexicons.current, "version", "changed", raising=False)
+    monkeypatch.setattr("lexicon_bundle.LexiconStore", lambda *a, **k: lexicons)
+    with caplog.at_level(logging.WARNING):
+        StudentClassifier.load(path, lexicons.src_dir)
+    assert "詞庫版本" in caplog.text
@@ -0,0 +1,167 @@
+# backend/api/utils/token_scorer.py
+"""
+單次走訪的 token 評分：詞典分數、關鍵詞、主題、驚嘆號一趟算完
+
+原本每篇要把 token 串成 list，再分別走好幾遍（詞典分數一遍、驚嘆號一遍、關鍵詞一遍、
+主題一遍、正負詞個數又一遍），每遍都對好幾個 set 查同一個字串。這裡改成：
+
+- TokenTable：詞典編譯時把所有會用到的詞（情緒詞、emoji、否定/強度詞、驚嘆號、主題詞）
+  收進一張 id 表，每個 id 對應一組旗標（bit）與極性權重；每個 token 只查一次 dict
+- score_tokens()：接任何 token 迭代器（可以直接是 segmenter.iter_cut 的 generator，不必先
+  建 list），一趟算出 TokenScore；結果是幾個整數/浮點數加一個 array('I')（關鍵詞的 id），
+  不是一串 Python 字串
+- 前一個 token 只記它的旗標（否定/強度詞），不必回頭看 tokens[i-1]
+
+數值與原本的逐遍計算完全相同（加總順序一致），bench_scoring.py 會逐篇比對
+"""
+from __future__ import annotations
+from typing import Dict, Iterable, List, Tuple
+from array import array
+import sys
+
+# 旗標
+POSITIVE = 1 << 0
+NEGATIVE = 1 << 1
+EMOJI = 1 << 2
+NEGATION = 1 << 3
+STRONG = 1 << 4
+WEAK = 1 << 5
+EXCLAMATION = 1 << 6
+# 主題類別 → 旗標（依此順序輸出）
+TOPIC_FLAGS: Tuple[Tuple[str, int], ...] = (
+    ("awareness", 1 << 7), ("control", 1 << 8), ("management", 1 << 9),
+)
+_TOPIC_MASK = sum(flag for _, flag in TOPIC_FLAGS)
+# 計分用的極性詞（正、負、emoji）
+POLAR = POSITIVE | NEGATIVE | EMOJI
+# 詞典類別 → 旗標
+CATEGORY_FLAGS: Dict[str, int] = {
+    "positive": POSITIVE, "negative": NEGATIVE, "negations": NEGATION,
+    "strong_intensifiers": STRONG, "weak_intensifiers": WEAK,
+    **dict(TOPIC_FLAGS),
+}
+# 驚嘆號類 token（詞典分數的強度加成）
+EXCLAMATIONS = ("!", "！", "!!!", "！！")
+
+
+class TokenTable:
+    """詞 → id；flags[id] 是旗標，weights[id] 是極性權重（正 1、負 -1、emoji 依 emoji.tsv）"""
+
+    __slots__ = ("ids", "vocab", "flags", "weights")
+
+    def __init__(self, words: Dict[str, Iterable[str]], emoji: Dict[str, float]):
+        self.ids: Dict[str, int] = {}
+        self.vocab: List[str] = []
+        self.flags = array("H")
+        self.weights = array("d")
+        for category, flag in CATEGORY_FLAGS.items():
+            for w in words.get(category, ()):
+                self._add(w, flag)
+        for ch in emoji:
+            self._add(ch, EMOJI)
+        for t in EXCLAMATIONS:
+            self._add(t, EXCLAMATION)
+        # 權重依原本的判定順序：正向詞 > 負向詞 > emoji
+        for i, w in enumerate(self.vocab):
+            f = self.flags[i]
+            if f & POSITIVE:
+                self.weights[i] = 1.0
+            elif f & NEGATIVE:
+                self.weights[i] = -1.0
+            elif f & EMOJI:
+                self.weights[i] = float(emoji[w])
+
+    def _add(self, word: str, flag: int) -> None:
+        i = self.ids.get(word)
+        if i is None:
+            i = self.ids[sys.intern(word)] = len(self.vocab)
+            self.vocab.append(word)
+            self.flags.append(0)
+            self.weights.append(0.0)
+        self.flags[i] |= flag
+
+    def words(self, ids: Iterable[int]) -> List[str]:
+        vocab = self.vocab
+        return [vocab[i] for i in ids]
+
+    def __len__(self) -> int:
+        return len(self.vocab)
+
+
+class TokenScore:
+    """一篇的評分結果"""
+
+    __slots__ = ("lex_s", "pos_hits", "neg_hits", "pos_count", "neg_count",
+                 "exclamations", "topic_bits", "keyword_ids", "tokens")
+
+    def __init__(self, lex_s: float, pos_hits: int, neg_hits: int, pos_count: int, neg_count: int,
+                 exclamations: int, topic_bits: int, keyword_ids: array, tokens: int):
+        self.lex_s = lex_s
+        self.pos_hits = pos_hits          # 套用否定後為正的命中數
+        self.neg_hits = neg_hits          # 套用否定後為負的命中數
+        self.pos_count = pos_count        # 正向詞 token 數（不看否定）
+        self.neg_count = neg_count
+        self.exclamations = exclamations
+        self.topic_bits = topic_bits
+        self.keyword_ids = keyword_ids    # 情緒詞/emoji token 的 id，依出現順序、含重複
+        self.tokens = tokens
+
+    def topics(self, names: Dict[str, str]) -> List[str]:
+        """主題旗標 → 顯示名稱（names：類別 → 名稱）"""
+        return [names[cat] for cat, flag in TOPIC_FLAGS if self.topic_bits & flag]
+
+
+def score_tokens(tokens: Iterable[str], table: TokenTable) -> TokenScore:
+    """
+    一趟走完 tokens：
+    - 詞典分數：正/負/emoji 權重 ×（前一個是否定詞則反向）×（前一個是強/弱程度詞則 1.5/1.2），
+      加上驚嘆號（0.1/個，最多 0.3），再除以 命中數×1.5 正規化到 [-1, 1]
+    - 正負詞個數、主題旗標、關鍵詞 id
+    """
+    ids_get = table.ids.get
+    flags, weights = table.flags, table.weights
+    keyword_ids = array("I")
+    score = 0.0
+    hits = pos_hits = neg_hits = pos_count = neg_count = exclam = topic_bits = n = 0
+    prev = 0   # 前一個 token 的旗標
+
+    for w in tokens:
+        n += 1
+        i = ids_get(w)
+        if i is None:
+            prev = 0
+            continue
+        f = flags[i]
+        topic_bits |= f
+        if f & EXCLAMATION:
+            exclam += 1
+        if f & POLAR:
+            keyword_ids.append(i)
+            if f & POSITIVE:
+                pos_count += 1
+            if f & NEGATIVE:
+                neg_count += 1
+            base = weights[i]
+            if prev & NEGATION:
+                base *= -1.0
+            modifier = 1.0
+            if prev & STRONG:
+                modifier *= 1.5
+            elif prev & WEAK:
+                modifier *= 1.2
+            score += base * modifier
+            hits += 1
+            if base > 0:
+                pos_hits += 1
+            elif base < 0:
+                neg_hits += 1
+        prev = f
+
+    score += min(0.3, exclam * 0.1)
+    if hits == 0:
+        lex_s, pos_hits, neg_hits = 0.0, 0, 0
+    else:
+        lex_s = max(-1.0, min(1.0, score / (hits * 1.5)))
+    return TokenScore(lex_s, pos_hits, neg_hits, pos_count, neg_count, exclam,
+                      topic_bits & _TOPIC_MASK, keyword_ids, n)
+